@@ -1,6 +1,20 @@
+from decouple import config
 from django.apps import AppConfig
 
 
 class DocumentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'document'
+
+    def ready(self):
+        # Load the classifier (and precompute label vectors) before the first upload arrives
+        if config('CLASSIFIER_PRELOAD', default=False, cast=bool):
+            from .categories import CUSTOM_DOCUMENT_CATEGORIES, DOCUMENT_CATEGORIES
+            from .classifiers import warm_up
+
+            warm_up([DOCUMENT_CATEGORIES, CUSTOM_DOCUMENT_CATEGORIES])
+        # Spawn the PDF parsing processes at startup instead of inside the first upload request
+        if config('PDF_POOL_PRELOAD', default=False, cast=bool):
+            from .extraction import extraction_pool
+
+            extraction_pool.start()
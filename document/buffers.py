@@ -0,0 +1,47 @@
+import io
+import tempfile
+
+from decouple import config
+
+# Uploads and downloads up to this size stay in memory; larger ones go to a temporary file
+UPLOAD_MEMORY_MAX_BYTES = config('UPLOAD_MEMORY_MAX_BYTES', default=5 * 1024 * 1024, cast=int)
+
+
+def spooled_buffer():
+    """Binary buffer kept in memory until it grows past UPLOAD_MEMORY_MAX_BYTES; deleted on close."""
+    return tempfile.SpooledTemporaryFile(max_size=UPLOAD_MEMORY_MAX_BYTES, mode='w+b')
+
+
+class UploadBuffer:
+    """
+    Bytes of an upload, read by several pipeline stages (extraction, Drive upload)
+    without copying them to disk again: small uploads are shared from memory and
+    every stage gets its own reader, large ones are read from the file Django
+    already spooled to disk.
+    """
+
+    def __init__(self, uploaded_file):
+        self.name = uploaded_file.name
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            self._path = uploaded_file.temporary_file_path()
+            self._data = None
+        else:
+            self._path = None
+            uploaded_file.seek(0)
+            self._data = uploaded_file.read()
+
+    def reader(self):
+        """A path for disk-backed uploads, otherwise a fresh in-memory reader over the shared bytes."""
+        if self._path is not None:
+            return self._path
+        # BytesIO shares the bytes object until it is written to: no copy per reader
+        return io.BytesIO(self._data)
+
+    def close(self):
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,77 @@
+"""
+Document category taxonomies shared by the classifiers and the manager-routing model.
+Kept free of Django/ML imports so the standalone RL scripts can use it too.
+"""
+
+# Predefined categories
+DOCUMENT_CATEGORIES = ["report", "contract", "invoice", "day-off"]
+
+CUSTOM_DOCUMENT_CATEGORIES = [
+    "Documentation", "Design", "Proposal", "Memo", "Agreement", "Receipt", "Letter",
+    "Manual", "Presentation", "Email", "Resume", "Minutes", "Checklist", "Policy", "Procedure",
+    "Research Paper", "Whitepaper", "Guideline", "Testimonial", "Certificate", "Order",
+    "SOW (Statement of Work)", "Project Plan", "Budget", "Financial Statement", "Contract Amendment",
+    "Project Update", "Job Description", "Non-disclosure Agreement (NDA)", "Tender", "Legal Notice",
+    "Patent", "Press Release", "Event Flyer", "Newsletter", "Statement", "Application Form", "Transcript",
+    "Report Summary", "Project Charter", "Presentation Slides", "Terms and Conditions", "Agreement Addendum",
+    "Purchase Order", "Order Confirmation", "Business Letter", "Letter of Intent", "Internal Memo",
+    "Customer Feedback", "Work Order", "Audit Report", "Risk Assessment", "Compliance Report", "Tax Report",
+    "Logistics Report", "Contract Proposal", "Employee Handbook", "Employee Onboarding", "Training Materials",
+    "Sales Proposal", "Marketing Plan", "Client Brief", "Service Level Agreement (SLA)", "Product Specification",
+    "Performance Review", "Meeting Agenda", "Product Roadmap", "Change Request", "Job Application",
+    "Exit Interview", "Workplace Safety Plan", "Employee Evaluation", "Supplier Agreement", "Project Budget",
+    "Supplier Invoice", "Asset Management", "Health & Safety Report", "Vendor Contract", "Technical Documentation",
+    "Patent Application", "Purchase Requisition", "Event Proposal", "Business Continuity Plan", "Strategic Plan",
+    "Legal Brief", "Customer Agreement", "Travel Request", "Expense Report", "Software Release Notes",
+    "Audit Trail", "Project Milestones", "Service Report", "IT Incident Report", "Support Ticket",
+    "Client Feedback", "Team Meeting Notes", "Employee Benefits Guide", "Operational Plan",
+    "Board Meeting Minutes", "Company Newsletter", "Product Review", "Service Agreement", "Customer Service Log",
+    "Communication Plan", "Leadership Brief", "Marketing Report", "Team Performance Report",
+    "Crisis Management Plan",
+]
+
+# Categories known to the PPO routing model, in the order of its observation space
+ROUTING_CATEGORIES = ["day-off", "report", "invoice"] + CUSTOM_DOCUMENT_CATEGORIES
+
+categories_map = {category: state for state, category in enumerate(ROUTING_CATEGORIES)}
+
+# Coarse groups over the custom taxonomy, used by the hierarchical classifier:
+# a document is first matched to a group, then only that group's labels are scored.
+CATEGORY_GROUPS = {
+    "human resources": [
+        "Resume", "Job Description", "Employee Handbook", "Employee Onboarding", "Training Materials",
+        "Performance Review", "Job Application", "Exit Interview", "Employee Evaluation",
+        "Employee Benefits Guide", "Team Performance Report", "Workplace Safety Plan", "Health & Safety Report",
+        "Certificate", "Application Form", "Transcript", "Policy", "Procedure", "Guideline",
+    ],
+    "finance and accounting": [
+        "Receipt", "Budget", "Financial Statement", "Purchase Order", "Order Confirmation", "Tax Report",
+        "Supplier Invoice", "Purchase Requisition", "Expense Report", "Project Budget", "Asset Management",
+        "Statement", "Order", "Work Order", "Travel Request", "Audit Report", "Audit Trail", "Compliance Report",
+    ],
+    "legal and contracts": [
+        "Agreement", "SOW (Statement of Work)", "Contract Amendment", "Non-disclosure Agreement (NDA)", "Tender",
+        "Legal Notice", "Patent", "Terms and Conditions", "Agreement Addendum", "Letter of Intent",
+        "Contract Proposal", "Service Level Agreement (SLA)", "Supplier Agreement", "Vendor Contract",
+        "Patent Application", "Legal Brief", "Customer Agreement", "Service Agreement",
+    ],
+    "project and operations management": [
+        "Project Plan", "Project Update", "Project Charter", "Change Request", "Project Milestones",
+        "Operational Plan", "Strategic Plan", "Business Continuity Plan", "Crisis Management Plan",
+        "Risk Assessment", "Logistics Report", "Service Report", "Product Roadmap", "Checklist",
+    ],
+    "internal and external communications": [
+        "Memo", "Letter", "Email", "Minutes", "Press Release", "Event Flyer", "Newsletter", "Business Letter",
+        "Internal Memo", "Meeting Agenda", "Team Meeting Notes", "Board Meeting Minutes", "Company Newsletter",
+        "Communication Plan", "Leadership Brief", "Presentation", "Presentation Slides", "Report Summary",
+        "Event Proposal",
+    ],
+    "sales, marketing and customers": [
+        "Proposal", "Sales Proposal", "Marketing Plan", "Client Brief", "Customer Feedback", "Client Feedback",
+        "Product Review", "Customer Service Log", "Marketing Report", "Testimonial",
+    ],
+    "technical and research": [
+        "Documentation", "Design", "Manual", "Research Paper", "Whitepaper", "Technical Documentation",
+        "Product Specification", "Software Release Notes", "IT Incident Report", "Support Ticket",
+    ],
+}
@@ -0,0 +1,230 @@
+import threading
+
+import numpy as np
+from decouple import config
+from transformers import AutoModel, AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+from .categories import CATEGORY_GROUPS
+from .model_registry import registry
+
+# Which engine classifies uploads: "zero-shot" (BART-MNLI), "embedding" or "hierarchical"
+CLASSIFIER_ENGINE = config('CLASSIFIER_ENGINE', default='zero-shot')
+# Hub id or local directory of the NLI model
+ZERO_SHOT_MODEL = config('ZERO_SHOT_MODEL', default='facebook/bart-large-mnli')
+# Zero-shot inference backend: "fp32" or "int8" (dynamic quantization of the Linear layers, CPU only)
+CLASSIFIER_BACKEND = config('CLASSIFIER_BACKEND', default='fp32')
+# Never reach the Hugging Face hub: models must already be in the cache or in a local directory
+MODEL_LOCAL_FILES_ONLY = config('MODEL_LOCAL_FILES_ONLY', default=False, cast=bool)
+EMBEDDING_MODEL = config('EMBEDDING_MODEL', default='sentence-transformers/all-MiniLM-L6-v2')
+EMBEDDING_MAX_TOKENS = config('EMBEDDING_MAX_TOKENS', default=512, cast=int)
+EMBEDDING_BATCH_SIZE = config('EMBEDDING_BATCH_SIZE', default=16, cast=int)
+# Number of (text, label) pairs scored per forward pass in zero-shot classification
+CLASSIFIER_BATCH_SIZE = config('CLASSIFIER_BATCH_SIZE', default=16, cast=int)
+# Groups kept after the coarse stage of the hierarchical engine
+HIERARCHICAL_TOP_GROUPS = config('HIERARCHICAL_TOP_GROUPS', default=1, cast=int)
+# Phrase embedded for each label, mirroring the zero-shot hypothesis template
+LABEL_TEMPLATE = "This document is a {}."
+
+
+CLASSIFIER_BACKENDS = ('fp32', 'int8')
+
+
+def load_zero_shot_pipeline(backend=CLASSIFIER_BACKEND, model_name=ZERO_SHOT_MODEL):
+    """
+    Builds the zero-shot pipeline on CPU. With the "int8" backend the Linear layers,
+    which hold almost all of BART's weights, are dynamically quantized: weights are
+    stored as int8 and activations are quantized on the fly at inference time.
+    """
+    if backend not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Unknown classifier backend: {backend}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=MODEL_LOCAL_FILES_ONLY)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, local_files_only=MODEL_LOCAL_FILES_ONLY)
+    model.eval()
+
+    if backend == 'int8':
+        import torch
+
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer, device=-1)
+
+
+def _load_zero_shot():
+    return load_zero_shot_pipeline(CLASSIFIER_BACKEND)
+
+
+def _load_embedder():
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL, local_files_only=MODEL_LOCAL_FILES_ONLY)
+    model = AutoModel.from_pretrained(EMBEDDING_MODEL, local_files_only=MODEL_LOCAL_FILES_ONLY)
+    model.eval()
+    return TextEmbedder(tokenizer, model)
+
+
+class TextEmbedder:
+    """Mean-pooled, L2-normalised sentence embeddings from a Hugging Face encoder."""
+
+    def __init__(self, tokenizer, model):
+        self.tokenizer = tokenizer
+        self.model = model
+
+    def embed(self, texts):
+        import torch
+
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+            encoded = self.tokenizer(
+                batch, padding=True, truncation=True, max_length=EMBEDDING_MAX_TOKENS, return_tensors='pt'
+            )
+            with torch.no_grad():
+                output = self.model(**encoded).last_hidden_state
+            mask = encoded['attention_mask'].unsqueeze(-1).to(output.dtype)
+            pooled = (output * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            vectors.append(pooled.numpy())
+
+        matrix = np.vstack(vectors).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+registry.register('zero-shot-classifier', _load_zero_shot)
+registry.register('text-embedder', _load_embedder)
+
+
+class ZeroShotClassifier:
+    """BART-MNLI zero-shot classification: one NLI forward pass per (document, label) pair."""
+    name = 'zero-shot'
+
+    def classify(self, texts, labels):
+        classifier = registry.get('zero-shot-classifier')
+        results = classifier(list(texts), candidate_labels=list(labels), batch_size=CLASSIFIER_BATCH_SIZE)
+        if isinstance(results, dict):
+            results = [results]
+        return [result['labels'][0] for result in results]
+
+    def forward_passes(self, text_count, labels):
+        return text_count * len(labels)
+
+
+class EmbeddingClassifier:
+    """
+    Embeds each document once and scores it against label embeddings computed
+    once per taxonomy, using a single matrix product for cosine similarity.
+    """
+    name = 'embedding'
+
+    def __init__(self):
+        self._label_matrices = {}
+        self._lock = threading.Lock()
+
+    def label_matrix(self, labels):
+        key = tuple(labels)
+        matrix = self._label_matrices.get(key)
+        if matrix is None:
+            with self._lock:
+                matrix = self._label_matrices.get(key)
+                if matrix is None:
+                    embedder = registry.get('text-embedder')
+                    matrix = embedder.embed([LABEL_TEMPLATE.format(label) for label in labels])
+                    self._label_matrices[key] = matrix
+        return matrix
+
+    def scores(self, texts, labels):
+        label_matrix = self.label_matrix(labels)
+        document_matrix = registry.get('text-embedder').embed(list(texts))
+        return document_matrix @ label_matrix.T
+
+    def classify(self, texts, labels):
+        best = np.argmax(self.scores(texts, labels), axis=1)
+        return [labels[index] for index in best]
+
+    def forward_passes(self, text_count, labels):
+        # Label vectors are precomputed, so only the documents go through the encoder
+        return text_count
+
+
+class HierarchicalClassifier:
+    """
+    Coarse-to-fine zero-shot classification over CATEGORY_GROUPS: the document is
+    scored against the group names first, then only against the labels of the best
+    group(s). Taxonomies that are not fully covered by the groups are classified flat.
+    """
+    name = 'hierarchical'
+
+    def __init__(self, groups, top_groups):
+        self.groups = groups
+        self.top_groups = top_groups
+        self._flat = ZeroShotClassifier()
+
+    def _groups_for(self, labels):
+        label_set = set(labels)
+        groups = {
+            group: [label for label in group_labels if label in label_set]
+            for group, group_labels in self.groups.items()
+        }
+        groups = {group: group_labels for group, group_labels in groups.items() if group_labels}
+        covered = {label for group_labels in groups.values() for label in group_labels}
+        return groups if covered == label_set and len(groups) > 1 else None
+
+    def classify(self, texts, labels):
+        texts = list(texts)
+        groups = self._groups_for(labels)
+        if groups is None:
+            return self._flat.classify(texts, labels)
+
+        classifier = registry.get('zero-shot-classifier')
+        coarse = classifier(texts, candidate_labels=list(groups), batch_size=CLASSIFIER_BATCH_SIZE)
+        if isinstance(coarse, dict):
+            coarse = [coarse]
+
+        # Batch the fine stage per candidate label set so each set is scored in one call
+        pending = {}
+        for index, result in enumerate(coarse):
+            candidates = tuple(
+                label for group in result['labels'][:self.top_groups] for label in groups[group]
+            )
+            pending.setdefault(candidates, []).append(index)
+
+        predictions = [None] * len(texts)
+        for candidates, indexes in pending.items():
+            if len(candidates) == 1:
+                for index in indexes:
+                    predictions[index] = candidates[0]
+                continue
+            fine = self._flat.classify([texts[index] for index in indexes], list(candidates))
+            for index, label in zip(indexes, fine):
+                predictions[index] = label
+        return predictions
+
+    def forward_passes(self, text_count, labels):
+        groups = self._groups_for(labels)
+        if groups is None:
+            return self._flat.forward_passes(text_count, labels)
+        mean_group_size = sum(len(group_labels) for group_labels in groups.values()) / len(groups)
+        return text_count * round(len(groups) + self.top_groups * mean_group_size)
+
+
+ENGINES = {
+    ZeroShotClassifier.name: ZeroShotClassifier(),
+    EmbeddingClassifier.name: EmbeddingClassifier(),
+    HierarchicalClassifier.name: HierarchicalClassifier(CATEGORY_GROUPS, HIERARCHICAL_TOP_GROUPS),
+}
+
+
+def get_classifier(name=None):
+    name = name or CLASSIFIER_ENGINE
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown classifier engine: {name}")
+
+
+def warm_up(taxonomies):
+    """Loads the configured engine and precomputes label vectors for the given taxonomies."""
+    engine = get_classifier()
+    if isinstance(engine, EmbeddingClassifier):
+        for labels in taxonomies:
+            engine.label_matrix(labels)
+    else:
+        registry.get('zero-shot-classifier')
@@ -0,0 +1,140 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import httplib2
+from decouple import config
+from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp, Request
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from .metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/drive']
+SERVICE_ACCOUNT_FILE = os.path.join(os.path.dirname(__file__), 'service-account.json')
+# Drive transport: per-socket-operation timeout
+DRIVE_SOCKET_TIMEOUT = config('DRIVE_SOCKET_TIMEOUT', default=30.0, cast=float)
+# The access token is refreshed this long before it expires, never in the middle of a call
+DRIVE_TOKEN_REFRESH_MARGIN = config('DRIVE_TOKEN_REFRESH_MARGIN', default=300, cast=int)
+
+
+class DriveClientFactory:
+    """
+    Per-process Drive client: the service-account credentials and the discovery
+    document are loaded once, the access token is refreshed ahead of expiry by a
+    single thread, and each thread gets its own service and HTTP transport
+    (httplib2 connections are not thread-safe).
+    """
+
+    def __init__(self, service_account_file=SERVICE_ACCOUNT_FILE, scopes=SCOPES, timeout=DRIVE_SOCKET_TIMEOUT,
+                 refresh_margin=DRIVE_TOKEN_REFRESH_MARGIN):
+        self.service_account_file = service_account_file
+        self.scopes = scopes
+        self.timeout = timeout
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._credentials = None
+        self._discovery = None
+        self.construction = {
+            'credentials': LatencyHistogram(),
+            'discovery': LatencyHistogram(),
+            'service': LatencyHistogram(),
+            'token_refresh': LatencyHistogram(),
+        }
+        self._calls = {}
+        self.services_built = 0
+
+    def _load(self):
+        if self._credentials is not None and self._discovery is not None:
+            return
+        with self._lock:
+            if self._credentials is None:
+                started = time.perf_counter()
+                self._credentials = service_account.Credentials.from_service_account_file(
+                    self.service_account_file, scopes=self.scopes
+                )
+                self.construction['credentials'].observe(time.perf_counter() - started)
+            if self._discovery is None:
+                started = time.perf_counter()
+                self._discovery = self._load_discovery()
+                self.construction['discovery'].observe(time.perf_counter() - started)
+
+    def _load_discovery(self):
+        # The discovery document ships with google-api-python-client; fetch it only if it does not
+        document = get_static_doc('drive', 'v3')
+        if document is not None:
+            return json.loads(document)
+        logger.warning("No bundled Drive discovery document, fetching it once")
+        service = build('drive', 'v3', http=httplib2.Http(timeout=self.timeout), cache_discovery=False)
+        return service._rootDesc
+
+    def _utcnow(self):
+        # google-auth keeps expiry as a naive UTC datetime
+        return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    def _needs_refresh(self):
+        credentials = self._credentials
+        return (
+            not credentials.token
+            or credentials.expiry is None
+            or credentials.expiry - self._utcnow() <= self.refresh_margin
+        )
+
+    def _refresh_token(self):
+        if not self._needs_refresh():
+            return
+        with self._lock:
+            # Another thread may have refreshed while this one waited for the lock
+            if not self._needs_refresh():
+                return
+            started = time.perf_counter()
+            self._credentials.refresh(Request(httplib2.Http(timeout=self.timeout)))
+            self.construction['token_refresh'].observe(time.perf_counter() - started)
+
+    def service(self):
+        """The Drive service of the calling thread, with a valid access token."""
+        self._load()
+        self._refresh_token()
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            started = time.perf_counter()
+            http = AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=self.timeout))
+            service = build_from_document(self._discovery, http=http)
+            self._local.service = service
+            self.construction['service'].observe(time.perf_counter() - started)
+            with self._lock:
+                self.services_built += 1
+        return service
+
+    @contextmanager
+    def timed(self, operation):
+        """Records the latency of one Drive call (or chunked transfer) under `operation`."""
+        histogram = self._calls.get(operation)
+        if histogram is None:
+            with self._lock:
+                histogram = self._calls.setdefault(operation, LatencyHistogram())
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    def stats(self):
+        credentials = self._credentials
+        return {
+            "services_built": self.services_built,
+            "token_expiry": credentials.expiry.isoformat() if credentials is not None and credentials.expiry else None,
+            "construction": {name: histogram.snapshot() for name, histogram in self.construction.items()},
+            "calls": {name: histogram.snapshot() for name, histogram in list(self._calls.items())},
+        }
+
+
+drive_client = DriveClientFactory()
@@ -0,0 +1,566 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+import PyPDF2
+from decouple import config
+
+from .text_prep import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Number of extracted texts kept per worker process
+TEXT_CACHE_SIZE = config('TEXT_CACHE_SIZE', default=32, cast=int)
+HASH_CHUNK_SIZE = 1024 * 1024
+# Preferred extractor, then the ones tried in order when it cannot parse a file
+PDF_EXTRACTOR = config('PDF_EXTRACTOR', default='pdfium')
+PDF_EXTRACTOR_FALLBACKS = config('PDF_EXTRACTOR_FALLBACKS', default='pypdf2,pdfplumber')
+# Processes parsing PDFs outside the GIL, per web/worker process (so keep it small); 0 parses in the calling thread
+PDF_PROCESS_WORKERS = config('PDF_PROCESS_WORKERS', default=2, cast=int)
+# Files of at least this size are split in page ranges extracted by several processes
+PDF_SPLIT_MIN_BYTES = config('PDF_SPLIT_MIN_BYTES', default=2 * 1024 * 1024, cast=int)
+PDF_SPLIT_PAGES = config('PDF_SPLIT_PAGES', default=32, cast=int)
+# Reading stops after this many pages or this much extracted text (UTF-8 bytes); 0 disables a cap
+PDF_MAX_PAGES = config('PDF_MAX_PAGES', default=500, cast=int)
+PDF_MAX_TEXT_BYTES = config('PDF_MAX_TEXT_BYTES', default=8 * 1024 * 1024, cast=int)
+
+
+@dataclass(frozen=True)
+class ExtractedText:
+    """Text of an uploaded PDF, computed once and shared by every pipeline stage."""
+    content_hash: str
+    text: str
+    # Pages actually read; fewer than the document has when `truncated`
+    page_count: int
+    # Offset in `text` where each page read ends
+    page_ends: tuple = ()
+    truncated: bool = False
+
+    def prefix(self, tokens):
+        """Leading whole pages holding at least `tokens` tokens (the full text for shorter documents)."""
+        if not tokens:
+            return self.text
+        start = 0
+        for end in self.page_ends:
+            tokens -= count_tokens(self.text[start:end])
+            start = end
+            if tokens <= 0:
+                return self.text[:end]
+        return self.text
+
+
+class ExtractedTextCache:
+    """Thread-safe LRU of extracted texts keyed by the SHA-256 of the PDF bytes."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, content_hash):
+        with self._lock:
+            artifact = self._entries.get(content_hash)
+            if artifact is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(content_hash)
+            self.hits += 1
+            return artifact
+
+    def put(self, artifact):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[artifact.content_hash] = artifact
+            self._entries.move_to_end(artifact.content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+text_cache = ExtractedTextCache(TEXT_CACHE_SIZE)
+
+
+def hash_file(pdf_file):
+    """SHA-256 of a file given by path or binary file object (position is restored)."""
+    digest = hashlib.sha256()
+    if hasattr(pdf_file, 'read'):
+        position = pdf_file.tell()
+        for chunk in iter(lambda: pdf_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        pdf_file.seek(position)
+    else:
+        with open(pdf_file, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PdfExtractor:
+    """Base of the extractors: `iter_pages` yields the text of pages [start, stop) in order."""
+
+    name = None
+
+    def page_count(self, pdf_file):
+        raise NotImplementedError
+
+    def iter_pages(self, pdf_file, start=0, stop=None):
+        raise NotImplementedError
+
+    def extract(self, pdf_file):
+        texts = list(self.iter_pages(pdf_file))
+        # Collect the pages and join once instead of growing a string page by page
+        return "".join(texts), len(texts)
+
+
+class PyPDF2Extractor(PdfExtractor):
+    """Pure-Python parser; slow on large or image-heavy files but tolerant of odd encodings."""
+
+    name = 'pypdf2'
+
+    def page_count(self, pdf_file):
+        return len(PyPDF2.PdfReader(pdf_file).pages)
+
+    def iter_pages(self, pdf_file, start=0, stop=None):
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        for page in pdf_reader.pages[start:stop]:
+            yield page.extract_text() or ""
+
+
+class PdfiumExtractor(PdfExtractor):
+    """PDFium (the Chrome PDF engine) through pypdfium2; the fast path."""
+
+    name = 'pdfium'
+
+    def page_count(self, pdf_file):
+        import pypdfium2 as pdfium
+
+        document = pdfium.PdfDocument(pdf_file)
+        try:
+            return len(document)
+        finally:
+            document.close()
+
+    def iter_pages(self, pdf_file, start=0, stop=None):
+        import pypdfium2 as pdfium
+
+        document = pdfium.PdfDocument(pdf_file)
+        try:
+            for index in range(*slice(start, stop).indices(len(document))):
+                page = document[index]
+                text_page = page.get_textpage()
+                try:
+                    yield text_page.get_text_range()
+                finally:
+                    text_page.close()
+                    page.close()
+        finally:
+            document.close()
+
+
+class PdfplumberExtractor(PdfExtractor):
+    """pdfminer-based layout analysis; slowest, but keeps the reading order of columns and tables."""
+
+    name = 'pdfplumber'
+
+    def page_count(self, pdf_file):
+        import pdfplumber
+
+        with pdfplumber.open(pdf_file) as pdf:
+            return len(pdf.pages)
+
+    def iter_pages(self, pdf_file, start=0, stop=None):
+        import pdfplumber
+
+        with pdfplumber.open(pdf_file) as pdf:
+            for page in pdf.pages[start:stop]:
+                yield page.extract_text() or ""
+                # Drop the parsed layout objects of the page as soon as its text is read
+                page.close()
+
+
+EXTRACTORS = {
+    PdfiumExtractor.name: PdfiumExtractor(),
+    PyPDF2Extractor.name: PyPDF2Extractor(),
+    PdfplumberExtractor.name: PdfplumberExtractor(),
+}
+
+
+def get_extractor(name):
+    try:
+        return EXTRACTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown PDF extractor: {name}")
+
+
+def extractor_chain(preferred=None):
+    names = [preferred or PDF_EXTRACTOR]
+    names += [name.strip() for name in PDF_EXTRACTOR_FALLBACKS.split(',') if name.strip()]
+    # Keep the order, drop duplicates (the preferred extractor may also be listed as a fallback)
+    return [get_extractor(name) for name in dict.fromkeys(names)]
+
+
+class _ExtractionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.extracted = {}
+        self.failures = {}
+        self.fallbacks = 0
+
+    def record(self, extractor_name, succeeded, fell_back=False):
+        with self._lock:
+            counters = self.extracted if succeeded else self.failures
+            counters[extractor_name] = counters.get(extractor_name, 0) + 1
+            self.fallbacks += int(fell_back)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "preferred": PDF_EXTRACTOR,
+                "extracted": dict(self.extracted),
+                "failures": dict(self.failures),
+                "fallbacks": self.fallbacks,
+            }
+
+
+extraction_stats = _ExtractionStats()
+
+
+def _take_within(pages, max_bytes):
+    """Page texts from `pages` until their UTF-8 size would exceed `max_bytes` (0: no cap)."""
+    texts = []
+    size = 0
+    for text in pages:
+        size += len(text.encode('utf-8'))
+        if max_bytes and size > max_bytes:
+            break
+        texts.append(text)
+    return texts
+
+
+def _extract_pages(pdf_file, start=0, stop=None, extractor=None, max_bytes=0):
+    """
+    Page texts of [start, stop) from the first extractor of the chain able to
+    parse the file. Returns (extractor used or None, [(failed extractor, error)], texts).
+    """
+    position = pdf_file.tell() if hasattr(pdf_file, 'read') else None
+    failed = []
+    for candidate in extractor_chain(extractor):
+        if position is not None:
+            pdf_file.seek(position)
+        try:
+            return candidate.name, failed, _take_within(candidate.iter_pages(pdf_file, start, stop), max_bytes)
+        except Exception as e:
+            failed.append((candidate.name, str(e)))
+    return None, failed, None
+
+
+def _iter_pages_in_thread(pdf_file, stop=None, extractor=None, start=0):
+    """
+    Yields page texts one at a time from page `start`. When an extractor fails
+    part-way, the next one of the chain resumes from the first page not yielded yet.
+    """
+    position = pdf_file.tell() if hasattr(pdf_file, 'read') else None
+    failed = []
+    index = start
+    for candidate in extractor_chain(extractor):
+        if position is not None:
+            pdf_file.seek(position)
+        try:
+            for text in candidate.iter_pages(pdf_file, index, stop):
+                index += 1
+                yield text
+        except GeneratorExit:
+            # The consumer stopped reading early
+            _record_extraction(candidate.name, failed)
+            raise
+        except Exception as e:
+            failed.append((candidate.name, str(e)))
+            continue
+        _record_extraction(candidate.name, failed)
+        return
+    _record_extraction(None, failed)
+
+
+def _count_pages(path, extractor=None):
+    for candidate in extractor_chain(extractor):
+        try:
+            return candidate.page_count(path)
+        except Exception:
+            continue
+    return None
+
+
+def _record_extraction(used, failed):
+    for name, error in failed:
+        logger.warning("%s could not parse the PDF (%s), trying the next extractor", name, error)
+        extraction_stats.record(name, succeeded=False)
+    if used is None:
+        raise ValueError(
+            "No PDF extractor could parse the file: " + "; ".join(f"{name}: {error}" for name, error in failed)
+        )
+    extraction_stats.record(used, succeeded=True, fell_back=bool(failed))
+
+
+def _warm_worker():
+    # Pay the import cost of the parsers once per process, not on the first upload
+    for module in ('pypdfium2', 'pdfplumber'):
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+class ExtractionPool:
+    """
+    Bounded pool of processes parsing PDFs outside the GIL. Large files are split
+    in page ranges so one document can use several cores; page texts are yielded
+    in order as soon as the range holding them is done.
+    """
+
+    def __init__(self, size, split_min_bytes=PDF_SPLIT_MIN_BYTES, split_pages=PDF_SPLIT_PAGES):
+        self.size = size
+        self.split_min_bytes = split_min_bytes
+        self.split_pages = split_pages
+        self._executor = None
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.split_documents = 0
+        self.ranges = 0
+        self.restarts = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that already runs threads (web server, workers) is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_warm_worker,
+                )
+            return self._executor
+
+    def start(self):
+        """Starts and warms every worker process up front (one task per worker)."""
+        if not self.enabled:
+            return
+        executor = self._get_executor()
+        for future in [executor.submit(_worker_pid) for _ in range(self.size)]:
+            future.result()
+
+    def restart(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.restarts += 1
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _ranges(self, executor, path, extractor, max_pages):
+        if os.path.getsize(path) < self.split_min_bytes:
+            return [(0, max_pages or None)]
+        page_count = executor.submit(_count_pages, path, extractor).result()
+        if not page_count:
+            return [(0, max_pages or None)]
+        if max_pages:
+            page_count = min(page_count, max_pages)
+        if page_count <= self.split_pages:
+            return [(0, page_count)]
+        return [(start, min(start + self.split_pages, page_count)) for start in range(0, page_count, self.split_pages)]
+
+    def iter_pages(self, path, extractor=None, max_pages=0, max_bytes=0):
+        executor = self._get_executor()
+        ranges = self._ranges(executor, path, extractor, max_pages)
+        with self._lock:
+            self.documents += 1
+            self.split_documents += int(len(ranges) > 1)
+            self.ranges += len(ranges)
+
+        futures = [
+            executor.submit(_extract_pages, path, start, stop, extractor, max_bytes) for start, stop in ranges
+        ]
+        try:
+            for (start, stop), future in zip(ranges, futures):
+                used, failed, texts = future.result()
+                _record_extraction(used, failed)
+                yield from texts
+                if stop is not None and len(texts) < stop - start:
+                    # The range was cut by the byte cap; later ranges would leave a gap
+                    return
+        finally:
+            # Nothing left to do for the ranges of an abandoned or failed document
+            for future in futures:
+                future.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.size,
+                "started": self._executor is not None,
+                "documents": self.documents,
+                "split_documents": self.split_documents,
+                "ranges": self.ranges,
+                "restarts": self.restarts,
+            }
+
+
+extraction_pool = ExtractionPool(PDF_PROCESS_WORKERS)
+
+
+def iter_pdf_pages(pdf_file, extractor=None, max_pages=0, max_bytes=0):
+    """
+    Yields the text of each page in order. Files on disk are parsed by the process
+    pool; file objects (which cannot be sent to another process) in this thread.
+    `max_pages`/`max_bytes` only bound the work done ahead of the consumer.
+    """
+    yielded = 0
+    if extraction_pool.enabled and isinstance(pdf_file, (str, os.PathLike)):
+        try:
+            for text in extraction_pool.iter_pages(pdf_file, extractor, max_pages, max_bytes):
+                yielded += 1
+                yield text
+            return
+        except BrokenProcessPool:
+            # A worker died (e.g. killed while parsing); parse the rest here and start a fresh pool next time
+            logger.exception("PDF extraction pool broken, extracting in the calling thread from page %s", yielded)
+            extraction_pool.restart()
+    yield from _iter_pages_in_thread(pdf_file, max_pages or None, extractor, start=yielded)
+
+
+class PageStream:
+    """
+    Reads the pages of a PDF lazily, stopping at `max_pages` pages or `max_bytes`
+    bytes of text. Iterating yields page texts; what was read is kept for `text`.
+    """
+
+    def __init__(self, pdf_file, extractor=None, max_pages=PDF_MAX_PAGES, max_bytes=PDF_MAX_TEXT_BYTES):
+        self.pdf_file = pdf_file
+        self.extractor = extractor
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.pages = []
+        self.size_bytes = 0
+        self.truncated = False
+
+    def __iter__(self):
+        # One page past the cap tells whether the document was cut
+        read_ahead = self.max_pages + 1 if self.max_pages else 0
+        pages = iter_pdf_pages(self.pdf_file, self.extractor, read_ahead, self.max_bytes)
+        try:
+            for text in pages:
+                size_bytes = len(text.encode('utf-8'))
+                if self.max_bytes and self.size_bytes + size_bytes > self.max_bytes:
+                    self.truncated = True
+                    return
+                self.pages.append(text)
+                self.size_bytes += size_bytes
+                yield text
+                if self.max_pages and len(self.pages) >= self.max_pages:
+                    self.truncated = self._has_more(pages)
+                    return
+        finally:
+            pages.close()
+
+    @staticmethod
+    def _has_more(pages):
+        try:
+            next(pages)
+        except StopIteration:
+            return False
+        return True
+
+    @property
+    def pages_read(self):
+        return len(self.pages)
+
+    @property
+    def text(self):
+        return "".join(self.pages)
+
+    def page_ends(self):
+        ends = []
+        end = 0
+        for text in self.pages:
+            end += len(text)
+            ends.append(end)
+        return tuple(ends)
+
+
+def extract_text_from_pdf(pdf_file, extractor=None):
+    stream = PageStream(pdf_file, extractor)
+    for _text in stream:
+        pass
+    return stream.text
+
+
+def get_extracted_text(pdf_file, on_prefix=None, prefix_tokens=0, content_hash=None):
+    """
+    Returns the ExtractedText for a PDF, parsing it only if the same bytes
+    have not been extracted recently by this process.
+
+    Pages are read one at a time within PDF_MAX_PAGES/PDF_MAX_TEXT_BYTES. When
+    `on_prefix` is given it is called once with `ExtractedText.prefix(prefix_tokens)`
+    as soon as enough pages are read, so a consumer that only needs the beginning
+    of the document (the classifier) can start before extraction finishes.
+    Pass `content_hash` when the caller already hashed the file.
+    """
+    content_hash = content_hash or hash_file(pdf_file)
+    artifact = text_cache.get(content_hash)
+    if artifact is not None:
+        if on_prefix is not None:
+            on_prefix(artifact.prefix(prefix_tokens))
+        return artifact
+
+    stream = PageStream(pdf_file)
+    prefix_tokens_left = prefix_tokens
+    prefix_sent = on_prefix is None
+    for text in stream:
+        if prefix_sent or not prefix_tokens:
+            continue
+        prefix_tokens_left -= count_tokens(text)
+        if prefix_tokens_left <= 0:
+            on_prefix(stream.text)
+            prefix_sent = True
+
+    artifact = ExtractedText(
+        content_hash=content_hash,
+        text=stream.text,
+        page_count=stream.pages_read,
+        page_ends=stream.page_ends(),
+        truncated=stream.truncated,
+    )
+    if artifact.truncated:
+        logger.warning(
+            "PDF %s truncated after %s pages (%s bytes of text)", content_hash[:12], stream.pages_read, stream.size_bytes
+        )
+    if not prefix_sent:
+        on_prefix(artifact.text)
+    text_cache.put(artifact)
+    return artifact
@@ -0,0 +1,217 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+FILE_CACHE_DIR = config('FILE_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'document-file-cache'))
+# Total size of the cached files on this node; 0 disables the cache
+FILE_CACHE_MAX_BYTES = config('FILE_CACHE_MAX_BYTES', default=2 * 1024 * 1024 * 1024, cast=int)
+# Also cache the bytes of every new upload, so that the manager's first open is a hit
+FILE_CACHE_ON_UPLOAD = config('FILE_CACHE_ON_UPLOAD', default=True, cast=bool)
+
+# Read size when a byte range of a cached file is served
+FILE_CACHE_READ_CHUNK_SIZE = 256 * 1024
+TEMP_SUFFIX = '.part'
+UNSAFE_KEY_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+
+
+class FileCache:
+    """
+    Node-local LRU directory of Drive files, keyed by Drive file id and checksum
+    (a file replaced on Drive gets a new key). Files are written under a temporary
+    name and renamed into place, and a hit bumps the file's mtime, so several
+    processes can share the directory; eviction removes the oldest mtimes until
+    the directory fits in max_bytes. Cache failures are logged and treated as
+    misses, never as download errors.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # Estimated directory size, recomputed on each eviction pass
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_written = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path(self, file_id, checksum):
+        key = UNSAFE_KEY_CHARS.sub('_', f"{file_id}-{checksum or 'unknown'}")
+        return os.path.join(self.directory, key)
+
+    def get(self, file_id, checksum, served_bytes=None):
+        """Path of the cached file, or None on a miss. `served_bytes` (default: the whole file) counts as saved."""
+        if not self.enabled or not file_id:
+            return None
+        path = self.path(file_id, checksum)
+        try:
+            size = os.path.getsize(path)
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size if served_bytes is None else served_bytes
+        return path
+
+    def _temp_path(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{uuid.uuid4().hex}{TEMP_SUFFIX}")
+
+    def _commit(self, temp_path, file_id, checksum):
+        size = os.path.getsize(temp_path)
+        if size > self.max_bytes:
+            os.unlink(temp_path)
+            return
+        os.replace(temp_path, self.path(file_id, checksum))
+        with self._lock:
+            self.bytes_written += size
+            if self._size is not None:
+                self._size += size
+            should_evict = self._size is None or self._size > self.max_bytes
+        if should_evict:
+            self.evict()
+
+    def put_file(self, file_id, checksum, source):
+        """Caches a file given by path or binary file object (copied from its start)."""
+        if not self.enabled or not file_id:
+            return
+        temp_path = None
+        try:
+            temp_path = self._temp_path()
+            if hasattr(source, 'read'):
+                source.seek(0)
+                with open(temp_path, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+            else:
+                shutil.copyfile(source, temp_path)
+            self._commit(temp_path, file_id, checksum)
+        except OSError:
+            logger.exception("File cache write failed")
+            if temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def tee(self, file_id, checksum, chunks):
+        """
+        Yields `chunks` unchanged while writing them to the cache; the file is only
+        added once every chunk went through (a client that disconnects early
+        leaves nothing behind).
+        """
+        if not self.enabled or not file_id:
+            yield from chunks
+            return
+        temp_path = target = None
+        try:
+            temp_path = self._temp_path()
+            target = open(temp_path, 'wb')
+        except OSError:
+            logger.exception("File cache write failed")
+        complete = False
+        try:
+            for chunk in chunks:
+                if target is not None:
+                    try:
+                        target.write(chunk)
+                    except OSError:
+                        logger.exception("File cache write failed")
+                        target.close()
+                        target = None
+                yield chunk
+            complete = True
+        finally:
+            if target is not None:
+                target.close()
+                try:
+                    if complete:
+                        self._commit(temp_path, file_id, checksum)
+                    else:
+                        os.unlink(temp_path)
+                except OSError:
+                    logger.exception("File cache write failed")
+            elif temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def evict(self):
+        """Deletes least recently used files until the directory fits in max_bytes."""
+        try:
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if not entry.is_file() or entry.name.endswith(TEMP_SUFFIX):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            evicted = evicted_bytes = 0
+            if total > self.max_bytes:
+                for _mtime, size, path in sorted(entries):
+                    if total <= self.max_bytes:
+                        break
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:  # Evicted by another process
+                        pass
+                    total -= size
+                    evicted += 1
+                    evicted_bytes += size
+        except OSError:
+            logger.exception("File cache eviction failed")
+            return 0
+
+        with self._lock:
+            self._size = total
+            self.evictions += evicted
+            self.evicted_bytes += evicted_bytes
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "directory": self.directory,
+                "max_bytes": self.max_bytes,
+                "size_bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "bytes_saved": self.bytes_saved,
+                "bytes_written": self.bytes_written,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+
+file_cache = FileCache(FILE_CACHE_DIR, FILE_CACHE_MAX_BYTES)
+
+
+def iter_range(file, first, last, chunk_size=FILE_CACHE_READ_CHUNK_SIZE):
+    """
+    Yields bytes `first`..`last` (inclusive) of an open local file, then closes it.
+    Taking the open file means a cache eviction after it was opened cannot cut the range short.
+    """
+    with file:
+        file.seek(first)
+        left = last - first + 1
+        while left > 0:
+            chunk = file.read(min(chunk_size, left))
+            if not chunk:
+                return
+            left -= len(chunk)
+            yield chunk
@@ -0,0 +1,155 @@
+import logging
+import random
+import threading
+import time
+
+import google.generativeai as genai
+from decouple import config
+from google.api_core import exceptions as google_exceptions
+
+from .metrics import LatencyHistogram
+from .resilience import remaining
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = config('GEMINI_MODEL', default='gemini-1.5-flash')
+GEMINI_REQUESTS_PER_MINUTE = config('GEMINI_REQUESTS_PER_MINUTE', default=60, cast=int)
+GEMINI_MAX_CONCURRENCY = config('GEMINI_MAX_CONCURRENCY', default=8, cast=int)
+GEMINI_MAX_RETRIES = config('GEMINI_MAX_RETRIES', default=4, cast=int)
+# Total time a single generate call may take, waits and retries included
+GEMINI_REQUEST_DEADLINE = config('GEMINI_REQUEST_DEADLINE', default=120.0, cast=float)
+GEMINI_BACKOFF_BASE = config('GEMINI_BACKOFF_BASE', default=1.0, cast=float)
+GEMINI_BACKOFF_MAX = config('GEMINI_BACKOFF_MAX', default=30.0, cast=float)
+
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+class RateLimiter:
+    """Token bucket allowing `per_minute` calls per minute with bursts of up to `burst` calls."""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or max(1, per_minute // 6))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                raise TimeoutError("Gemini rate limit: no request slot available before the deadline.")
+            time.sleep(wait)
+
+
+class GeminiClient:
+    """
+    Process-wide Gemini client: the API is configured once, GenerativeModel objects
+    (and their underlying transport) are reused, and every call goes through a
+    requests-per-minute limiter, a concurrency cap and a retry budget bounded by a deadline.
+    """
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE,
+                 max_concurrency=GEMINI_MAX_CONCURRENCY, max_retries=GEMINI_MAX_RETRIES,
+                 deadline=GEMINI_REQUEST_DEADLINE):
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self._models = {}
+        self._models_lock = threading.Lock()
+        self._limiter = RateLimiter(requests_per_minute)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._stats_lock = threading.Lock()
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def get_model(self, model_name=None):
+        model_name = model_name or self.model_name
+        model = self._models.get(model_name)
+        if model is None:
+            with self._models_lock:
+                model = self._models.setdefault(model_name, genai.GenerativeModel(model_name))
+        return model
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def generate_content(self, prompt, model_name=None, deadline=None):
+        # Never outlive the budget of the request/job this call is made for
+        deadline = remaining(deadline if deadline is not None else self.deadline)
+        deadline_at = time.monotonic() + deadline
+        model = self.get_model(model_name)
+        attempt = 0
+        while True:
+            self._limiter.acquire(deadline_at)
+            left = deadline_at - time.monotonic()
+            if left <= 0 or not self._slots.acquire(timeout=left):
+                raise TimeoutError("Gemini request deadline exceeded while waiting for a free slot.")
+
+            self._count('requests')
+            started = time.perf_counter()
+            try:
+                return model.generate_content(
+                    prompt, request_options={'timeout': max(deadline_at - time.monotonic(), 1.0)}
+                )
+            except RETRYABLE_ERRORS as e:
+                error = e
+            except Exception:
+                self._count('failures')
+                raise
+            finally:
+                self.latency.observe(time.perf_counter() - started)
+                self._slots.release()
+
+            attempt += 1
+            # Full jitter exponential backoff, never sleeping past the deadline
+            backoff = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+            if attempt > self.max_retries or time.monotonic() + backoff >= deadline_at:
+                self._count('failures')
+                raise error
+            logger.warning("Gemini call failed (%s), retry %s in %.1fs", error, attempt, backoff)
+            self._count('retries')
+            time.sleep(backoff)
+
+    def generate_text(self, prompt, model_name=None, deadline=None):
+        """Text of the first candidate, or None when the response has no text."""
+        response = self.generate_content(prompt, model_name=model_name, deadline=deadline)
+        try:
+            return response.candidates[0].content.parts[0].text
+        except (AttributeError, IndexError):
+            return None
+
+    def stats(self):
+        with self._stats_lock:
+            counters = {"requests": self.requests, "retries": self.retries, "failures": self.failures}
+        return {**counters, "latency": self.latency.snapshot()}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient(api_key=config('GEMINI_API_KEY'))
+    return _client
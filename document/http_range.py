@@ -0,0 +1,31 @@
+import re
+
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_byte_range(header, size):
+    """
+    (first, last) inclusive byte positions asked for by a single-range `Range`
+    header of a `size`-byte file. None to send the whole file: no header, or one
+    that is invalid (e.g. last < first) or not handled (several ranges), which
+    RFC 9110 says to ignore. False when the range cannot be satisfied (416).
+    """
+    match = RANGE_HEADER.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        return None
+    if not size:
+        # Nothing in an empty file can be satisfied
+        return False
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if first >= size:
+        return False
+    return first, min(int(last), size - 1) if last else size - 1
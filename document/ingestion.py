@@ -0,0 +1,638 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from decouple import config
+from django.core.files.move import file_move_safe
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .buffers import UploadBuffer
+from .categories import CUSTOM_DOCUMENT_CATEGORIES, DOCUMENT_CATEGORIES
+from .extraction import get_extracted_text, hash_file
+from .file_cache import FILE_CACHE_ON_UPLOAD, file_cache
+from .minhash import find_near_duplicates, index_document, minhash_signature
+from .models import Document, DocumentText, IngestionJob
+from .storage import get_storage
+from .text_store import store_text, text_rows
+from .resilience import INGESTION_REQUEST_BUDGET, request_deadline, submit_in_context, without_deadline
+from .utils import (
+    classify_custom_document,
+    classify_document,
+    classify_documents,
+    get_manager_by_gemini,
+    predict_manager,
+    summarize_document,
+)
+
+logger = logging.getLogger(__name__)
+
+# When False, uploads are processed inside the request like before
+INGESTION_ASYNC = config('INGESTION_ASYNC', default=True, cast=bool)
+# Start the worker threads inside the web process (disable when running `manage.py run_ingestion_workers`)
+INGESTION_WORKERS_IN_WEB = config('INGESTION_WORKERS_IN_WEB', default=True, cast=bool)
+INGESTION_WORKERS = config('INGESTION_WORKERS', default=2, cast=int)
+INGESTION_POLL_SECONDS = config('INGESTION_POLL_SECONDS', default=2.0, cast=float)
+INGESTION_MAX_ATTEMPTS = config('INGESTION_MAX_ATTEMPTS', default=3, cast=int)
+# Jobs stuck in "running" longer than this (crashed worker) are put back in the queue
+INGESTION_JOB_TIMEOUT = config('INGESTION_JOB_TIMEOUT', default=900, cast=int)
+# Threads shared by all workers for the network-bound stages (Drive upload, Gemini summary)
+INGESTION_STAGE_THREADS = config('INGESTION_STAGE_THREADS', default=2 * INGESTION_WORKERS, cast=int)
+# Batch uploads: maximum files per request and concurrent Drive/Gemini calls per batch
+INGESTION_BATCH_MAX_FILES = config('INGESTION_BATCH_MAX_FILES', default=200, cast=int)
+INGESTION_BATCH_CONCURRENCY = config('INGESTION_BATCH_CONCURRENCY', default=8, cast=int)
+# The classifier only sees the leading pages holding this many tokens (0: whole text)
+CLASSIFIER_EARLY_STOP_TOKENS = config('CLASSIFIER_EARLY_STOP_TOKENS', default=4096, cast=int)
+INGESTION_SPOOL_DIR = config(
+    'INGESTION_SPOOL_DIR', default=os.path.join(tempfile.gettempdir(), 'document-ingestion')
+)
+
+
+def spool_upload(uploaded_file):
+    """Persists the uploaded bytes so that a worker can pick them up later."""
+    os.makedirs(INGESTION_SPOOL_DIR, exist_ok=True)
+    spool_path = os.path.join(INGESTION_SPOOL_DIR, f"{uuid.uuid4().hex}.pdf")
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        # Django already wrote the upload to disk: move it rather than copying it again
+        file_move_safe(uploaded_file.temporary_file_path(), spool_path)
+        return spool_path
+    with open(spool_path, 'wb') as spool_file:
+        for chunk in uploaded_file.chunks():
+            spool_file.write(chunk)
+    return spool_path
+
+
+def remove_spool_file(spool_path):
+    try:
+        os.remove(spool_path)
+    except FileNotFoundError:
+        pass
+
+
+stage_executor = ThreadPoolExecutor(max_workers=INGESTION_STAGE_THREADS, thread_name_prefix='ingestion-stage')
+
+
+def _closing_connection(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Django keeps one connection per thread and pool threads outlive the stage:
+        # without this every pool thread would hold its own connection open forever
+        connection.close()
+
+
+def submit_stage(executor, func, *args, **kwargs):
+    """Submits a pipeline stage to a thread pool with the caller's deadline; its database connection is closed after."""
+    return submit_in_context(executor, _closing_connection, func, *args, **kwargs)
+
+
+def _timed(timings, stage, func, *args):
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timings[stage] = round(time.perf_counter() - started, 3)
+
+
+def _route_manager(kind, category):
+    if kind == IngestionJob.KIND_CUSTOM:
+        try:
+            return predict_manager(category).id
+        except ValueError:
+            return get_manager_by_gemini(category)
+    return predict_manager(category).id
+
+
+def _reader(source):
+    """Each stage reads the PDF on its own: a path, or a private reader over an UploadBuffer."""
+    return source.reader() if isinstance(source, UploadBuffer) else source
+
+
+def _taxonomy(kind):
+    return CUSTOM_DOCUMENT_CATEGORIES if kind == IngestionJob.KIND_CUSTOM else DOCUMENT_CATEGORIES
+
+
+def find_duplicates(content_hashes, kind):
+    """
+    Earliest Document per content hash whose category belongs to the taxonomy of
+    `kind` (the same bytes uploaded as a custom document get their own category).
+    """
+    originals = {}
+    candidates = Document.objects.filter(
+        content_hash__in=set(content_hashes), category__in=_taxonomy(kind)
+    ).order_by('created_at')
+    for document in candidates:
+        originals.setdefault(document.content_hash, document)
+    return originals
+
+
+def _duplicate_of(original, owner_id):
+    """New ownership record pointing at the Drive file, category, summary and manager of `original`."""
+    return Document(
+        owner_id=owner_id,
+        category=original.category,
+        manager_id=original.manager_id,
+        summary=original.summary,
+        file_name=original.file_name,
+        status="pending",
+        content_hash=original.content_hash,
+        minhash=original.minhash,
+        storage_backend=original.storage_backend,
+        drive_file_id=original.drive_file_id,
+        file_size=original.file_size,
+        mime_type=original.mime_type,
+        checksum=original.checksum,
+    )
+
+
+def _nearest_duplicate(signature, kind):
+    if signature is None:
+        return None
+    matches = find_near_duplicates(signature, categories=_taxonomy(kind))
+    return matches[0] if matches else None
+
+
+def process_document(kind, source, file_name, owner_id, timings=None):
+    # Every outbound call made for this document shares one time budget
+    with request_deadline(INGESTION_REQUEST_BUDGET):
+        return _process_document(kind, source, file_name, owner_id, timings)
+
+
+def _process_document(kind, source, file_name, owner_id, timings=None):
+    """
+    Runs the ingestion stages for one PDF (a path or an UploadBuffer) and saves
+    the resulting Document. A PDF whose bytes were already ingested skips every
+    stage and gets a new Document reusing the earlier results; a near-duplicate
+    (similar MinHash signature) is uploaded but reuses the category, summary
+    and manager of its nearest neighbour.
+
+    Pages are streamed out of the PDF: the Drive upload starts right away and
+    the classifier starts on the stage thread pool as soon as the leading pages
+    hold CLASSIFIER_EARLY_STOP_TOKENS tokens, while extraction goes on for the
+    Gemini summary. The stages are joined before the manager is routed and the
+    row is created. Per-stage durations in seconds (and the number of pages
+    read) are written to `timings` when a dict is given.
+    """
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    print(f"Processing file: {file_name}")
+
+    content_hash = _timed(timings, 'hash', hash_file, _reader(source))
+    original = find_duplicates([content_hash], kind).get(content_hash)
+    if original is not None:
+        document = _duplicate_of(original, owner_id)
+        document.save()
+        timings['duplicate_of'] = original.id
+        timings['total'] = round(time.perf_counter() - started, 3)
+        print(f"Duplicate of document {original.id}, reusing its Drive file, category and summary")
+        return document
+
+    upload_future = submit_stage(
+        stage_executor, _timed, timings, 'upload', _upload, _reader(source), file_name
+    )
+
+    try:
+        classifier = classify_custom_document if kind == IngestionJob.KIND_CUSTOM else classify_document
+        classify_futures = []
+
+        def start_classification(prefix):
+            classify_futures.append(submit_stage(stage_executor, _timed, timings, 'classify', classifier, prefix))
+
+        # Parse the PDF once and share the text with every stage below
+        extracted = _timed(
+            timings, 'extract', get_extracted_text, _reader(source), start_classification, CLASSIFIER_EARLY_STOP_TOKENS,
+            content_hash,
+        )
+        timings['pages_read'] = extracted.page_count
+
+        signature = _timed(timings, 'minhash', minhash_signature, extracted.text)
+        nearest = _timed(timings, 'near_duplicate_lookup', _nearest_duplicate, signature, kind)
+        if nearest is not None:
+            neighbour, score = nearest
+            # The classifier may already be running; its answer is not needed any more
+            for future in classify_futures:
+                future.cancel()
+            category, summary, manager_id = neighbour.category, neighbour.summary, neighbour.manager_id
+            timings['near_duplicate_of'] = neighbour.id
+            timings['similarity'] = round(score, 3)
+            print(f"Near-duplicate of document {neighbour.id} (similarity {score:.2f}), "
+                  f"reusing its category and summary")
+            stored_file = upload_future.result()
+            print('File uploaded successfully.')
+        else:
+            summary_future = submit_stage(
+                stage_executor, _timed, timings, 'summarize', summarize_document, extracted.text
+            )
+
+            category = classify_futures[0].result()
+            print(f"Category: {category}")
+
+            stored_file = upload_future.result()
+            print('File uploaded successfully.')
+            summary = summary_future.result()
+            print(f"Summary: {summary}")
+
+            manager_id = _timed(timings, 'route', _route_manager, kind, category)
+
+        # All or nothing: a retried job must not find a half-saved Document from the failed attempt
+        with transaction.atomic():
+            document = Document.objects.create(
+                owner_id=owner_id,
+                category=category,
+                manager_id=manager_id,
+                summary=summary,
+                file_name=file_name,
+                status="pending",
+                content_hash=content_hash,
+                **stored_file,
+            )
+            if signature is not None:
+                index_document(document, signature)
+            # Keep the text so that reclassification/resummarization never has to go back to Drive
+            store_text(document, extracted)
+    except Exception:
+        # No row points at the uploaded file: remove it, or every failed attempt would leave one behind
+        _discard_upload(upload_future)
+        raise
+    timings['total'] = round(time.perf_counter() - started, 3)
+    print(f"Stage timings: {timings}")
+    return document
+
+
+def integrate_document(file_io, stored_file, file_name, owner_id, category, manager_id, status="pending"):
+    """
+    Creates the Document of a file that is already in storage (integrated from the
+    old system) with the content hash, stored text and MinHash entry an upload
+    gets. Bytes that were already ingested are not integrated again: the owner's
+    Document is returned as is, or a new ownership record reuses the earlier
+    results. Returns (document, created).
+    """
+    content_hash = hash_file(file_io)
+    existing = Document.objects.filter(content_hash=content_hash).order_by('created_at')
+    owned = existing.filter(owner_id=owner_id).first()
+    if owned is not None:
+        return owned, False
+    original = existing.first()
+    if original is not None:
+        document = _duplicate_of(original, owner_id)
+        document.save()
+        return document, True
+
+    extracted = get_extracted_text(file_io, content_hash=content_hash)
+    summary = summarize_document(extracted.text)
+    signature = minhash_signature(extracted.text)
+    with transaction.atomic():
+        document = Document.objects.create(
+            owner_id=owner_id,
+            category=category,
+            manager_id=manager_id,
+            summary=summary,
+            file_name=file_name,
+            status=status,
+            content_hash=content_hash,
+            **stored_file,
+        )
+        if signature is not None:
+            index_document(document, signature)
+        store_text(document, extracted)
+    return document, True
+
+
+def _upload(pdf_file, file_name):
+    """Stores the PDF in the deployment's storage backend; returns the Document fields describing it."""
+    storage = get_storage()
+    stored_file = storage.put(pdf_file, file_name)
+    if FILE_CACHE_ON_UPLOAD and storage.cacheable:
+        # New documents are opened by their manager soon: serve that first download locally
+        file_cache.put_file(stored_file['drive_file_id'], stored_file['checksum'], pdf_file)
+    return stored_file
+
+
+def _discard_stored_file(stored_file):
+    """Deletes an uploaded file that no Document refers to; failures are only logged."""
+    try:
+        without_deadline(get_storage(stored_file['storage_backend']).delete, stored_file['drive_file_id'])
+    except Exception:
+        logger.exception("Could not delete orphaned file %s", stored_file['drive_file_id'])
+
+
+def _discard_upload(upload_future):
+    try:
+        stored_file = upload_future.result()
+    except Exception:
+        return  # The upload failed too: nothing was stored
+    _discard_stored_file(stored_file)
+
+
+def _upload_and_summarize(pdf_file, file_name, text, summary=None):
+    stored_file = _upload(pdf_file, file_name)
+    if summary is not None:
+        # Near-duplicates come with their neighbour's summary
+        return stored_file, summary
+    try:
+        return stored_file, summarize_document(text)
+    except Exception:
+        _discard_stored_file(stored_file)
+        raise
+
+
+def process_batch(uploaded_files, owner_id, kind=IngestionJob.KIND_STANDARD):
+    """
+    Ingests many PDFs in one go: texts are classified together in batched
+    forward passes, Drive uploads and summaries fan out over a bounded pool,
+    and the Document rows are written with a single bulk_create. Files whose
+    bytes were already ingested reuse the earlier results.
+    Returns one result dict per file, in the order the files were given.
+    """
+    with request_deadline(INGESTION_REQUEST_BUDGET):
+        return _process_batch(uploaded_files, owner_id, kind)
+
+
+def _process_batch(uploaded_files, owner_id, kind):
+    results = [{'file_name': uploaded_file.name, 'status': 'pending'} for uploaded_file in uploaded_files]
+    # The request's uploaded files are read in place; Django deletes them when the request ends
+    buffers = [UploadBuffer(uploaded_file) for uploaded_file in uploaded_files]
+    try:
+        # Files already ingested (earlier, or earlier in this batch) skip every stage
+        content_hashes = [hash_file(buffer.reader()) for buffer in buffers]
+        originals = find_duplicates(content_hashes, kind)
+        first_index = {}
+        copies = {}
+        for index, content_hash in enumerate(content_hashes):
+            if content_hash in originals:
+                copies[index] = None
+            elif content_hash in first_index:
+                copies[index] = first_index[content_hash]
+            else:
+                first_index[content_hash] = index
+
+        # Keep the PDF parsing processes busy with several files at once
+        with ThreadPoolExecutor(max_workers=INGESTION_BATCH_CONCURRENCY,
+                                thread_name_prefix='ingestion-extract') as executor:
+            extract_futures = {
+                index: submit_stage(executor, get_extracted_text, buffers[index].reader(), content_hash=content_hash)
+                for content_hash, index in first_index.items()
+            }
+
+        extracted_texts = {}
+        texts = {}
+        prefixes = {}
+        for index, future in extract_futures.items():
+            try:
+                extracted = future.result()
+            except Exception as e:
+                results[index].update(status='failed', error=f"Text extraction failed: {e}")
+                continue
+            if not extracted.text.strip():
+                results[index].update(status='failed', error="No text could be extracted from the PDF.")
+                continue
+            extracted_texts[index] = extracted
+            texts[index] = extracted.text
+            prefixes[index] = extracted.prefix(CLASSIFIER_EARLY_STOP_TOKENS)
+            results[index]['pages_read'] = extracted.page_count
+
+        indexes = list(texts)
+        signatures = {index: minhash_signature(texts[index]) for index in indexes}
+        nearest = {}
+        for index in indexes:
+            match = _nearest_duplicate(signatures[index], kind)
+            if match is not None:
+                nearest[index] = match[0]
+                results[index]['near_duplicate_of'] = match[0].id
+
+        to_classify = [index for index in indexes if index not in nearest]
+        categories = dict(zip(to_classify, classify_documents([prefixes[index] for index in to_classify],
+                                                              custom=kind == IngestionJob.KIND_CUSTOM)))
+        categories.update({index: neighbour.category for index, neighbour in nearest.items()})
+
+        with ThreadPoolExecutor(max_workers=INGESTION_BATCH_CONCURRENCY,
+                                thread_name_prefix='ingestion-batch') as executor:
+            futures = {
+                index: submit_stage(executor, _upload_and_summarize, buffers[index].reader(),
+                                    results[index]['file_name'], texts[index],
+                                    nearest[index].summary if index in nearest else None)
+                for index in indexes
+            }
+            summaries = {}
+            stored_files = {}
+            for index, future in futures.items():
+                try:
+                    stored_files[index], summaries[index] = future.result()
+                except Exception as e:
+                    results[index].update(status='failed', error=f"Upload or summary failed: {e}")
+
+        # The routing decision only depends on the category: resolve it once per category
+        managers = {}
+        documents = []
+        for index, summary in summaries.items():
+            category = categories[index]
+            try:
+                if index in nearest:
+                    manager_id = nearest[index].manager_id
+                else:
+                    if category not in managers:
+                        managers[category] = _route_manager(kind, category)
+                    manager_id = managers[category]
+            except Exception as e:
+                results[index].update(status='failed', error=f"Manager routing failed: {e}")
+                _discard_stored_file(stored_files[index])
+                continue
+            documents.append((index, Document(
+                owner_id=owner_id,
+                category=category,
+                manager_id=manager_id,
+                summary=summary,
+                file_name=results[index]['file_name'],
+                status="pending",
+                content_hash=content_hashes[index],
+                **stored_files[index],
+            )))
+
+        try:
+            created = Document.objects.bulk_create([document for _index, document in documents])
+        except Exception:
+            for index, _document in documents:
+                _discard_stored_file(stored_files[index])
+            raise
+        for (index, _document), document in zip(documents, created):
+            results[index].update(status='created', document=document)
+            if signatures[index] is not None:
+                index_document(document, signatures[index])
+        DocumentText.objects.bulk_create(
+            text_rows((document, extracted_texts[index]) for (index, _document), document in zip(documents, created))
+        )
+
+        duplicates = []
+        for index, source_index in copies.items():
+            if source_index is None:
+                original = originals[content_hashes[index]]
+            elif results[source_index]['status'] == 'created':
+                original = results[source_index]['document']
+            else:
+                results[index].update(status='failed', error=results[source_index].get('error'))
+                continue
+            duplicates.append((index, original))
+        created = Document.objects.bulk_create([_duplicate_of(original, owner_id) for _index, original in duplicates])
+        for (index, original), document in zip(duplicates, created):
+            results[index].update(status='created', document=document, duplicate_of=original.id)
+    finally:
+        for buffer in buffers:
+            buffer.close()
+
+    return results
+
+
+def enqueue_upload(uploaded_file, owner_id, kind=IngestionJob.KIND_STANDARD):
+    job = IngestionJob.objects.create(
+        kind=kind,
+        owner_id=owner_id,
+        file_name=uploaded_file.name,
+        spool_path=spool_upload(uploaded_file),
+    )
+    if INGESTION_WORKERS_IN_WEB:
+        worker_pool.ensure_started()
+    transaction.on_commit(worker_pool.wake)
+    return job
+
+
+def claim_next_job():
+    """Atomically moves the oldest queued job to "running"; concurrent workers skip locked rows."""
+    with transaction.atomic():
+        job = (
+            IngestionJob.objects.select_for_update(skip_locked=True)
+            .filter(status=IngestionJob.STATUS_QUEUED)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = IngestionJob.STATUS_RUNNING
+        job.started_at = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=['status', 'started_at', 'attempts'])
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Puts the jobs of crashed workers back in the queue. Jobs that already used all
+    their attempts are failed instead: the job itself may be what kills the worker
+    (out of memory, a crash in the PDF parser), and would otherwise loop forever.
+    """
+    cutoff = timezone.now() - timedelta(seconds=INGESTION_JOB_TIMEOUT)
+    stale = IngestionJob.objects.filter(status=IngestionJob.STATUS_RUNNING, started_at__lt=cutoff)
+    exhausted = list(stale.filter(attempts__gte=INGESTION_MAX_ATTEMPTS).values_list('id', 'spool_path'))
+    if exhausted:
+        IngestionJob.objects.filter(
+            pk__in=[job_id for job_id, _spool_path in exhausted], status=IngestionJob.STATUS_RUNNING
+        ).update(
+            status=IngestionJob.STATUS_FAILED,
+            error="The worker stopped while running this job.",
+            finished_at=timezone.now(),
+        )
+        for _job_id, spool_path in exhausted:
+            remove_spool_file(spool_path)
+    return stale.filter(attempts__lt=INGESTION_MAX_ATTEMPTS).update(status=IngestionJob.STATUS_QUEUED)
+
+
+def run_job(job):
+    timings = {}
+    try:
+        document = process_document(job.kind, job.spool_path, job.file_name, job.owner_id, timings)
+    except Exception as e:
+        logger.exception("Ingestion job %s failed (attempt %s)", job.id, job.attempts)
+        job.error = str(e)
+        job.stage_timings = timings
+        if job.attempts >= INGESTION_MAX_ATTEMPTS:
+            job.status = IngestionJob.STATUS_FAILED
+            job.finished_at = timezone.now()
+            remove_spool_file(job.spool_path)
+        else:
+            job.status = IngestionJob.STATUS_QUEUED
+        job.save(update_fields=['status', 'error', 'stage_timings', 'finished_at'])
+        return job
+
+    job.document = document
+    job.status = IngestionJob.STATUS_SUCCEEDED
+    job.error = ''
+    job.stage_timings = timings
+    job.finished_at = timezone.now()
+    job.save(update_fields=['document', 'status', 'error', 'stage_timings', 'finished_at'])
+    remove_spool_file(job.spool_path)
+    return job
+
+
+class IngestionWorkerPool:
+    """
+    Bounded pool of worker threads consuming the IngestionJob table.
+    The database is the queue: no external broker is needed, and several
+    processes can run pools against the same table.
+    """
+
+    def __init__(self, size, poll_seconds):
+        self.size = size
+        self.poll_seconds = poll_seconds
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            requeue_stale_jobs()
+            for index in range(self.size):
+                thread = threading.Thread(
+                    target=self._worker_loop, name=f"ingestion-worker-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _worker_loop(self):
+        try:
+            while not self._stopping.is_set():
+                close_old_connections()
+                try:
+                    job = claim_next_job()
+                except Exception:
+                    logger.exception("Could not claim an ingestion job")
+                    job = None
+
+                if job is not None:
+                    run_job(job)
+                    continue
+
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+        finally:
+            connection.close()
+
+    def stats(self):
+        return {
+            "workers": self.size,
+            "alive": sum(1 for thread in self._threads if thread.is_alive()),
+        }
+
+
+worker_pool = IngestionWorkerPool(INGESTION_WORKERS, INGESTION_POLL_SECONDS)
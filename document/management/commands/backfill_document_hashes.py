@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from document.extraction import hash_file
+from document.models import Document
+from document.storage import StoredFileMissing, get_storage
+
+
+def hash_stored_file(storage_backend, file_id, file_name):
+    """
+    SHA-256 of a document's stored file, or None when it cannot be found. Rows stored
+    before their file id was kept fall back to the (oldest) file with their name.
+    """
+    storage = get_storage(storage_backend)
+    if not file_id:
+        found = storage.find(file_name)
+        if found is None:
+            return None
+        file_id = found['drive_file_id']
+    try:
+        with storage.get(file_id) as file_io:
+            return hash_file(file_io)
+    except StoredFileMissing:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills Document.content_hash for existing rows by downloading their stored files, "
+        "so that new uploads of the same bytes are deduplicated. Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4, help="Concurrent downloads.")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after N documents.")
+
+    def handle(self, *args, **options):
+        # File names are not unique: every row is hashed from its own stored file
+        pending = (
+            Document.objects.filter(content_hash__isnull=True)
+            .order_by('id').values_list('id', 'storage_backend', 'drive_file_id', 'file_name')
+        )
+        documents = list(pending[:options['limit']] if options['limit'] else pending)
+        self.stdout.write(f"{len(documents)} documents to hash.")
+
+        hashed = missing = failed = 0
+        batch_size = options['batch_size']
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for start in range(0, len(documents), batch_size):
+                batch = documents[start:start + batch_size]
+                futures = {
+                    document_id: (file_name, executor.submit(hash_stored_file, storage_backend, file_id, file_name))
+                    for document_id, storage_backend, file_id, file_name in batch
+                }
+                for document_id, (file_name, future) in futures.items():
+                    try:
+                        content_hash = future.result()
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"{document_id} ({file_name}): {e}")
+                        continue
+                    if content_hash is None:
+                        missing += 1
+                        continue
+                    Document.objects.filter(pk=document_id, content_hash__isnull=True).update(
+                        content_hash=content_hash
+                    )
+                    hashed += 1
+                self.stdout.write(f"{start + len(batch)}/{len(documents)} documents processed")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Hashed {hashed} documents, {missing} without a stored file, {failed} failed."
+        ))
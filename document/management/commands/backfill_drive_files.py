@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from document.models import Document
+from document.utils import drive_file_fields, find_files_by_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the Drive file id, size, mime type and checksum of existing documents with a "
+        "name lookup per file, so that downloads no longer need one. Rows already filled are "
+        "skipped: safe to interrupt and re-run, or resume with --start-after."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4, help="Concurrent Drive lookups.")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after N distinct files.")
+        parser.add_argument('--start-after', default='', help="Skip file names up to this one (inclusive).")
+
+    def handle(self, *args, **options):
+        # Rows sharing a file name point at the same Drive object: look each name up once
+        pending = (
+            Document.objects.filter(drive_file_id__isnull=True, file_name__gt=options['start_after'])
+            .order_by('file_name').values_list('file_name', flat=True).distinct()
+        )
+        file_names = list(pending[:options['limit']] if options['limit'] else pending)
+        self.stdout.write(f"{len(file_names)} files to resolve.")
+
+        resolved = missing = ambiguous = failed = 0
+        batch_size = options['batch_size']
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for start in range(0, len(file_names), batch_size):
+                batch = file_names[start:start + batch_size]
+                futures = {file_name: executor.submit(find_files_by_name, file_name) for file_name in batch}
+                for file_name, future in futures.items():
+                    try:
+                        files = future.result()
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"{file_name}: {e}")
+                        continue
+                    if not files:
+                        missing += 1
+                        continue
+                    if len(files) > 1:
+                        # Same choice as the name lookup downloads made so far: the oldest file
+                        ambiguous += 1
+                        self.stderr.write(f"{file_name}: {len(files)} Drive files, using {files[0]['id']}")
+                    Document.objects.filter(file_name=file_name, drive_file_id__isnull=True).update(
+                        **drive_file_fields(files[0])
+                    )
+                    resolved += 1
+                self.stdout.write(f"{start + len(batch)}/{len(file_names)} files processed (last: {batch[-1]!r})")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Resolved {resolved} files ({ambiguous} ambiguous), {missing} not found on Drive, {failed} failed."
+        ))
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from document.categories import CUSTOM_DOCUMENT_CATEGORIES, DOCUMENT_CATEGORIES
+from document.classifiers import CLASSIFIER_BACKENDS, CLASSIFIER_BATCH_SIZE, ZERO_SHOT_MODEL
+from document.management.commands.compare_classifiers import load_corpus
+from document.metrics import peak_rss_bytes, percentile
+
+
+def run_backend(backend, model_name, texts, labels):
+    """Runs in a fresh process so that peak memory is measured for this backend alone."""
+    from document.classifiers import load_zero_shot_pipeline
+
+    started = time.perf_counter()
+    classifier = load_zero_shot_pipeline(backend, model_name)
+    load_seconds = time.perf_counter() - started
+
+    # Warm-up pass, not counted in the latencies
+    classifier(texts[0], candidate_labels=labels, batch_size=CLASSIFIER_BATCH_SIZE)
+
+    latencies = []
+    predictions = []
+    for text in texts:
+        started = time.perf_counter()
+        result = classifier(text, candidate_labels=labels, batch_size=CLASSIFIER_BATCH_SIZE)
+        latencies.append(time.perf_counter() - started)
+        predictions.append(result['labels'][0])
+
+    return {
+        'load_seconds': load_seconds,
+        'latencies': latencies,
+        'predictions': predictions,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the zero-shot classifier backends (fp32 vs int8) on a local corpus: "
+        "load time, latency, peak memory and label agreement with fp32. "
+        "Set MODEL_LOCAL_FILES_ONLY=True and ZERO_SHOT_MODEL=<dir> to run fully offline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help="Directory of .pdf/.txt samples.")
+        parser.add_argument('--backends', default=','.join(CLASSIFIER_BACKENDS))
+        parser.add_argument('--model', default=ZERO_SHOT_MODEL, help="Hub id or cached model directory.")
+        parser.add_argument('--custom', action='store_true', help="Use the custom category taxonomy.")
+        parser.add_argument('--limit', type=int, default=None, help="Only use the first N samples.")
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['corpus']):
+            raise CommandError(f"Corpus directory not found: {options['corpus']}")
+
+        labels = CUSTOM_DOCUMENT_CATEGORIES if options['custom'] else DOCUMENT_CATEGORIES
+        texts = [text for _path, text, _expected in load_corpus(options['corpus'])][:options['limit']]
+        if not texts:
+            raise CommandError("The corpus does not contain any readable sample.")
+
+        backends = [backend.strip() for backend in options['backends'].split(',') if backend.strip()]
+        context = multiprocessing.get_context('spawn')
+        reports = {}
+        for backend in backends:
+            with context.Pool(1) as pool:
+                reports[backend] = pool.apply(run_backend, (backend, options['model'], texts, labels))
+
+        reference = reports.get('fp32')
+        for backend, report in reports.items():
+            latencies = report['latencies']
+            agreement = "n/a"
+            if reference is not None:
+                matches = sum(
+                    1 for label, expected in zip(report['predictions'], reference['predictions']) if label == expected
+                )
+                agreement = f"{matches / len(texts):.1%}"
+            peak = report['peak_rss_bytes']
+            self.stdout.write(
+                f"{backend:<5} docs={len(texts)} load={report['load_seconds']:.1f}s "
+                f"mean={sum(latencies) / len(latencies) * 1000:.1f}ms "
+                f"p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+                f"peak_rss={f'{peak / 2 ** 20:.0f}MiB' if peak else 'n/a'} "
+                f"agreement_with_fp32={agreement}"
+            )
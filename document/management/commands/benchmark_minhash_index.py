@@ -0,0 +1,126 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from document.minhash import (
+    MINHASH_BANDS,
+    MINHASH_PERMUTATIONS,
+    band_buckets,
+    find_near_duplicates,
+    from_bytes,
+)
+from document.metrics import percentile
+from document.models import Document
+
+
+class SortedBucketIndex:
+    """
+    In-memory stand-in for the document_lsh_buckets table and its B-tree index:
+    bucket values sorted once, looked up by binary search.
+    """
+
+    def __init__(self, buckets, document_ids):
+        order = np.argsort(buckets, kind='stable')
+        self.buckets = buckets[order]
+        self.document_ids = document_ids[order]
+
+    def candidates(self, query_buckets):
+        found = set()
+        for bucket in query_buckets:
+            start = np.searchsorted(self.buckets, bucket, side='left')
+            stop = np.searchsorted(self.buckets, bucket, side='right')
+            found.update(self.document_ids[start:stop].tolist())
+        return found
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks near-duplicate lookups: builds an LSH bucket index over N synthetic "
+        "signatures (default 1M) and reports lookup latency and recall per similarity level, "
+        "against a brute-force scan. --database also times lookups on the real bucket table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--similarities', default='0.95,0.9,0.85,0.8,0.7,0.5')
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--database', action='store_true', help="Also query the stored documents.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        count = options['documents']
+        sample_size = min(options['queries'], count)
+        sample_ids = rng.choice(count, size=sample_size, replace=False)
+        sample_position = {int(document_id): index for index, document_id in enumerate(sample_ids)}
+        samples = np.empty((sample_size, MINHASH_PERMUTATIONS), dtype=np.uint32)
+
+        # Only the bucket values are kept for the whole corpus (N x bands int64)
+        started = time.perf_counter()
+        buckets = np.empty(count * MINHASH_BANDS, dtype=np.int64)
+        chunk = 10_000
+        for start in range(0, count, chunk):
+            signatures = rng.integers(0, 2 ** 32, size=(min(chunk, count - start), MINHASH_PERMUTATIONS),
+                                      dtype=np.uint32)
+            for offset, signature in enumerate(signatures):
+                document_id = start + offset
+                position = (start + offset) * MINHASH_BANDS
+                buckets[position:position + MINHASH_BANDS] = band_buckets(signature)
+                if document_id in sample_position:
+                    samples[sample_position[document_id]] = signature
+        index = SortedBucketIndex(buckets, np.repeat(np.arange(count), MINHASH_BANDS))
+        self.stdout.write(f"Indexed {count} signatures ({buckets.nbytes / 2 ** 20:.0f} MiB of buckets) "
+                          f"in {time.perf_counter() - started:.1f}s")
+
+        for level in [float(value) for value in options['similarities'].split(',') if value.strip()]:
+            latencies = []
+            found = 0
+            candidate_counts = []
+            for document_id, signature in zip(sample_ids, samples):
+                # A near-duplicate shares `level` of the signature with the stored document
+                query = signature.copy()
+                changed = rng.random(MINHASH_PERMUTATIONS) >= level
+                query[changed] = rng.integers(0, 2 ** 32, size=int(changed.sum()), dtype=np.uint32)
+
+                started = time.perf_counter()
+                candidates = index.candidates(band_buckets(query))
+                latencies.append(time.perf_counter() - started)
+                candidate_counts.append(len(candidates))
+                found += int(int(document_id) in candidates)
+            self.stdout.write(
+                f"similarity~{level:.2f} recall={found / sample_size:.1%} "
+                f"candidates/query={sum(candidate_counts) / sample_size:.1f} "
+                f"p50={percentile(latencies, 0.5) * 1000:.2f}ms p95={percentile(latencies, 0.95) * 1000:.2f}ms"
+            )
+
+        # Brute force: compare one query with every signature, extrapolated from a block
+        block = rng.integers(0, 2 ** 32, size=(min(count, 100_000), MINHASH_PERMUTATIONS), dtype=np.uint32)
+        started = time.perf_counter()
+        (block == samples[0]).mean(axis=1)
+        scan_seconds = (time.perf_counter() - started) * count / len(block)
+        self.stdout.write(f"brute-force scan over {count} signatures: ~{scan_seconds * 1000:.0f}ms per query")
+
+        if options['database']:
+            self._benchmark_database(options['queries'])
+
+    def _benchmark_database(self, queries):
+        documents = list(
+            Document.objects.filter(minhash__isnull=False).order_by('-created_at').values_list('id', 'minhash')[:queries]
+        )
+        if not documents:
+            self.stdout.write("No stored signatures to query.")
+            return
+        latencies = []
+        matches = 0
+        for document_id, minhash in documents:
+            signature = from_bytes(minhash)
+            started = time.perf_counter()
+            found = find_near_duplicates(signature, threshold=0.5, exclude_id=document_id)
+            latencies.append(time.perf_counter() - started)
+            matches += len(found)
+        self.stdout.write(
+            f"database ({Document.objects.filter(minhash__isnull=False).count()} signatures): "
+            f"p50={percentile(latencies, 0.5) * 1000:.1f}ms p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+            f"near-duplicates/query={matches / len(documents):.2f}"
+        )
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from document.extraction import EXTRACTORS, ExtractionPool
+from document.metrics import peak_rss_bytes
+
+
+def find_pdfs(corpus_dir):
+    paths = []
+    for root, _dirs, files in os.walk(corpus_dir):
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith('.pdf'))
+    return paths
+
+
+def run_extractor(name, paths, repeat):
+    """Runs in a fresh process so that peak memory is measured for this extractor alone."""
+    from document.extraction import get_extractor
+
+    extractor = get_extractor(name)
+    pages = 0
+    characters = 0
+    failures = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            try:
+                text, page_count = extractor.extract(path)
+            except Exception as e:
+                failures.append(f"{os.path.basename(path)}: {e}")
+                continue
+            pages += page_count
+            characters += len(text)
+    return {
+        'seconds': time.perf_counter() - started,
+        'pages': pages,
+        'characters': characters,
+        'failures': failures,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the PDF text extractors on a local corpus: pages/second, "
+        "extracted characters, parse failures and peak memory per extractor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help="Directory of .pdf files (searched recursively).")
+        parser.add_argument('--extractors', default=','.join(EXTRACTORS))
+        parser.add_argument('--repeat', type=int, default=1, help="Extract the corpus N times per extractor.")
+        parser.add_argument(
+            '--pool-workers', default='',
+            help="Comma-separated process pool sizes (e.g. 1,4,16) to measure how throughput scales with cores.",
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['corpus']):
+            raise CommandError(f"Corpus directory not found: {options['corpus']}")
+        paths = find_pdfs(options['corpus'])
+        if not paths:
+            raise CommandError("The corpus does not contain any PDF.")
+
+        names = [name.strip() for name in options['extractors'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in EXTRACTORS]
+        if unknown:
+            raise CommandError(f"Unknown extractors: {', '.join(unknown)}")
+
+        context = multiprocessing.get_context('spawn')
+        for name in names:
+            with context.Pool(1) as pool:
+                report = pool.apply(run_extractor, (name, paths, options['repeat']))
+
+            peak = report['peak_rss_bytes']
+            pages_per_second = report['pages'] / report['seconds'] if report['seconds'] else 0
+            self.stdout.write(
+                f"{name:<10} files={len(paths)} pages={report['pages']} time={report['seconds']:.2f}s "
+                f"pages/s={pages_per_second:.1f} chars={report['characters']} "
+                f"failures={len(report['failures'])} "
+                f"peak_rss={f'{peak / 2 ** 20:.0f}MiB' if peak else 'n/a'}"
+            )
+            for failure in report['failures'][:5]:
+                self.stdout.write(f"    {failure}")
+
+        for size in [int(size) for size in options['pool_workers'].split(',') if size.strip()]:
+            self._benchmark_pool(size, paths * options['repeat'])
+
+    def _benchmark_pool(self, size, paths):
+        """Extracts the corpus with the configured extractor chain through a pool of `size` processes."""
+        pool = ExtractionPool(size)
+        pool.start()
+        try:
+            started = time.perf_counter()
+            # As many documents in flight as there are processes, like concurrent uploads would do
+            with ThreadPoolExecutor(max_workers=size) as threads:
+                page_counts = list(threads.map(lambda path: sum(1 for _ in pool.iter_pages(path)), paths))
+            seconds = time.perf_counter() - started
+        finally:
+            pool.restart()
+        pages = sum(page_counts)
+        stats = pool.stats()
+        self.stdout.write(
+            f"pool[{size:>2}] files={len(paths)} pages={pages} time={seconds:.2f}s "
+            f"pages/s={pages / seconds if seconds else 0:.1f} split_documents={stats['split_documents']}"
+        )
@@ -0,0 +1,89 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from document.categories import CUSTOM_DOCUMENT_CATEGORIES, DOCUMENT_CATEGORIES
+from document.classifiers import ENGINES, get_classifier
+from document.extraction import extract_text_from_pdf
+from document.metrics import percentile
+
+
+def load_corpus(corpus_dir):
+    """
+    Reads every .pdf/.txt file under `corpus_dir`. When a file sits in a
+    sub-directory, the sub-directory name is used as its expected label.
+    """
+    samples = []
+    for root, _dirs, files in os.walk(corpus_dir):
+        expected = None if os.path.abspath(root) == os.path.abspath(corpus_dir) else os.path.basename(root)
+        for file_name in sorted(files):
+            path = os.path.join(root, file_name)
+            if file_name.lower().endswith('.pdf'):
+                text = extract_text_from_pdf(path)
+            elif file_name.lower().endswith('.txt'):
+                with open(path, encoding='utf-8') as handle:
+                    text = handle.read()
+            else:
+                continue
+            if text.strip():
+                samples.append((os.path.relpath(path, corpus_dir), text, expected))
+    return samples
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares classifier engines (latency, forward passes, accuracy, agreement with zero-shot) "
+        "on a local corpus. Use --custom to measure the hierarchical engine on the custom taxonomy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help="Directory of .pdf/.txt samples, optionally in label-named sub-directories.")
+        parser.add_argument('--engines', default=','.join(ENGINES),
+                            help="Comma-separated engines to compare (default: all).")
+        parser.add_argument('--custom', action='store_true', help="Use the custom category taxonomy.")
+        parser.add_argument('--baseline', default='zero-shot', help="Engine used as the agreement reference.")
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['corpus']):
+            raise CommandError(f"Corpus directory not found: {options['corpus']}")
+
+        labels = CUSTOM_DOCUMENT_CATEGORIES if options['custom'] else DOCUMENT_CATEGORIES
+        samples = load_corpus(options['corpus'])
+        if not samples:
+            raise CommandError("The corpus does not contain any readable sample.")
+        texts = [text for _path, text, _expected in samples]
+
+        engine_names = [name.strip() for name in options['engines'].split(',') if name.strip()]
+        if options['baseline'] not in engine_names:
+            engine_names.insert(0, options['baseline'])
+
+        predictions = {}
+        for name in engine_names:
+            engine = get_classifier(name)
+            # Warm-up so that model loading is not counted as inference latency
+            engine.classify(texts[:1], labels)
+
+            latencies = []
+            predicted = []
+            for text in texts:
+                started = time.perf_counter()
+                predicted.append(engine.classify([text], labels)[0])
+                latencies.append(time.perf_counter() - started)
+            predictions[name] = predicted
+
+            labelled = [(p, expected) for p, (_path, _text, expected) in zip(predicted, samples) if expected]
+            accuracy = (
+                f"{sum(1 for p, expected in labelled if p == expected) / len(labelled):.1%}" if labelled else "n/a"
+            )
+            agreement = sum(
+                1 for p, reference in zip(predicted, predictions[options['baseline']]) if p == reference
+            ) / len(predicted)
+
+            self.stdout.write(
+                f"{name:<12} docs={len(texts)} "
+                f"mean={sum(latencies) / len(latencies) * 1000:.1f}ms "
+                f"p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+                f"forward_passes/doc={engine.forward_passes(1, labels)} "
+                f"accuracy={accuracy} agreement_with_{options['baseline']}={agreement:.1%}"
+            )
@@ -0,0 +1,135 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from document.categories import CUSTOM_DOCUMENT_CATEGORIES, DOCUMENT_CATEGORIES
+from document.extraction import get_extracted_text
+from document.ingestion import CLASSIFIER_EARLY_STOP_TOKENS
+from document.minhash import index_document, minhash_signature
+from document.models import Document, DocumentLshBucket
+from document.storage import StoredFileMissing, get_storage
+from document.text_store import load_extracted_text, store_text
+from document.utils import classify_documents, summarize_document
+
+
+def fetch_and_store(document, dry_run=False):
+    """
+    Downloads the document from its storage once, extracts it and stores the text
+    for the next runs (not with `dry_run`: the text is only used for this run).
+    """
+    storage = get_storage(document.storage_backend)
+    file_id = document.drive_file_id
+    if not file_id:
+        stored_file = storage.find(document.file_name)
+        if stored_file is None:
+            return None
+        file_id = stored_file['drive_file_id']
+    try:
+        file_io = storage.get(file_id)
+    except StoredFileMissing:
+        return None
+    with file_io:
+        extracted = get_extracted_text(file_io)
+    if not dry_run:
+        store_text(document, extracted)
+    return extracted
+
+
+def is_custom(document):
+    return document.category not in DOCUMENT_CATEGORIES and document.category in CUSTOM_DOCUMENT_CATEGORIES
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-runs classification, summarization and/or MinHash indexing of existing documents from "
+        "their stored extracted text, e.g. after a model or prompt change. File storage is only used with --fetch-missing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reclassify', action='store_true')
+        parser.add_argument('--resummarize', action='store_true')
+        parser.add_argument('--minhash', action='store_true',
+                            help="Recompute MinHash signatures and LSH buckets (after a signature scheme change).")
+        parser.add_argument('--ids', default='', help="Comma-separated document ids (default: all).")
+        parser.add_argument('--category', default=None, help="Only documents currently in this category.")
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--fetch-missing', action='store_true',
+                            help="Download and store the text of documents that have none.")
+        parser.add_argument('--dry-run', action='store_true', help="Report changes without saving them.")
+
+    def handle(self, *args, **options):
+        if not options['reclassify'] and not options['resummarize'] and not options['minhash']:
+            raise CommandError("Pass --reclassify, --resummarize and/or --minhash.")
+
+        documents = Document.objects.defer('minhash').order_by('id')
+        if options['ids']:
+            documents = documents.filter(id__in=[int(value) for value in options['ids'].split(',') if value.strip()])
+        if options['category']:
+            documents = documents.filter(category=options['category'])
+
+        processed = changed = missing = 0
+        for batch in self._batches(documents, options['batch_size']):
+            batch_processed, batch_changed, batch_missing = self._process(batch, options)
+            processed += batch_processed
+            changed += batch_changed
+            missing += batch_missing
+
+        verb = "would change" if options['dry_run'] else "changed"
+        self.stdout.write(self.style.SUCCESS(
+            f"Reprocessed {processed} documents, {verb} {changed}, {missing} without stored text."
+        ))
+
+    @staticmethod
+    def _batches(documents, size):
+        batch = []
+        for document in documents.iterator(chunk_size=size):
+            batch.append(document)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _process(self, batch, options):
+        texts = {}
+        missing = 0
+        for document in batch:
+            extracted = load_extracted_text(document)
+            if extracted is None and options['fetch_missing']:
+                extracted = fetch_and_store(document, options['dry_run'])
+            if extracted is None or not extracted.text.strip():
+                missing += 1
+                continue
+            texts[document.id] = extracted
+
+        documents = [document for document in batch if document.id in texts]
+        updates = {document.id: {} for document in documents}
+        if options['reclassify']:
+            for custom in (False, True):
+                group = [document for document in documents if is_custom(document) == custom]
+                prefixes = [texts[document.id].prefix(CLASSIFIER_EARLY_STOP_TOKENS) for document in group]
+                for document, category in zip(group, classify_documents(prefixes, custom=custom)):
+                    if category != document.category:
+                        updates[document.id]['category'] = category
+        if options['resummarize']:
+            for document in documents:
+                summary = summarize_document(texts[document.id].text)
+                if summary and summary != document.summary:
+                    updates[document.id]['summary'] = summary
+
+        if options['minhash'] and not options['dry_run']:
+            DocumentLshBucket.objects.filter(document__in=documents).delete()
+            for document in documents:
+                signature = minhash_signature(texts[document.id].text)
+                if signature is not None:
+                    index_document(document, signature)
+                else:
+                    # No words left to sign: an old signature would still match its old neighbours
+                    Document.objects.filter(pk=document.pk).update(minhash=None)
+
+        changed = [document for document in documents if updates[document.id]]
+        for document in changed:
+            for field, value in updates[document.id].items():
+                self.stdout.write(f"{document.id} {field}: {str(getattr(document, field))[:60]!r} -> {value[:60]!r}")
+                setattr(document, field, value)
+        if changed and not options['dry_run']:
+            Document.objects.bulk_update(changed, ['category', 'summary'])
+        return len(documents), len(changed), missing
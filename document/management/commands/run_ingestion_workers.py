@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from document.extraction import extraction_pool
+from document.ingestion import INGESTION_POLL_SECONDS, INGESTION_WORKERS, IngestionWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Runs a pool of ingestion workers that process queued document uploads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=INGESTION_WORKERS)
+        parser.add_argument('--poll-seconds', type=float, default=INGESTION_POLL_SECONDS)
+
+    def handle(self, *args, **options):
+        # Spawn the PDF parsing processes before the first job needs them
+        extraction_pool.start()
+        pool = IngestionWorkerPool(options['workers'], options['poll_seconds'])
+        pool.ensure_started()
+        self.stdout.write(f"Started {options['workers']} ingestion workers.")
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping ingestion workers...")
+            pool.stop(timeout=30)
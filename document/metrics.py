@@ -0,0 +1,69 @@
+import bisect
+import threading
+
+# Upper bounds (seconds) of the latency buckets; the last bucket is unbounded
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+
+def percentile(values, q):
+    """Nearest-rank q-th quantile (0..1) of a non-empty sequence of measurements."""
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+def peak_rss_bytes():
+    """Peak resident memory of the current process, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LatencyHistogram:
+    """Thread-safe fixed-bucket latency histogram with approximate quantiles."""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._sum += seconds
+            self._count += 1
+
+    @property
+    def count(self):
+        return self._count
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, or None without observations."""
+        with self._lock:
+            if not self._count:
+                return None
+            rank = q * self._count
+            seen = 0
+            for index, bucket_count in enumerate(self._counts):
+                seen += bucket_count
+                if seen >= rank and bucket_count:
+                    return self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            return self.buckets[-1]
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {f"le_{bound}": count for bound, count in zip(self.buckets, self._counts)}
+            buckets["le_inf"] = self._counts[-1]
+            count, total = self._count, self._sum
+        return {
+            "count": count,
+            "mean_seconds": round(total / count, 4) if count else None,
+            "p50_seconds": self.quantile(0.5),
+            "p95_seconds": self.quantile(0.95),
+            "p99_seconds": self.quantile(0.99),
+            "buckets": buckets,
+        }
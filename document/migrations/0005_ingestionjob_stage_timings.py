@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0004_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0005_ingestionjob_stage_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SummaryCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('prompt_version', models.CharField(max_length=64)),
+                ('summary', models.TextField()),
+                ('size_bytes', models.PositiveIntegerField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'summary_cache',
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'prompt_version'), name='summary_cache_key_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0007_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='minhash',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='DocumentLshBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField(db_index=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='document.document')),
+            ],
+            options={
+                'db_table': 'document_lsh_buckets',
+            },
+        ),
+    ]
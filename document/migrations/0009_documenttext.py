@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0008_document_minhash_documentlshbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentText',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='extracted_text', serialize=False, to='document.document')),
+                ('codec', models.CharField(choices=[('zlib', 'zlib'), ('zstd', 'Zstandard')], max_length=8)),
+                ('data', models.BinaryField()),
+                ('text_bytes', models.PositiveIntegerField()),
+                ('page_count', models.PositiveIntegerField(default=0)),
+                ('page_ends', models.JSONField(default=list)),
+                ('truncated', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'document_texts',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0010_document_drive_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='storage_backend',
+            field=models.CharField(default='drive', max_length=16),
+        ),
+    ]
@@ -0,0 +1,120 @@
+import hashlib
+import re
+import zlib
+
+import numpy as np
+from decouple import config
+from django.db.models import Count
+
+from .models import Document, DocumentLshBucket
+
+MINHASH_PERMUTATIONS = config('MINHASH_PERMUTATIONS', default=128, cast=int)
+# Bands x rows must equal the number of permutations; 16 bands of 8 rows make
+# documents with a Jaccard similarity above ~0.7 likely to share a bucket
+MINHASH_BANDS = config('MINHASH_BANDS', default=16, cast=int)
+MINHASH_SHINGLE_WORDS = config('MINHASH_SHINGLE_WORDS', default=5, cast=int)
+# Estimated Jaccard similarity above which a neighbour's category and summary are reused
+NEAR_DUPLICATE_THRESHOLD = config('NEAR_DUPLICATE_THRESHOLD', default=0.85, cast=float)
+# Candidates (those sharing the most buckets) whose signatures are compared on lookup
+NEAR_DUPLICATE_MAX_CANDIDATES = config('NEAR_DUPLICATE_MAX_CANDIDATES', default=100, cast=int)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Hashed this many shingles at a time to bound the (shingles x permutations) matrix
+_SHINGLE_BLOCK = 4096
+
+# Fixed seed: signatures must stay comparable across processes and restarts. Shingle
+# hashes (crc32) and the multipliers stay below 2**32, so a * x fits in 64 bits.
+_generator = np.random.RandomState(1)
+_A = _generator.randint(1, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _generator.randint(0, (1 << 61) - 1, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingles(text):
+    """Word n-grams of the lower-cased text, ignoring punctuation and layout (re-scans differ there)."""
+    words = re.findall(r'\w+', (text or "").lower())
+    if len(words) <= MINHASH_SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {
+        " ".join(words[index:index + MINHASH_SHINGLE_WORDS])
+        for index in range(len(words) - MINHASH_SHINGLE_WORDS + 1)
+    }
+
+
+def minhash_signature(text):
+    """MinHash signature (MINHASH_PERMUTATIONS uint32 values) of the text, or None for text without words."""
+    values = shingles(text)
+    if not values:
+        return None
+    hashes = np.fromiter(
+        (zlib.crc32(value.encode('utf-8')) for value in values), dtype=np.uint64, count=len(values)
+    )
+    signature = np.full(MINHASH_PERMUTATIONS, _MAX_HASH, dtype=np.uint64)
+    for start in range(0, len(hashes), _SHINGLE_BLOCK):
+        block = hashes[start:start + _SHINGLE_BLOCK, np.newaxis]
+        # Universal hashing (a * x + b) mod p, one (a, b) pair per permutation. a * x < 2**64 and
+        # (a * x mod p) + b < 2**62: no step wraps around, so this is the exact modular value
+        permuted = np.bitwise_and((block * _A % _MERSENNE_PRIME + _B) % _MERSENNE_PRIME, _MAX_HASH)
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature.astype(np.uint32)
+
+
+def to_bytes(signature):
+    return signature.astype('<u4').tobytes()
+
+
+def from_bytes(data):
+    return np.frombuffer(bytes(data), dtype='<u4')
+
+
+def band_buckets(signature):
+    """One signed 64-bit bucket per band, mixing in the band index so that one column can index all bands."""
+    rows = len(signature) // MINHASH_BANDS
+    buckets = []
+    for band in range(MINHASH_BANDS):
+        digest = hashlib.blake2b(
+            band.to_bytes(2, 'little') + to_bytes(signature[band * rows:(band + 1) * rows]), digest_size=8
+        ).digest()
+        buckets.append(int.from_bytes(digest, 'little', signed=True))
+    return buckets
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity: the share of permutations with the same minimum."""
+    return float(np.mean(signature == other))
+
+
+def index_document(document, signature):
+    """Stores the signature on the document and its band buckets in the LSH table."""
+    document.minhash = to_bytes(signature)
+    Document.objects.filter(pk=document.pk).update(minhash=document.minhash)
+    DocumentLshBucket.objects.bulk_create(
+        [DocumentLshBucket(document=document, bucket=bucket) for bucket in band_buckets(signature)]
+    )
+
+
+def find_near_duplicates(signature, threshold=NEAR_DUPLICATE_THRESHOLD, categories=None, exclude_id=None,
+                         limit=NEAR_DUPLICATE_MAX_CANDIDATES):
+    """
+    Documents whose estimated similarity to `signature` is at least `threshold`,
+    most similar first, as (document, similarity) pairs. Only documents sharing a
+    band bucket are compared, through the bucket index: the cost does not grow
+    with the number of stored documents.
+    """
+    buckets = DocumentLshBucket.objects.filter(bucket__in=band_buckets(signature))
+    if exclude_id is not None:
+        buckets = buckets.exclude(document_id=exclude_id)
+    if categories is not None:
+        # Before the limit: documents of other categories must not take the candidate slots
+        buckets = buckets.filter(document__category__in=categories)
+    candidates = buckets.values('document_id').annotate(shared=Count('id')).order_by('-shared')
+    candidate_ids = [row['document_id'] for row in candidates[:limit]]
+
+    documents = Document.objects.filter(pk__in=candidate_ids, minhash__isnull=False)
+    matches = []
+    for document in documents:
+        score = similarity(signature, from_bytes(document.minhash))
+        if score >= threshold:
+            matches.append((document, score))
+    matches.sort(key=lambda match: match[1], reverse=True)
+    return matches
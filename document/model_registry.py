@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _RegistryEntry:
+    def __init__(self, loader):
+        self.loader = loader
+        self.model = None
+        self.lock = threading.Lock()
+        self.load_seconds = None
+        self.loaded_at = None
+        self.memory_bytes = None
+        self.hits = 0
+        self.loads = 0
+
+
+def estimate_memory_bytes(model):
+    """
+    Best-effort size of the tensors held by a loaded model (parameters + buffers).
+    Works for Hugging Face pipelines (``.model``) and stable-baselines3 agents (``.policy``).
+    """
+    module = getattr(model, 'model', None) or getattr(model, 'policy', None)
+    if module is None or not hasattr(module, 'parameters'):
+        return None
+
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    """
+    Keeps the ML models used by the document pipeline resident for the lifetime
+    of the worker process. Models are loaded lazily on first use, exactly once,
+    even when several request threads ask for the same model at the same time.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._stats_lock = threading.Lock()
+
+    def register(self, name, loader):
+        self._entries[name] = _RegistryEntry(loader)
+
+    def get(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            raise ValueError(f"Unknown model: {name}")
+
+        if entry.model is None:
+            with entry.lock:
+                if entry.model is None:
+                    logger.info("Loading model '%s'", name)
+                    started = time.perf_counter()
+                    model = entry.loader()
+                    entry.load_seconds = time.perf_counter() - started
+                    entry.loaded_at = time.time()
+                    entry.memory_bytes = estimate_memory_bytes(model)
+                    entry.loads += 1
+                    entry.model = model
+                    logger.info("Model '%s' loaded in %.2fs", name, entry.load_seconds)
+                    return model
+
+        with self._stats_lock:
+            entry.hits += 1
+        return entry.model
+
+    def is_loaded(self, name):
+        entry = self._entries.get(name)
+        return entry is not None and entry.model is not None
+
+    def unload(self, name):
+        entry = self._entries.get(name)
+        if entry is not None:
+            with entry.lock:
+                entry.model = None
+
+    def stats(self):
+        return {
+            name: {
+                "loaded": entry.model is not None,
+                "load_seconds": round(entry.load_seconds, 3) if entry.load_seconds is not None else None,
+                "loaded_at": entry.loaded_at,
+                "memory_bytes": entry.memory_bytes,
+                "hits": entry.hits,
+                "loads": entry.loads,
+            }
+            for name, entry in self._entries.items()
+        }
+
+
+# Process-wide registry shared by every request handled by this worker
+registry = ModelRegistry()
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from user.models import User
 
@@ -9,6 +11,17 @@ class Document(models.Model):
     file_name = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=50)
+    # SHA-256 of the PDF bytes; identical uploads reuse the Drive file, category and summary
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    # MinHash signature of the extracted text (little-endian uint32 values), see document/minhash.py
+    minhash = models.BinaryField(null=True, blank=True, editable=False)
+    # Storage backend holding the file (see document/storage.py) and the file's id there (for Drive,
+    # the Drive file id), so downloads go straight to it instead of a name lookup
+    storage_backend = models.CharField(max_length=16, default='drive')
+    drive_file_id = models.CharField(max_length=128, null=True, blank=True, db_index=True)
+    file_size = models.BigIntegerField(null=True, blank=True)
+    mime_type = models.CharField(max_length=255, null=True, blank=True)
+    checksum = models.CharField(max_length=32, null=True, blank=True)  # MD5 reported by Drive
 
     def __str__(self) -> str:
         # Dynamically list all fields and their values
@@ -23,4 +36,104 @@ class Document(models.Model):
         
 
     class Meta:
-        db_table = 'documents'  # Replace with your preferred table name
\ No newline at end of file
+        db_table = 'documents'  # Replace with your preferred table name
+
+
+class IngestionJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    KIND_STANDARD = 'standard'
+    KIND_CUSTOM = 'custom'
+    KIND_CHOICES = [
+        (KIND_STANDARD, 'Standard'),
+        (KIND_CUSTOM, 'Custom'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_STANDARD)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    file_name = models.CharField(max_length=255)
+    spool_path = models.CharField(max_length=1024)  # Uploaded bytes waiting to be processed
+    document = models.ForeignKey(
+        Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='ingestion_jobs'
+    )
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    stage_timings = models.JSONField(default=dict, blank=True)  # Seconds spent in each pipeline stage
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.file_name} ({self.status})"
+
+    class Meta:
+        db_table = 'ingestion_jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='ingestion_status_created_idx'),
+        ]
+
+
+class SummaryCacheEntry(models.Model):
+    content_hash = models.CharField(max_length=64)  # SHA-256 of the summarized text
+    prompt_version = models.CharField(max_length=64)  # Hash of the prompts, model and budgets used
+    summary = models.TextField()
+    size_bytes = models.PositiveIntegerField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.content_hash[:12]}@{self.prompt_version}"
+
+    class Meta:
+        db_table = 'summary_cache'
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'prompt_version'], name='summary_cache_key_unique'),
+        ]
+
+
+class DocumentLshBucket(models.Model):
+    """One LSH band of a Document's MinHash signature; documents sharing a bucket are near-duplicate candidates."""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='lsh_buckets')
+    bucket = models.BigIntegerField(db_index=True)  # Hash of the band index and its signature values
+
+    def __str__(self) -> str:
+        return f"{self.document_id}:{self.bucket}"
+
+    class Meta:
+        db_table = 'document_lsh_buckets'
+
+
+class DocumentText(models.Model):
+    """Compressed extracted text of a Document, so it can be reprocessed without going back to Drive."""
+    CODEC_ZLIB = 'zlib'
+    CODEC_ZSTD = 'zstd'
+    CODEC_CHOICES = [(CODEC_ZLIB, 'zlib'), (CODEC_ZSTD, 'Zstandard')]
+
+    document = models.OneToOneField(
+        Document, on_delete=models.CASCADE, primary_key=True, related_name='extracted_text'
+    )
+    codec = models.CharField(max_length=8, choices=CODEC_CHOICES)
+    data = models.BinaryField()
+    text_bytes = models.PositiveIntegerField()  # Size of the UTF-8 text before compression
+    page_count = models.PositiveIntegerField(default=0)
+    page_ends = models.JSONField(default=list)  # Offset in the text where each page ends
+    truncated = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.document_id} ({self.codec}, {self.text_bytes} bytes)"
+
+    class Meta:
+        db_table = 'document_texts'
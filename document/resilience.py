@@ -0,0 +1,145 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from decouple import config
+
+from .metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Time budgets of whole operations; outbound calls made on their behalf share what is left
+INGESTION_REQUEST_BUDGET = config('INGESTION_REQUEST_BUDGET', default=600.0, cast=float)
+DOWNLOAD_REQUEST_BUDGET = config('DOWNLOAD_REQUEST_BUDGET', default=60.0, cast=float)
+HEDGE_THREADS = config('HEDGE_THREADS', default=16, cast=int)
+HEDGE_MIN_SAMPLES = config('HEDGE_MIN_SAMPLES', default=20, cast=int)
+HEDGE_QUANTILE = config('HEDGE_QUANTILE', default=0.95, cast=float)
+
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def request_deadline(seconds):
+    """
+    Sets the time budget of the current request/job. Nested budgets never extend
+    the outer one. Outbound calls read what is left with `remaining()`.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(default=None):
+    """Seconds left in the current budget, capped at `default`; `default` when no budget is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    left = max(deadline - time.monotonic(), 0.0)
+    return left if default is None else min(left, default)
+
+
+def check_deadline(operation):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"{operation} exceeded the request deadline.")
+
+
+def without_deadline(func, *args, **kwargs):
+    """Runs `func` outside any request budget, for cleanup that must happen even once the budget is spent."""
+    return contextvars.Context().run(func, *args, **kwargs)
+
+
+def submit_in_context(executor, func, *args, **kwargs):
+    """Submits to a thread pool while keeping the caller's deadline (context variables)."""
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix='hedge')
+
+
+class Hedger:
+    """
+    Hedged requests for idempotent calls: when the first attempt has not answered
+    after the observed p95 latency, a second identical attempt is issued and the
+    first successful response wins. `func` must be safe to run twice concurrently.
+    `default_delay` is used until enough latencies have been observed.
+    """
+
+    def __init__(self, name, default_delay):
+        self.name = name
+        self.default_delay = default_delay
+        self.latency = LatencyHistogram()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        self.timeouts = 0
+
+    def delay(self):
+        if self.latency.count >= HEDGE_MIN_SAMPLES:
+            return self.latency.quantile(HEDGE_QUANTILE)
+        return self.default_delay
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def call(self, func, *args, enabled=True):
+        self._count('calls')
+        started = time.perf_counter()
+        if not enabled:
+            result = func(*args)
+            self.latency.observe(time.perf_counter() - started)
+            return result
+
+        primary = submit_in_context(hedge_executor, func, *args)
+        hedge = None
+        first_wait = self.delay()
+        left = remaining()
+        if left is not None:
+            first_wait = min(first_wait, left)
+        done, _pending = wait([primary], timeout=first_wait)
+        if not done and remaining() != 0:
+            hedge = submit_in_context(hedge_executor, func, *args)
+            self._count('fired')
+            logger.info("Hedging %s after %.2fs", self.name, first_wait)
+
+        pending = {primary} if hedge is None else {primary, hedge}
+        errors = []
+        while pending:
+            done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                self._count('timeouts')
+                raise DeadlineExceeded(f"{self.name} exceeded the request deadline.")
+            for future in done:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                if future is hedge:
+                    self._count('won')
+                self.latency.observe(time.perf_counter() - started)
+                return future.result()
+        raise errors[0]
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "calls": self.calls,
+                "hedges_fired": self.fired,
+                "hedges_won": self.won,
+                "timeouts": self.timeouts,
+            }
+        return {**counters, "current_delay_seconds": self.delay(), "latency": self.latency.snapshot()}
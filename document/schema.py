@@ -5,17 +5,14 @@ from .models import Document
 import psycopg2
 import os
 import json
+from .gemini import get_gemini_client
 from .utils import transform_text_to_pgsql_command
-import google.generativeai as genai
 from decouple import config
 
-genai.configure(api_key=config('GEMINI_API_KEY'))
-model = genai.GenerativeModel('gemini-1.5-flash')
-
 class DocumentType(DjangoObjectType):
     class Meta:
         model = Document
-        fields = '__all__'
+        exclude = ('minhash',)  # Binary signature, not meant for clients
 
 
 class CommandResponse(graphene.ObjectType):
@@ -64,7 +61,7 @@ class Query(graphene.ObjectType):
             prompt = (
                 f"this is the answer for this question: {command}, answer is: {response_data}, make a short human answer"
             )
-            structured_response = model.generate_content(prompt).candidates[0].content.parts[0].text
+            structured_response = get_gemini_client().generate_text(prompt)
 
             return CommandResponse(
                 query=sql_command,
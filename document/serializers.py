@@ -1,8 +1,20 @@
 # serializers.py
 from rest_framework import serializers
-from .models import Document
+from .models import Document, IngestionJob
 
 class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
-        fields = '__all__'
\ No newline at end of file
+        exclude = ['minhash']
+        # Set by ingestion only: a client able to change them could point a document at another user's file
+        read_only_fields = [
+            'drive_file_id', 'storage_backend', 'checksum', 'file_size', 'mime_type', 'content_hash',
+        ]
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestionJob
+        fields = [
+            'id', 'kind', 'status', 'file_name', 'document', 'error', 'attempts', 'stage_timings',
+            'created_at', 'started_at', 'finished_at',
+        ]
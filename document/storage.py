@@ -0,0 +1,249 @@
+import glob
+import hashlib
+import io
+import mimetypes
+import mmap
+import os
+import re
+import uuid
+from contextlib import contextmanager
+
+from decouple import config
+from googleapiclient.errors import HttpError
+
+from .utils import (
+    DRIVE_STREAM_CHUNK_SIZE,
+    delete_file_from_drive,
+    download_file_from_drive,
+    drive_file_fields,
+    find_files_by_name,
+    get_drive_file,
+    stream_file_from_drive,
+    upload,
+)
+
+# Where new documents are stored on this deployment ('drive' or 'local'); existing
+# documents are always read from the backend recorded on their row
+STORAGE_BACKEND = config('STORAGE_BACKEND', default='drive')
+LOCAL_STORAGE_DIR = config(
+    'LOCAL_STORAGE_DIR', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'storage')
+)
+LOCAL_COPY_CHUNK_SIZE = 1024 * 1024
+UNSAFE_NAME_CHARS = re.compile(r'[^\w.() -]')
+
+
+# Keeps `<uuid>/<name>` ids within Document.drive_file_id
+LOCAL_NAME_MAX_LENGTH = 90
+
+
+def _safe_name(file_name):
+    name = UNSAFE_NAME_CHARS.sub('_', os.path.basename(file_name or '')) or 'document.pdf'
+    stem, extension = os.path.splitext(name)
+    return stem[:LOCAL_NAME_MAX_LENGTH - len(extension)] + extension
+
+
+class StorageError(Exception):
+    """A storage backend call failed."""
+
+
+class StoredFileMissing(StorageError):
+    """The file is not (or no longer) in the storage backend."""
+
+
+class StorageBackend:
+    """
+    Blob store for uploaded documents. `put` returns the Document field values
+    describing the stored file (file id, size, mime type, checksum, backend),
+    `get` a readable binary file object, `stream` the bytes `start`..`end`
+    (inclusive) in chunks, `stat` the same field values as `put`. A file that
+    does not exist raises StoredFileMissing, any other failure StorageError.
+    """
+    name = None
+    # Whether reads are remote and worth keeping in the node-local file cache
+    cacheable = True
+
+    def put(self, pdf_file, file_name):
+        raise NotImplementedError
+
+    def get(self, file_id):
+        raise NotImplementedError
+
+    def stream(self, file_id, start=0, end=None):
+        raise NotImplementedError
+
+    def stat(self, file_id):
+        raise NotImplementedError
+
+    def delete(self, file_id):
+        raise NotImplementedError
+
+    def find(self, file_name):
+        """
+        Field values (as `stat`) of the oldest stored file with this original name, for
+        documents stored before their file id was kept; None when there is none.
+        """
+        raise NotImplementedError
+
+    def local_path(self, file_id):
+        """Filesystem path of the file when it can be served directly, otherwise None."""
+        return None
+
+
+@contextmanager
+def _drive_errors():
+    try:
+        yield
+    except HttpError as error:
+        if error.resp.status == 404:
+            raise StoredFileMissing(str(error)) from error
+        raise StorageError(str(error)) from error
+
+
+class DriveStorage(StorageBackend):
+    name = 'drive'
+
+    def _fields(self, metadata):
+        return {**drive_file_fields(metadata), 'storage_backend': self.name}
+
+    def put(self, pdf_file, file_name):
+        with _drive_errors():
+            return self._fields(upload(pdf_file, file_name))
+
+    def get(self, file_id):
+        with _drive_errors():
+            return download_file_from_drive(file_id)
+
+    def stream(self, file_id, start=0, end=None):
+        with _drive_errors():
+            yield from stream_file_from_drive(file_id, start, end)
+
+    def stat(self, file_id):
+        with _drive_errors():
+            return self._fields(get_drive_file(file_id))
+
+    def delete(self, file_id):
+        with _drive_errors():
+            delete_file_from_drive(file_id)
+
+    def find(self, file_name):
+        # The name listing already carries size, mime type and checksum: no metadata call needed
+        with _drive_errors():
+            files = find_files_by_name(file_name)
+        return self._fields(files[0]) if files else None
+
+
+@contextmanager
+def _local_errors():
+    try:
+        yield
+    except FileNotFoundError as error:
+        raise StoredFileMissing(str(error)) from error
+    except OSError as error:
+        raise StorageError(str(error)) from error
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files under `root`, one directory per upload (`<uuid>/<file name>`, the id).
+    Reads are memory-mapped: no copy into a Python buffer, the page cache is shared
+    by every worker process, and whole-file downloads can be served with sendfile.
+    """
+    name = 'local'
+    cacheable = False
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, file_id):
+        path = os.path.abspath(os.path.join(self.root, file_id))
+        if os.path.commonpath([path, os.path.abspath(self.root)]) != os.path.abspath(self.root):
+            raise ValueError(f"Invalid file id: {file_id}")
+        return path
+
+    def put(self, pdf_file, file_name):
+        file_id = f"{uuid.uuid4().hex}/{_safe_name(file_name)}"
+        path = self._path(file_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        checksum = hashlib.md5(usedforsecurity=False)
+        size = 0
+        if hasattr(pdf_file, 'read'):
+            pdf_file.seek(0)
+            source = pdf_file
+        else:
+            source = open(pdf_file, 'rb')
+        try:
+            with open(path, 'wb') as target:
+                # Checksum computed while copying, in the format Drive reports (hex MD5)
+                while chunk := source.read(LOCAL_COPY_CHUNK_SIZE):
+                    checksum.update(chunk)
+                    target.write(chunk)
+                    size += len(chunk)
+        finally:
+            if source is not pdf_file:
+                source.close()
+        return self._fields(file_id, size, checksum.hexdigest())
+
+    def _fields(self, file_id, size, checksum=None):
+        return {
+            'drive_file_id': file_id,
+            'file_size': size,
+            'mime_type': mimetypes.guess_type(file_id)[0] or 'application/pdf',
+            'checksum': checksum,
+            'storage_backend': self.name,
+        }
+
+    def get(self, file_id):
+        with _local_errors(), open(self._path(file_id), 'rb') as file:
+            if not os.fstat(file.fileno()).st_size:
+                return io.BytesIO()
+            # The mapping stays valid after the descriptor is closed
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def stream(self, file_id, start=0, end=None, chunk_size=DRIVE_STREAM_CHUNK_SIZE):
+        with self.get(file_id) as mapped:
+            size = len(mapped) if isinstance(mapped, mmap.mmap) else 0  # Empty files are not mapped
+            stop = size if end is None else min(end + 1, size)
+            for position in range(start, stop, chunk_size):
+                yield mapped[position:min(position + chunk_size, stop)]
+
+    def stat(self, file_id):
+        with _local_errors():
+            return self._fields(file_id, os.path.getsize(self._path(file_id)))
+
+    def delete(self, file_id):
+        path = self._path(file_id)
+        with _local_errors():
+            os.unlink(path)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+    def find(self, file_name):
+        matches = glob.glob(os.path.join(glob.escape(self.root), '*', glob.escape(_safe_name(file_name))))
+        if not matches:
+            return None
+        # The oldest upload, like the Drive name lookup
+        oldest = min(matches, key=os.path.getmtime)
+        return self.stat(os.path.relpath(oldest, self.root).replace(os.sep, '/'))
+
+    def local_path(self, file_id):
+        path = self._path(file_id)
+        return path if os.path.isfile(path) else None
+
+
+BACKENDS = {
+    'drive': lambda: DriveStorage(),
+    'local': lambda: LocalStorage(LOCAL_STORAGE_DIR),
+}
+_backends = {}
+
+
+def get_storage(name=None):
+    """The storage backend called `name` (default: STORAGE_BACKEND), created once per process."""
+    name = name or STORAGE_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {name}. Available: {', '.join(BACKENDS)}")
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
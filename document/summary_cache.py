@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from decouple import config
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import SummaryCacheEntry
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_CACHE_MEMORY_ENTRIES = config('SUMMARY_CACHE_MEMORY_ENTRIES', default=256, cast=int)
+# Total size of the summaries kept in the database table
+SUMMARY_CACHE_MAX_BYTES = config('SUMMARY_CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+# The table size is checked (and trimmed) every N writes
+SUMMARY_CACHE_EVICT_EVERY = config('SUMMARY_CACHE_EVICT_EVERY', default=50, cast=int)
+
+
+def prompt_version(*parts):
+    """Short hash of everything that shapes a summary: changing any part invalidates old entries."""
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+
+
+def content_hash(text):
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+
+class SummaryCache:
+    """
+    Two-level summary cache: a per-process LRU in front of the summary_cache table,
+    keyed by the SHA-256 of the text and the prompt version. Cache failures never
+    break summarization; they are logged and treated as misses.
+    """
+
+    def __init__(self, version, memory_entries, max_bytes):
+        self.version = version
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key, summary):
+        with self._lock:
+            self._memory[key] = summary
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, text):
+        key = content_hash(text)
+        with self._lock:
+            summary = self._memory.get(key)
+            if summary is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return summary
+
+        try:
+            entry = SummaryCacheEntry.objects.filter(content_hash=key, prompt_version=self.version).first()
+            if entry is not None:
+                SummaryCacheEntry.objects.filter(pk=entry.pk).update(
+                    hits=F('hits') + 1, last_used_at=timezone.now()
+                )
+        except Exception:
+            logger.exception("Summary cache lookup failed")
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.db_hits += 1
+        self._remember(key, entry.summary)
+        return entry.summary
+
+    def set(self, text, summary):
+        key = content_hash(text)
+        self._remember(key, summary)
+        try:
+            SummaryCacheEntry.objects.update_or_create(
+                content_hash=key,
+                prompt_version=self.version,
+                defaults={'summary': summary, 'size_bytes': len(summary.encode('utf-8'))},
+            )
+        except Exception:
+            logger.exception("Summary cache write failed")
+            return
+
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % SUMMARY_CACHE_EVICT_EVERY == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Deletes least recently used rows until the table fits in max_bytes."""
+        try:
+            total = SummaryCacheEntry.objects.aggregate(total=Sum('size_bytes'))['total'] or 0
+            if total <= self.max_bytes:
+                return 0
+
+            deleted = 0
+            oldest = SummaryCacheEntry.objects.order_by('last_used_at').values_list('pk', 'size_bytes')
+            to_delete = []
+            for pk, size_bytes in oldest.iterator():
+                if total <= self.max_bytes:
+                    break
+                to_delete.append(pk)
+                total -= size_bytes
+            for start in range(0, len(to_delete), 500):
+                deleted += SummaryCacheEntry.objects.filter(pk__in=to_delete[start:start + 500]).delete()[0]
+        except Exception:
+            logger.exception("Summary cache eviction failed")
+            return 0
+
+        with self._lock:
+            self.evictions += deleted
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "prompt_version": self.version,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -1,3 +1,1030 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from user.models import User
+
+from . import ingestion
+from .buffers import UploadBuffer, spooled_buffer
+from .extraction import (
+    ExtractedText,
+    ExtractedTextCache,
+    ExtractionPool,
+    PageStream,
+    PdfExtractor,
+    extraction_stats,
+    extractor_chain,
+    get_extracted_text,
+    iter_pdf_pages,
+    text_cache,
+)
+from .file_cache import FileCache, iter_range
+from .gemini import RateLimiter
+from .http_range import parse_byte_range
+from .minhash import (
+    MINHASH_BANDS,
+    MINHASH_PERMUTATIONS,
+    _A,
+    _B,
+    band_buckets,
+    find_near_duplicates,
+    from_bytes,
+    index_document,
+    minhash_signature,
+    shingles,
+    similarity,
+    to_bytes,
+)
+from .models import Document, DocumentLshBucket, DocumentText, IngestionJob, SummaryCacheEntry
+from .resilience import (
+    DeadlineExceeded,
+    Hedger,
+    check_deadline,
+    remaining,
+    request_deadline,
+    without_deadline,
+)
+from .serializers import DocumentSerializer
+from .storage import LocalStorage, StoredFileMissing, get_storage
+from .summary_cache import SummaryCache, content_hash
+from .text_prep import WINDOW_SEPARATOR, _WhitespaceTokenizer, prepare_text
+
+
+class ParseByteRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        cases = [
+            # (header, size, expected)
+            (None, 1000, None),
+            ('', 1000, None),
+            ('bytes=0-99', 1000, (0, 99)),
+            ('bytes=100-', 1000, (100, 999)),  # Open-ended
+            ('bytes=0-5000', 1000, (0, 999)),  # Last position past the end is clamped
+            ('bytes=-50', 1000, (950, 999)),  # Suffix
+            ('bytes=-5000', 1000, (0, 999)),  # Suffix longer than the file
+            ('bytes=-0', 1000, False),
+            ('bytes=1000-', 1000, False),  # Out of range
+            ('bytes=1000-2000', 1000, False),
+            ('bytes=9-3', 1000, None),  # Invalid: ignored, whole file
+            ('bytes=0-1,5-6', 1000, None),  # Several ranges: whole file
+            ('bytes=-', 1000, None),
+            ('items=0-5', 1000, None),
+            ('bytes=-5', 0, False),  # Empty file
+            ('bytes=0-', 0, False),
+            (None, 0, None),
+        ]
+        for header, size, expected in cases:
+            with self.subTest(header=header, size=size):
+                self.assertEqual(parse_byte_range(header, size), expected)
+
+
+class ExtractedTextCacheTests(SimpleTestCase):
+    @staticmethod
+    def artifact(content_hash):
+        return ExtractedText(content_hash=content_hash, text=f"text of {content_hash}", page_count=1)
+
+    def test_hit_and_miss(self):
+        cache = ExtractedTextCache(max_entries=2)
+        cache.put(self.artifact('a'))
+        self.assertEqual(cache.get('a').text, "text of a")
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats(), {"entries": 1, "max_entries": 2, "hits": 1, "misses": 1})
+
+    def test_evicts_least_recently_used(self):
+        cache = ExtractedTextCache(max_entries=2)
+        cache.put(self.artifact('a'))
+        cache.put(self.artifact('b'))
+        cache.get('a')  # 'b' is now the least recently used
+        cache.put(self.artifact('c'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_disabled(self):
+        cache = ExtractedTextCache(max_entries=0)
+        cache.put(self.artifact('a'))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+# One token per word, so that budgets do not depend on the tiktoken encoding
+@mock.patch('document.text_prep._tokenizer', _WhitespaceTokenizer())
+@mock.patch('document.text_prep.TOKEN_WINDOW_SIZE', 4)
+class PrepareTextTests(SimpleTestCase):
+    text = (
+        "Invoice from Acme Corp "
+        "the the the the "
+        "total 1200 due 2024-05-01 "
+        "the the the the "
+        "the the the the "
+    )
+
+    def test_within_budget_unchanged(self):
+        prepared = prepare_text(self.text, 'summary', budget=20)
+        self.assertEqual(prepared.text, self.text)
+        self.assertEqual((prepared.tokens_total, prepared.tokens_kept), (20, 20))
+        self.assertFalse(prepared.truncated)
+
+    def test_keeps_opening_and_most_informative_windows(self):
+        prepared = prepare_text(self.text, 'classifier', budget=8)
+        self.assertEqual(
+            prepared.text, "Invoice from Acme Corp " + WINDOW_SEPARATOR + "total 1200 due 2024-05-01 "
+        )
+        self.assertEqual((prepared.tokens_total, prepared.tokens_kept, prepared.tokens_dropped), (20, 8, 12))
+        self.assertTrue(prepared.truncated)
+
+    def test_consecutive_windows_are_merged(self):
+        # The opening, the figures and (on a tie) the earliest filler window: no gap between them
+        prepared = prepare_text(self.text, 'classifier', budget=12)
+        self.assertEqual(prepared.text, "Invoice from Acme Corp the the the the total 1200 due 2024-05-01 ")
+
+    def test_never_exceeds_budget(self):
+        for budget in (1, 3, 4, 5, 9, 19):
+            with self.subTest(budget=budget):
+                prepared = prepare_text(self.text, 'sql', budget=budget)
+                self.assertLessEqual(prepared.tokens_kept, budget)
+                self.assertLessEqual(len(prepared.text.replace(WINDOW_SEPARATOR, " ").split()), budget)
+
+    def test_empty_text(self):
+        prepared = prepare_text(None, 'summary', budget=10)
+        self.assertEqual((prepared.text, prepared.tokens_total), ("", 0))
+
+
+class SummaryCacheTests(TestCase):
+    def make_cache(self, version='v1', memory_entries=8, max_bytes=1024 * 1024):
+        return SummaryCache(version, memory_entries, max_bytes)
+
+    def test_memory_hit(self):
+        cache = self.make_cache()
+        cache.set("some text", "a summary")
+        self.assertEqual(cache.get("some text"), "a summary")
+        self.assertEqual((cache.memory_hits, cache.db_hits, cache.misses), (1, 0, 0))
+
+    def test_database_fallback(self):
+        self.make_cache().set("some text", "a summary")
+        # Another process: empty memory, same table
+        cache = self.make_cache()
+        self.assertEqual(cache.get("some text"), "a summary")
+        self.assertEqual(cache.get("some text"), "a summary")
+        self.assertEqual((cache.memory_hits, cache.db_hits, cache.misses), (1, 1, 0))
+        self.assertEqual(SummaryCacheEntry.objects.get(content_hash=content_hash("some text")).hits, 1)
+
+    def test_prompt_version_is_part_of_the_key(self):
+        self.make_cache(version='v1').set("some text", "a summary")
+        cache = self.make_cache(version='v2')
+        self.assertIsNone(cache.get("some text"))
+        self.assertEqual(cache.misses, 1)
+
+    def test_memory_evicts_least_recently_used(self):
+        cache = self.make_cache(memory_entries=2)
+        cache.set("first", "summary 1")
+        cache.set("second", "summary 2")
+        cache.get("first")  # "second" is now the least recently used
+        cache.set("third", "summary 3")
+        self.assertEqual(cache.get("first"), "summary 1")
+        self.assertEqual(cache.get("second"), "summary 2")  # Dropped from memory, still in the table
+        self.assertEqual((cache.memory_hits, cache.db_hits), (2, 1))
+
+    def test_evict_trims_the_table_oldest_first(self):
+        cache = self.make_cache(max_bytes=20)
+        for index in range(3):
+            cache.set(f"text {index}", "x" * 10)
+        for index in range(3):
+            SummaryCacheEntry.objects.filter(content_hash=content_hash(f"text {index}")).update(
+                last_used_at=timezone.now() - timedelta(minutes=10 - index)
+            )
+        self.assertEqual(cache.evict(), 1)
+        self.assertFalse(SummaryCacheEntry.objects.filter(content_hash=content_hash("text 0")).exists())
+        self.assertEqual(SummaryCacheEntry.objects.count(), 2)
+
+
+class FakeClock:
+    """Stands in for the time module: sleeping advances the clock instantly."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('document.gemini.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(per_minute=60, burst=3)
+        deadline = self.clock.now + 60
+        for _ in range(3):
+            limiter.acquire(deadline)
+        self.assertEqual(self.clock.slept, 0)
+        limiter.acquire(deadline)  # Bucket empty: one token per second
+        self.assertAlmostEqual(self.clock.slept, 1.0)
+
+    def test_refills_up_to_capacity(self):
+        limiter = RateLimiter(per_minute=60, burst=2)
+        limiter.acquire(self.clock.now + 60)
+        limiter.acquire(self.clock.now + 60)
+        self.clock.now += 3600  # Idle for an hour: still only `burst` tokens
+        for _ in range(2):
+            limiter.acquire(self.clock.now + 60)
+        self.assertEqual(self.clock.slept, 0)
+        limiter.acquire(self.clock.now + 60)
+        self.assertAlmostEqual(self.clock.slept, 1.0)
+
+    def test_default_burst(self):
+        limiter = RateLimiter(per_minute=60)
+        self.assertEqual(limiter.capacity, 10)
+        self.assertEqual(RateLimiter(per_minute=3).capacity, 1)
+
+    def test_deadline(self):
+        limiter = RateLimiter(per_minute=60, burst=1)
+        limiter.acquire(self.clock.now + 60)
+        with self.assertRaises(TimeoutError):
+            limiter.acquire(self.clock.now + 0.5)
+        self.assertEqual(self.clock.slept, 0)
+
+
+class RequestDeadlineTests(SimpleTestCase):
+    def test_no_budget(self):
+        self.assertIsNone(remaining())
+        self.assertEqual(remaining(5), 5)
+        check_deadline("test")
+
+    def test_budget(self):
+        with request_deadline(10):
+            self.assertTrue(9 < remaining() <= 10)
+            self.assertEqual(remaining(1), 1)  # Capped at the default
+            self.assertIsNone(without_deadline(remaining))
+        self.assertIsNone(remaining())
+
+    def test_nested_budget_never_extends(self):
+        with request_deadline(1):
+            with request_deadline(100):
+                self.assertLessEqual(remaining(), 1)
+            with request_deadline(0.5):
+                self.assertLessEqual(remaining(), 0.5)
+            self.assertTrue(0.5 < remaining() <= 1)
+
+    def test_spent_budget(self):
+        with request_deadline(0):
+            self.assertEqual(remaining(), 0)
+            with self.assertRaises(DeadlineExceeded):
+                check_deadline("test")
+
+
+class HedgerTests(SimpleTestCase):
+    def test_fast_call_is_not_hedged(self):
+        hedger = Hedger('test', default_delay=1.0)
+        self.assertEqual(hedger.call(lambda value: value * 2, 21), 42)
+        self.assertEqual((hedger.calls, hedger.fired, hedger.won), (1, 0, 0))
+
+    def test_slow_call_is_hedged(self):
+        attempts = []
+        lock = threading.Lock()
+
+        def lookup():
+            with lock:
+                attempts.append(None)
+                first = len(attempts) == 1
+            if first:
+                time.sleep(0.5)
+                return 'primary'
+            return 'hedge'
+
+        hedger = Hedger('test', default_delay=0.05)
+        self.assertEqual(hedger.call(lookup), 'hedge')
+        self.assertEqual((hedger.calls, hedger.fired, hedger.won), (1, 1, 1))
+
+    def test_disabled(self):
+        hedger = Hedger('test', default_delay=0.0)
+        self.assertEqual(hedger.call(threading.current_thread, enabled=False), threading.current_thread())
+        self.assertEqual((hedger.calls, hedger.fired), (1, 0))
+
+    def test_error(self):
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            Hedger('test', default_delay=1.0).call(fail)
+
+    def test_deadline(self):
+        hedger = Hedger('test', default_delay=1.0)
+        with request_deadline(0.1), self.assertRaises(DeadlineExceeded):
+            hedger.call(time.sleep, 0.5)
+        self.assertEqual(hedger.timeouts, 1)
+
+    def test_delay_follows_observed_latency(self):
+        hedger = Hedger('test', default_delay=7.0)
+        self.assertEqual(hedger.delay(), 7.0)
+        with mock.patch('document.resilience.HEDGE_MIN_SAMPLES', 3):
+            for _ in range(3):
+                hedger.latency.observe(0.2)
+            self.assertEqual(hedger.delay(), 0.25)  # Upper bound of the p95 bucket
+
+
+class MinHashTests(SimpleTestCase):
+    words = [f"word{index}" for index in range(300)]
+
+    def test_signature(self):
+        signature = minhash_signature(" ".join(self.words))
+        self.assertEqual(signature.dtype, np.uint32)
+        self.assertEqual(len(signature), MINHASH_PERMUTATIONS)
+        self.assertIsNone(minhash_signature(""))
+        self.assertIsNone(minhash_signature(" -- ... "))
+
+    def test_signature_is_the_exact_universal_hash(self):
+        text = "The parties agree to the terms set out in the schedule below"
+        hashes = [zlib.crc32(value.encode('utf-8')) for value in shingles(text)]
+        prime = (1 << 61) - 1
+        expected = [
+            min(((int(a) * value + int(b)) % prime) & 0xFFFFFFFF for value in hashes) for a, b in zip(_A, _B)
+        ]
+        self.assertEqual(minhash_signature(text).tolist(), expected)
+
+    def test_layout_and_case_are_ignored(self):
+        self.assertTrue(np.array_equal(
+            minhash_signature("Total DUE: 1,200 EUR by 1 May."),
+            minhash_signature("total due\n1 200 eur by 1 may"),
+        ))
+
+    def test_similarity(self):
+        signature = minhash_signature(" ".join(self.words))
+        edited = list(self.words)
+        edited[150] = "changed"
+        self.assertEqual(similarity(signature, minhash_signature(" ".join(self.words))), 1.0)
+        self.assertGreater(similarity(signature, minhash_signature(" ".join(edited))), 0.85)
+        unrelated = " ".join(f"term{index}" for index in range(300))
+        self.assertLess(similarity(signature, minhash_signature(unrelated)), 0.1)
+
+    def test_bytes_round_trip(self):
+        signature = minhash_signature(" ".join(self.words))
+        data = to_bytes(signature)
+        self.assertEqual(len(data), 4 * MINHASH_PERMUTATIONS)
+        self.assertTrue(np.array_equal(from_bytes(data), signature))
+
+    def test_band_buckets(self):
+        signature = minhash_signature(" ".join(self.words))
+        buckets = band_buckets(signature)
+        self.assertEqual(len(buckets), MINHASH_BANDS)
+        self.assertEqual(buckets, band_buckets(signature.copy()))
+        self.assertTrue(all(-(1 << 63) <= bucket < (1 << 63) for bucket in buckets))
+
+        # Only the band holding the changed value gets another bucket
+        changed = signature.copy()
+        changed[0] += 1
+        self.assertEqual(
+            [index for index, (a, b) in enumerate(zip(buckets, band_buckets(changed))) if a != b], [0]
+        )
+
+    def test_band_index_is_mixed_in(self):
+        # Equal values in every band must still index different buckets per band
+        buckets = band_buckets(np.zeros(MINHASH_PERMUTATIONS, dtype=np.uint32))
+        self.assertEqual(len(set(buckets)), MINHASH_BANDS)
+
+
+class NearDuplicateTests(TestCase):
+    def test_category_filter_applies_before_the_candidate_limit(self):
+        owner = User.objects.create(username='owner', email='owner@example.com')
+        signature = minhash_signature(" ".join(f"word{index}" for index in range(300)))
+        edited = signature.copy()
+        edited[0] += 1  # Shares every band but the first
+        for category, document_signature in (('Legal', edited), ('Finance', signature)):
+            document = Document.objects.create(
+                owner=owner, manager=owner, category=category, summary="", file_name='a.pdf', status="pending",
+            )
+            index_document(document, document_signature)
+
+        # The Finance document shares more buckets and would take the only candidate slot
+        matches = find_near_duplicates(signature, categories=['Legal'], limit=1)
+        self.assertEqual([document.category for document, _score in matches], ['Legal'])
+
+
+
+class IngestionJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com')
+
+    def spool_file(self):
+        descriptor, path = tempfile.mkstemp(suffix='.pdf')
+        os.close(descriptor)
+        self.addCleanup(ingestion.remove_spool_file, path)
+        return path
+
+    def make_job(self, **fields):
+        return IngestionJob.objects.create(owner=self.owner, file_name='a.pdf', spool_path=self.spool_file(), **fields)
+
+    def make_document(self, **fields):
+        return Document.objects.create(
+            owner=self.owner, manager=self.owner, category='Finance', summary="A summary.", file_name='a.pdf',
+            status="pending", **fields,
+        )
+
+    def test_claim_oldest_job(self):
+        first = self.make_job()
+        self.make_job()
+        self.make_job(status=IngestionJob.STATUS_RUNNING)
+        job = ingestion.claim_next_job()
+        self.assertEqual(job.pk, first.pk)
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts), (IngestionJob.STATUS_RUNNING, 1))
+
+    def test_failed_attempt_is_requeued(self):
+        job = self.make_job(status=IngestionJob.STATUS_RUNNING, attempts=1)
+        with mock.patch('document.ingestion.process_document', side_effect=RuntimeError("Drive is down")):
+            ingestion.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (IngestionJob.STATUS_QUEUED, "Drive is down"))
+        self.assertTrue(os.path.exists(job.spool_path))
+
+    def test_last_attempt_fails_the_job(self):
+        job = self.make_job(status=IngestionJob.STATUS_RUNNING, attempts=ingestion.INGESTION_MAX_ATTEMPTS)
+        with mock.patch('document.ingestion.process_document', side_effect=RuntimeError("Drive is down")):
+            ingestion.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.STATUS_FAILED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertFalse(os.path.exists(job.spool_path))
+
+    def test_success(self):
+        job = self.make_job(status=IngestionJob.STATUS_RUNNING, attempts=1)
+        document = self.make_document()
+        with mock.patch('document.ingestion.process_document', return_value=document):
+            ingestion.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.document_id), (IngestionJob.STATUS_SUCCEEDED, document.pk))
+        self.assertFalse(os.path.exists(job.spool_path))
+
+    def test_stale_jobs(self):
+        stale = timezone.now() - timedelta(seconds=ingestion.INGESTION_JOB_TIMEOUT + 60)
+        retried = self.make_job(status=IngestionJob.STATUS_RUNNING, attempts=1, started_at=stale)
+        # Killed the worker on every attempt: failed, not put back in the queue
+        exhausted = self.make_job(
+            status=IngestionJob.STATUS_RUNNING, attempts=ingestion.INGESTION_MAX_ATTEMPTS, started_at=stale
+        )
+        running = self.make_job(status=IngestionJob.STATUS_RUNNING, attempts=1, started_at=timezone.now())
+
+        self.assertEqual(ingestion.requeue_stale_jobs(), 1)
+        for job, status in ((retried, IngestionJob.STATUS_QUEUED), (exhausted, IngestionJob.STATUS_FAILED),
+                            (running, IngestionJob.STATUS_RUNNING)):
+            job.refresh_from_db()
+            self.assertEqual(job.status, status)
+        self.assertFalse(os.path.exists(exhausted.spool_path))
+        self.assertTrue(os.path.exists(retried.spool_path))
+
+    def test_failed_save_leaves_no_document(self):
+        extracted = ExtractedText(content_hash='0' * 64, text="Invoice 42", page_count=1)
+        stored_file = {'drive_file_id': 'file-1', 'storage_backend': 'drive'}
+        storage = mock.Mock()
+
+        def extract(pdf_file, on_prefix=None, prefix_tokens=0, content_hash=None):
+            on_prefix(extracted.text)
+            return extracted
+
+        with mock.patch.multiple(
+            'document.ingestion',
+            hash_file=mock.Mock(return_value=extracted.content_hash),
+            get_extracted_text=extract,
+            classify_document=mock.Mock(return_value='Finance'),
+            summarize_document=mock.Mock(return_value="A summary."),
+            _route_manager=mock.Mock(return_value=self.owner.pk),
+            _upload=mock.Mock(return_value=stored_file),
+            _nearest_duplicate=mock.Mock(return_value=None),
+            store_text=mock.Mock(side_effect=RuntimeError("Database error")),
+            get_storage=mock.Mock(return_value=storage),
+        ), self.assertRaises(RuntimeError):
+            ingestion.process_document(IngestionJob.KIND_STANDARD, self.spool_file(), 'a.pdf', self.owner.pk)
+
+        # A retry starts from scratch: no Document from this attempt, no orphaned upload
+        self.assertFalse(Document.objects.exists())
+        storage.delete.assert_called_once_with('file-1')
+
+
+class SubmitStageTests(SimpleTestCase):
+    def test_closes_the_thread_connection(self):
+        def fail():
+            raise RuntimeError("Drive is down")
+
+        with mock.patch('document.ingestion.connection') as connection:
+            self.assertEqual(ingestion.submit_stage(ingestion.stage_executor, max, 1, 2).result(), 2)
+            with self.assertRaises(RuntimeError):
+                ingestion.submit_stage(ingestion.stage_executor, fail).result()
+        self.assertEqual(connection.close.call_count, 2)
+
+    def test_keeps_the_deadline(self):
+        with request_deadline(10):
+            left = ingestion.submit_stage(ingestion.stage_executor, remaining).result()
+        self.assertTrue(9 < left <= 10)
+
+
+class IntegrateDocumentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com')
+        cls.other = User.objects.create(username='other', email='other@example.com')
+
+    def integrate(self, owner, data=b"%PDF-1.4 old contract"):
+        extracted = ExtractedText(
+            content_hash=ingestion.hash_file(io.BytesIO(data)),
+            text="This agreement is made between the parties named below",
+            page_count=1,
+        )
+        stored_file = {'drive_file_id': 'file-1', 'storage_backend': 'drive'}
+        with mock.patch('document.ingestion.get_extracted_text', return_value=extracted), \
+                mock.patch('document.ingestion.summarize_document', return_value="A contract.") as summarize:
+            result = ingestion.integrate_document(
+                io.BytesIO(data), stored_file, 'contract.pdf', owner.pk, 'Legal', self.owner.pk
+            )
+        return result, summarize.call_count
+
+    def test_indexed_like_an_upload(self):
+        (document, created), _summaries = self.integrate(self.owner)
+        self.assertTrue(created)
+        self.assertEqual(document.content_hash, ingestion.hash_file(io.BytesIO(b"%PDF-1.4 old contract")))
+        self.assertTrue(DocumentText.objects.filter(document=document).exists())
+        self.assertTrue(DocumentLshBucket.objects.filter(document=document).exists())
+
+    def test_not_integrated_twice(self):
+        (document, _created), _summaries = self.integrate(self.owner)
+        (again, created), summaries = self.integrate(self.owner)
+        self.assertEqual((again.pk, created, summaries), (document.pk, False, 0))
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_other_owner_reuses_the_results(self):
+        (document, _created), _summaries = self.integrate(self.owner)
+        (copy, created), summaries = self.integrate(self.other)
+        self.assertTrue(created)
+        self.assertNotEqual(copy.pk, document.pk)
+        self.assertEqual((copy.owner_id, copy.summary, copy.drive_file_id), (self.other.pk, "A contract.", 'file-1'))
+        self.assertEqual(summaries, 0)
+
+
+class FileCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = FileCache(directory.name, max_bytes=10)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('file-1', 'md5'))
+        self.cache.put_file('file-1', 'md5', io.BytesIO(b"12345"))
+        with open(self.cache.get('file-1', 'md5'), 'rb') as file:
+            self.assertEqual(file.read(), b"12345")
+        self.assertIsNone(self.cache.get('file-1', 'other-md5'))  # Replaced file: another key
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["bytes_saved"]), (1, 2, 5))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put_file('a', 'md5', io.BytesIO(b"12345"))
+        self.cache.put_file('b', 'md5', io.BytesIO(b"12345"))
+        now = time.time()
+        os.utime(self.cache.path('a', 'md5'), (now - 100, now - 100))
+        os.utime(self.cache.path('b', 'md5'), (now - 50, now - 50))
+        self.cache.get('a', 'md5')  # 'b' is now the least recently used
+        self.cache.put_file('c', 'md5', io.BytesIO(b"12345"))
+        self.assertIsNone(self.cache.get('b', 'md5'))
+        self.assertIsNotNone(self.cache.get('a', 'md5'))
+        self.assertIsNotNone(self.cache.get('c', 'md5'))
+        self.assertEqual((self.cache.evictions, self.cache.evicted_bytes), (1, 5))
+
+    def test_larger_than_the_cache_is_not_kept(self):
+        self.cache.put_file('a', 'md5', io.BytesIO(b"x" * 11))
+        self.assertIsNone(self.cache.get('a', 'md5'))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_tee(self):
+        chunks = list(self.cache.tee('a', 'md5', iter([b"ab", b"cd"])))
+        self.assertEqual(chunks, [b"ab", b"cd"])
+        with open(self.cache.get('a', 'md5'), 'rb') as file:
+            self.assertEqual(file.read(), b"abcd")
+
+    def test_interrupted_tee_leaves_nothing(self):
+        chunks = self.cache.tee('a', 'md5', iter([b"ab", b"cd"]))
+        self.assertEqual(next(chunks), b"ab")
+        chunks.close()  # Client disconnected
+        self.assertIsNone(self.cache.get('a', 'md5'))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_iter_range_survives_eviction(self):
+        self.cache.put_file('a', 'md5', io.BytesIO(b"0123456789"))
+        path = self.cache.get('a', 'md5')
+        chunks = iter_range(open(path, 'rb'), 2, 8, chunk_size=3)
+        os.unlink(path)  # Evicted by another request once opened
+        self.assertEqual(list(chunks), [b"234", b"567", b"8"])
+
+
+class DocumentSerializerTests(TestCase):
+    def test_stored_file_fields_are_read_only(self):
+        owner = User.objects.create(username='owner', email='owner@example.com')
+        document = Document.objects.create(
+            owner=owner, manager=owner, category='Finance', summary="A summary.", file_name='a.pdf',
+            status="pending", drive_file_id='file-1', storage_backend='drive', content_hash='a' * 64,
+        )
+        serializer = DocumentSerializer(document, partial=True, data={
+            'status': 'approved',
+            'drive_file_id': 'someone-elses-file',
+            'storage_backend': 'local',
+            'checksum': '0' * 32,
+            'file_size': 1,
+            'mime_type': 'text/html',
+            'content_hash': 'b' * 64,
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        document.refresh_from_db()
+        self.assertEqual(document.status, 'approved')
+        self.assertEqual(
+            (document.drive_file_id, document.storage_backend, document.checksum, document.file_size,
+             document.mime_type, document.content_hash),
+            ('file-1', 'drive', None, None, None, 'a' * 64),
+        )
+
+
+class FakeExtractor(PdfExtractor):
+    """Yields `pages`, raising once page `fail_at` is reached (None: never)."""
+
+    def __init__(self, name, pages, fail_at=None):
+        self.name = name
+        self.pages = pages
+        self.fail_at = fail_at
+
+    def page_count(self, pdf_file):
+        if self.fail_at == 0:
+            raise ValueError(f"{self.name} cannot parse this file")
+        return len(self.pages)
+
+    def iter_pages(self, pdf_file, start=0, stop=None):
+        for index in range(start, len(self.pages) if stop is None else min(stop, len(self.pages))):
+            if index == self.fail_at:
+                raise ValueError(f"{self.name} cannot parse page {index}")
+            yield self.pages[index]
+
+
+class FakeExtractorsMixin:
+    """Replaces the extractor chain with `extractors` (preferred first) for the duration of a test."""
+
+    def use_extractors(self, *extractors):
+        for patcher in (
+            mock.patch.dict('document.extraction.EXTRACTORS', {extractor.name: extractor for extractor in extractors}),
+            mock.patch('document.extraction.PDF_EXTRACTOR', extractors[0].name),
+            mock.patch('document.extraction.PDF_EXTRACTOR_FALLBACKS', ",".join(e.name for e in extractors[1:])),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class ExtractorChainTests(FakeExtractorsMixin, SimpleTestCase):
+    pages = ["page 0 ", "page 1 ", "page 2 ", "page 3 "]
+
+    def test_preferred_extractor(self):
+        self.use_extractors(FakeExtractor('fast', self.pages), FakeExtractor('slow', ["unused"] * 4))
+        self.assertEqual(list(iter_pdf_pages(io.BytesIO(b"%PDF"))), self.pages)
+
+    def test_falls_back_when_the_preferred_extractor_fails(self):
+        self.use_extractors(FakeExtractor('fast', self.pages, fail_at=0), FakeExtractor('slow', self.pages))
+        fallbacks = extraction_stats.fallbacks
+        self.assertEqual(list(iter_pdf_pages(io.BytesIO(b"%PDF"))), self.pages)
+        self.assertEqual(extraction_stats.fallbacks, fallbacks + 1)
+
+    def test_fallback_resumes_after_the_pages_already_read(self):
+        self.use_extractors(
+            FakeExtractor('fast', ["fast 0 ", "fast 1 ", "fast 2 ", "fast 3 "], fail_at=2),
+            FakeExtractor('slow', ["slow 0 ", "slow 1 ", "slow 2 ", "slow 3 "]),
+        )
+        self.assertEqual(list(iter_pdf_pages(io.BytesIO(b"%PDF"))), ["fast 0 ", "fast 1 ", "slow 2 ", "slow 3 "])
+
+    def test_no_extractor_can_parse_the_file(self):
+        self.use_extractors(FakeExtractor('fast', self.pages, fail_at=0), FakeExtractor('slow', self.pages, fail_at=0))
+        with self.assertRaisesRegex(ValueError, "No PDF extractor could parse the file"):
+            list(iter_pdf_pages(io.BytesIO(b"%PDF")))
+
+    def test_chain_without_duplicates(self):
+        self.use_extractors(FakeExtractor('fast', []), FakeExtractor('slow', []), FakeExtractor('fast', []))
+        self.assertEqual([extractor.name for extractor in extractor_chain()], ['fast', 'slow'])
+        self.assertEqual([extractor.name for extractor in extractor_chain('slow')], ['slow', 'fast'])
+
+
+class ExtractionPoolTests(FakeExtractorsMixin, SimpleTestCase):
+    @staticmethod
+    def pdf_path(size):
+        descriptor, path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(b"x" * size)
+        return path
+
+    @staticmethod
+    def executor(page_count):
+        """Stands in for the process pool: only the page count is asked for when planning the ranges."""
+        future = Future()
+        future.set_result(page_count)
+        return mock.Mock(submit=mock.Mock(return_value=future))
+
+    def test_ranges(self):
+        path = self.pdf_path(100)
+        self.addCleanup(os.remove, path)
+        pool = ExtractionPool(2, split_min_bytes=50, split_pages=10)
+        cases = [
+            # (page count, max pages, expected ranges)
+            (25, 0, [(0, 10), (10, 20), (20, 25)]),
+            (25, 15, [(0, 10), (10, 15)]),  # Not past the page cap
+            (8, 0, [(0, 8)]),
+            (None, 0, [(0, None)]),  # Page count unknown: one range
+            (None, 40, [(0, 40)]),
+        ]
+        for page_count, max_pages, expected in cases:
+            with self.subTest(page_count=page_count, max_pages=max_pages):
+                self.assertEqual(pool._ranges(self.executor(page_count), path, None, max_pages), expected)
+
+    def test_small_files_are_not_split(self):
+        path = self.pdf_path(10)
+        self.addCleanup(os.remove, path)
+        executor = self.executor(100)
+        pool = ExtractionPool(2, split_min_bytes=50, split_pages=10)
+        self.assertEqual(pool._ranges(executor, path, None, 0), [(0, None)])
+        executor.submit.assert_not_called()
+
+    def test_broken_pool_resumes_after_the_pages_already_yielded(self):
+        self.use_extractors(FakeExtractor('fast', ["thread 0 ", "thread 1 ", "thread 2 ", "thread 3 "]))
+
+        def broken(*args):
+            yield "pool 0 "
+            yield "pool 1 "
+            raise BrokenProcessPool("A worker was killed")
+
+        pool = mock.Mock(enabled=True, iter_pages=broken)
+        with mock.patch('document.extraction.extraction_pool', pool):
+            pages = list(iter_pdf_pages('/tmp/document.pdf'))
+        self.assertEqual(pages, ["pool 0 ", "pool 1 ", "thread 2 ", "thread 3 "])
+        pool.restart.assert_called_once_with()
+
+
+class PageStreamTests(FakeExtractorsMixin, SimpleTestCase):
+    def setUp(self):
+        self.use_extractors(FakeExtractor('fast', ["one ", "two ", "three "]))
+
+    def test_reads_every_page(self):
+        stream = PageStream(io.BytesIO(b"%PDF"), max_pages=0, max_bytes=0)
+        self.assertEqual(list(stream), ["one ", "two ", "three "])
+        self.assertEqual((stream.text, stream.pages_read, stream.truncated), ("one two three ", 3, False))
+        self.assertEqual(stream.page_ends(), (4, 8, 14))
+
+    def test_page_cap(self):
+        cases = [
+            # (max pages, pages read, truncated)
+            (2, 2, True),
+            (3, 3, False),  # Exactly as many pages as the cap: nothing was cut
+            (5, 3, False),
+        ]
+        for max_pages, pages_read, truncated in cases:
+            with self.subTest(max_pages=max_pages):
+                stream = PageStream(io.BytesIO(b"%PDF"), max_pages=max_pages, max_bytes=0)
+                list(stream)
+                self.assertEqual((stream.pages_read, stream.truncated), (pages_read, truncated))
+
+    def test_byte_cap(self):
+        stream = PageStream(io.BytesIO(b"%PDF"), max_pages=0, max_bytes=10)
+        self.assertEqual(list(stream), ["one ", "two "])  # A third page would make 14 bytes
+        self.assertEqual((stream.size_bytes, stream.truncated), (8, True))
+
+
+@mock.patch('document.text_prep._tokenizer', _WhitespaceTokenizer())
+class EarlyPrefixTests(FakeExtractorsMixin, SimpleTestCase):
+    def setUp(self):
+        self.pages = ["first page words ", "second page ", "third page ", "fourth "]
+        self.use_extractors(FakeExtractor('fast', self.pages))
+        self.addCleanup(text_cache.clear)
+
+    def test_prefix_sent_once_enough_pages_are_read(self):
+        prefixes = []
+        extracted = get_extracted_text(io.BytesIO(b"%PDF"), prefixes.append, 4, content_hash='prefix-test')
+        # Two pages hold the 4 tokens the classifier needs; extraction went on for the rest
+        self.assertEqual(prefixes, ["first page words second page "])
+        self.assertEqual((extracted.text, extracted.page_count), ("".join(self.pages), 4))
+        self.assertEqual(extracted.prefix(4), prefixes[0])
+
+    def test_short_document_sends_the_whole_text(self):
+        prefixes = []
+        get_extracted_text(io.BytesIO(b"%PDF"), prefixes.append, 100, content_hash='short-test')
+        self.assertEqual(prefixes, ["".join(self.pages)])
+
+    def test_cached_text_sends_its_prefix(self):
+        get_extracted_text(io.BytesIO(b"%PDF"), content_hash='cached-test')
+        prefixes = []
+        get_extracted_text(io.BytesIO(b"%PDF"), prefixes.append, 4, content_hash='cached-test')
+        self.assertEqual(prefixes, ["first page words second page "])
+
+
+class UploadBufferTests(SimpleTestCase):
+    def test_in_memory_upload_gets_independent_readers(self):
+        with UploadBuffer(SimpleUploadedFile('a.pdf', b"%PDF-1.4 content")) as buffer:
+            first, second = buffer.reader(), buffer.reader()
+            self.assertEqual(first.read(4), b"%PDF")
+            self.assertEqual(second.read(), b"%PDF-1.4 content")  # Not moved by the other stage
+            self.assertEqual(first.read(), b"-1.4 content")
+
+    def test_upload_on_disk_is_read_in_place(self):
+        uploaded = TemporaryUploadedFile('a.pdf', 'application/pdf', 16, None)
+        self.addCleanup(uploaded.close)
+        uploaded.write(b"%PDF-1.4 content")
+        uploaded.flush()
+        with UploadBuffer(uploaded) as buffer:
+            self.assertEqual(buffer.reader(), uploaded.temporary_file_path())
+
+    @mock.patch('document.buffers.UPLOAD_MEMORY_MAX_BYTES', 8)
+    def test_spooled_buffer_rolls_over_to_disk(self):
+        with spooled_buffer() as buffer:
+            buffer.write(b"1234")
+            self.assertFalse(buffer._rolled)
+            buffer.write(b"56789")
+            self.assertTrue(buffer._rolled)
+
+
+class ContentHashDedupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com')
+        cls.other = User.objects.create(username='other', email='other@example.com')
+
+    def setUp(self):
+        descriptor, self.path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(b"%PDF-1.4 invoice 42")
+        self.addCleanup(os.remove, self.path)
+        self.original = Document.objects.create(
+            owner=self.owner, manager=self.owner, category='invoice', summary="Invoice 42.", file_name='invoice.pdf',
+            status="pending", content_hash=ingestion.hash_file(self.path), storage_backend='drive',
+            drive_file_id='file-1', file_size=19, checksum='0' * 32,
+        )
+
+    def test_same_bytes_skip_every_stage(self):
+        with mock.patch('document.ingestion.get_extracted_text') as extract, \
+                mock.patch('document.ingestion._upload') as upload:
+            timings = {}
+            document = ingestion.process_document(
+                IngestionJob.KIND_STANDARD, self.path, 'copy.pdf', self.other.pk, timings
+            )
+        extract.assert_not_called()
+        upload.assert_not_called()
+        self.assertNotEqual(document.pk, self.original.pk)
+        self.assertEqual(timings['duplicate_of'], self.original.pk)
+        self.assertEqual(
+            (document.owner_id, document.category, document.summary, document.drive_file_id, document.content_hash),
+            (self.other.pk, 'invoice', "Invoice 42.", 'file-1', self.original.content_hash),
+        )
+
+    def test_other_taxonomy_is_not_a_duplicate(self):
+        # The same bytes uploaded as a custom document get their own custom category
+        self.assertEqual(ingestion.find_duplicates([self.original.content_hash], IngestionJob.KIND_CUSTOM), {})
+        self.assertEqual(
+            ingestion.find_duplicates([self.original.content_hash], IngestionJob.KIND_STANDARD),
+            {self.original.content_hash: self.original},
+        )
+
+    def test_earliest_document_is_the_original(self):
+        Document.objects.create(
+            owner=self.other, manager=self.owner, category='invoice', summary="Invoice 42.", file_name='copy.pdf',
+            status="pending", content_hash=self.original.content_hash,
+        )
+        originals = ingestion.find_duplicates([self.original.content_hash], IngestionJob.KIND_STANDARD)
+        self.assertEqual(originals[self.original.content_hash].pk, self.original.pk)
+
+
+class LocalStorageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = LocalStorage(directory.name)
+
+    def test_put_and_read_back(self):
+        data = b"%PDF-1.4 " + b"x" * 100
+        stored = self.storage.put(io.BytesIO(data), 'report.pdf')
+        self.assertEqual(stored['file_size'], len(data))
+        self.assertEqual(stored['checksum'], hashlib.md5(data).hexdigest())
+        self.assertEqual((stored['mime_type'], stored['storage_backend']), ('application/pdf', 'local'))
+        file_id = stored['drive_file_id']
+        with self.storage.get(file_id) as file:
+            self.assertEqual(file.read(), data)
+        self.assertEqual(b"".join(self.storage.stream(file_id, 2, 11, chunk_size=4)), data[2:12])
+        self.assertEqual(self.storage.stat(file_id)['file_size'], len(data))
+        self.assertTrue(os.path.isfile(self.storage.local_path(file_id)))
+
+    def test_empty_file(self):
+        file_id = self.storage.put(io.BytesIO(b""), 'empty.pdf')['drive_file_id']
+        with self.storage.get(file_id) as file:
+            self.assertEqual(file.read(), b"")
+        self.assertEqual(list(self.storage.stream(file_id)), [])
+
+    def test_unsafe_names_are_sanitized(self):
+        file_id = self.storage.put(io.BytesIO(b"%PDF"), '../../etc/pass wd?.pdf')['drive_file_id']
+        self.assertRegex(file_id, r'^[0-9a-f]{32}/pass wd_\.pdf$')
+
+    def test_path_traversal_is_rejected(self):
+        for file_id in ('../outside.pdf', '../../etc/passwd', '/etc/passwd', 'a/../../outside.pdf'):
+            with self.subTest(file_id=file_id):
+                with self.assertRaises(ValueError):
+                    self.storage.get(file_id)
+                with self.assertRaises(ValueError):
+                    self.storage.local_path(file_id)
+
+    def test_missing_file(self):
+        file_id = self.storage.put(io.BytesIO(b"%PDF"), 'gone.pdf')['drive_file_id']
+        self.storage.delete(file_id)
+        self.assertIsNone(self.storage.local_path(file_id))
+        for operation in (self.storage.get, self.storage.stat, self.storage.delete):
+            with self.subTest(operation=operation.__name__), self.assertRaises(StoredFileMissing):
+                operation(file_id)
+        with self.assertRaises(StoredFileMissing):
+            list(self.storage.stream(file_id))
+
+    def test_find_returns_the_oldest_upload(self):
+        first = self.storage.put(io.BytesIO(b"first"), 'report.pdf')['drive_file_id']
+        second = self.storage.put(io.BytesIO(b"second"), 'report.pdf')['drive_file_id']
+        now = time.time()
+        os.utime(self.storage.local_path(first), (now - 100, now - 100))
+        os.utime(self.storage.local_path(second), (now - 50, now - 50))
+        self.assertEqual(self.storage.find('report.pdf')['drive_file_id'], first)
+        self.assertIsNone(self.storage.find('other.pdf'))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_storage('ftp')
+
+
+class ProcessBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner', email='owner@example.com')
+
+    @staticmethod
+    def extract(pdf_file, content_hash=None):
+        return ExtractedText(content_hash=content_hash, text=f"Invoice number {content_hash[:12]} due", page_count=1)
+
+    def test_batch(self):
+        files = [
+            SimpleUploadedFile('a.pdf', b"%PDF-1.4 first"),
+            SimpleUploadedFile('b.pdf', b"%PDF-1.4 second"),
+            SimpleUploadedFile('c.pdf', b"%PDF-1.4 first"),  # Same bytes as a.pdf
+        ]
+        classify = mock.Mock(side_effect=lambda texts, custom: ['invoice'] * len(texts))
+        upload = mock.Mock(side_effect=lambda pdf_file, file_name: {'drive_file_id': f"id-{file_name}"})
+        with mock.patch.multiple(
+            'document.ingestion',
+            get_extracted_text=mock.Mock(side_effect=self.extract),
+            classify_documents=classify,
+            summarize_document=mock.Mock(return_value="An invoice."),
+            _route_manager=mock.Mock(return_value=self.owner.pk),
+            _upload=upload,
+            _nearest_duplicate=mock.Mock(return_value=None),
+        ):
+            results = ingestion.process_batch(files, self.owner.pk)
+
+        self.assertEqual([result['status'] for result in results], ['created'] * 3)
+        # One batched classification and one upload per distinct file
+        classify.assert_called_once()
+        self.assertEqual(len(classify.call_args.args[0]), 2)
+        self.assertEqual(upload.call_count, 2)
+        self.assertEqual(results[2]['duplicate_of'], results[0]['document'].pk)
+        self.assertEqual(results[2]['document'].drive_file_id, 'id-a.pdf')
+        self.assertEqual(DocumentText.objects.count(), 2)
+
+    def test_failed_file_does_not_fail_the_batch(self):
+        def upload(pdf_file, file_name):
+            if file_name == 'b.pdf':
+                raise RuntimeError("Drive is down")
+            return {'drive_file_id': f"id-{file_name}"}
+
+        files = [SimpleUploadedFile('a.pdf', b"%PDF-1.4 first"), SimpleUploadedFile('b.pdf', b"%PDF-1.4 second")]
+        with mock.patch.multiple(
+            'document.ingestion',
+            get_extracted_text=mock.Mock(side_effect=self.extract),
+            classify_documents=mock.Mock(side_effect=lambda texts, custom: ['invoice'] * len(texts)),
+            summarize_document=mock.Mock(return_value="An invoice."),
+            _route_manager=mock.Mock(return_value=self.owner.pk),
+            _upload=mock.Mock(side_effect=upload),
+            _nearest_duplicate=mock.Mock(return_value=None),
+        ):
+            results = ingestion.process_batch(files, self.owner.pk)
+
+        self.assertEqual([result['status'] for result in results], ['created', 'failed'])
+        self.assertIn("Drive is down", results[1]['error'])
+        self.assertEqual(Document.objects.count(), 1)
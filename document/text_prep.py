@@ -0,0 +1,160 @@
+import logging
+import re
+import threading
+from dataclasses import dataclass
+
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+# Token budget of the text handed to each consumer
+TOKEN_BUDGETS = {
+    'classifier': config('TOKEN_BUDGET_CLASSIFIER', default=1024, cast=int),
+    'summary': config('TOKEN_BUDGET_SUMMARY', default=32000, cast=int),
+    'sql': config('TOKEN_BUDGET_SQL', default=2000, cast=int),
+}
+TOKENIZER_ENCODING = config('TOKENIZER_ENCODING', default='cl100k_base')
+# Size of the windows the text is cut into when it exceeds its budget
+TOKEN_WINDOW_SIZE = config('TOKEN_WINDOW_SIZE', default=256, cast=int)
+WINDOW_SEPARATOR = "\n[...]\n"
+
+
+class _WhitespaceTokenizer:
+    """Fallback when the tiktoken encoding cannot be loaded (e.g. offline): one token per word."""
+
+    def encode(self, text):
+        return re.findall(r'\S+\s*', text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    import tiktoken
+
+                    _tokenizer = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    logger.warning("tiktoken encoding unavailable (%s), counting words instead", e)
+                    _tokenizer = _WhitespaceTokenizer()
+    return _tokenizer
+
+
+def count_tokens(text):
+    return len(get_tokenizer().encode(text or ""))
+
+
+@dataclass(frozen=True)
+class PreparedText:
+    text: str
+    consumer: str
+    budget: int
+    tokens_total: int
+    tokens_kept: int
+
+    @property
+    def tokens_dropped(self):
+        return self.tokens_total - self.tokens_kept
+
+    @property
+    def truncated(self):
+        return self.tokens_dropped > 0
+
+
+class _PreparationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._consumers = {}
+
+    def record(self, prepared):
+        with self._lock:
+            stats = self._consumers.setdefault(prepared.consumer, {
+                "texts": 0, "truncated": 0, "tokens_total": 0, "tokens_kept": 0,
+            })
+            stats["texts"] += 1
+            stats["truncated"] += int(prepared.truncated)
+            stats["tokens_total"] += prepared.tokens_total
+            stats["tokens_kept"] += prepared.tokens_kept
+
+    def snapshot(self):
+        with self._lock:
+            return {consumer: dict(stats) for consumer, stats in self._consumers.items()}
+
+
+preparation_stats = _PreparationStats()
+
+
+def _informativeness(window_tokens, window_text):
+    """Cheap score favouring varied vocabulary and figures (amounts, dates, references)."""
+    if not window_tokens:
+        return 0.0
+    distinct_ratio = len(set(window_tokens)) / len(window_tokens)
+    digit_density = sum(character.isdigit() for character in window_text) / max(len(window_text), 1)
+    return distinct_ratio + 2 * digit_density
+
+
+def prepare_text(text, consumer, budget=None):
+    """
+    Fits `text` into the token budget of `consumer`. Text within budget is returned
+    unchanged. Otherwise the opening window (title, parties, headers) is always kept
+    and the remaining budget goes to the most informative windows, in document order.
+    """
+    budget = budget if budget is not None else TOKEN_BUDGETS[consumer]
+    text = text or ""
+    tokenizer = get_tokenizer()
+    tokens = tokenizer.encode(text)
+
+    if len(tokens) <= budget:
+        prepared = PreparedText(text, consumer, budget, len(tokens), len(tokens))
+        preparation_stats.record(prepared)
+        return prepared
+
+    window_size = max(1, min(TOKEN_WINDOW_SIZE, budget))
+    windows = [tokens[start:start + window_size] for start in range(0, len(tokens), window_size)]
+    texts = [tokenizer.decode(window) for window in windows]
+
+    selected = {0}
+    kept = len(windows[0])
+    ranked = sorted(
+        range(1, len(windows)), key=lambda index: _informativeness(windows[index], texts[index]), reverse=True
+    )
+    for index in ranked:
+        if kept + len(windows[index]) > budget:
+            continue
+        selected.add(index)
+        kept += len(windows[index])
+
+    # Merge consecutive windows so separators only mark real gaps
+    parts = []
+    previous = None
+    for index in sorted(selected):
+        if previous is not None and index == previous + 1:
+            parts[-1] += texts[index]
+        else:
+            parts.append(texts[index])
+        previous = index
+
+    prepared = PreparedText(WINDOW_SEPARATOR.join(parts), consumer, budget, len(tokens), kept)
+    preparation_stats.record(prepared)
+    logger.info(
+        "Prepared text for %s: kept %s of %s tokens (%s dropped)",
+        consumer, prepared.tokens_kept, prepared.tokens_total, prepared.tokens_dropped,
+    )
+    return prepared
+
+
+def split_into_chunks(text, chunk_tokens):
+    """Splits text into consecutive pieces of at most `chunk_tokens` tokens."""
+    tokenizer = get_tokenizer()
+    tokens = tokenizer.encode(text or "")
+    return [
+        tokenizer.decode(tokens[start:start + chunk_tokens]) for start in range(0, len(tokens), chunk_tokens)
+    ] or [""]
@@ -0,0 +1,121 @@
+import codecs
+import zlib
+
+from decouple import config
+
+from .extraction import ExtractedText
+from .models import DocumentText
+
+try:
+    import zstandard
+except ImportError:  # Optional: zlib is used when the zstandard package is not installed
+    zstandard = None
+
+TEXT_STORE_CODEC = config(
+    'TEXT_STORE_CODEC', default=DocumentText.CODEC_ZSTD if zstandard is not None else DocumentText.CODEC_ZLIB
+)
+TEXT_STORE_LEVEL = config('TEXT_STORE_LEVEL', default=6, cast=int)
+# Decompressed bytes produced per step by the streaming accessor
+TEXT_STREAM_CHUNK_SIZE = config('TEXT_STREAM_CHUNK_SIZE', default=64 * 1024, cast=int)
+
+
+def compress(text, codec=TEXT_STORE_CODEC):
+    data = (text or "").encode('utf-8')
+    if codec == DocumentText.CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("The zstandard package is required for the zstd codec.")
+        return zstandard.ZstdCompressor(level=TEXT_STORE_LEVEL).compress(data), len(data)
+    if codec == DocumentText.CODEC_ZLIB:
+        return zlib.compress(data, TEXT_STORE_LEVEL), len(data)
+    raise ValueError(f"Unknown text codec: {codec}")
+
+
+def _decompressor(codec):
+    if codec == DocumentText.CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("The zstandard package is required to read zstd texts.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == DocumentText.CODEC_ZLIB:
+        return zlib.decompressobj()
+    raise ValueError(f"Unknown text codec: {codec}")
+
+
+def iter_decompressed(codec, data, chunk_size=TEXT_STREAM_CHUNK_SIZE):
+    """
+    Yields the text in pieces while decompressing, so that at most about
+    `chunk_size` bytes of decompressed text are held at a time.
+    """
+    decompressor = _decompressor(codec)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    data = memoryview(bytes(data))
+    # Feed the compressed bytes in small steps: one step never inflates to much more than chunk_size
+    step = max(1024, chunk_size // 16)
+    for start in range(0, len(data), step):
+        piece = decoder.decode(decompressor.decompress(data[start:start + step]))
+        if piece:
+            yield piece
+    tail = decoder.decode(decompressor.flush(), final=True)
+    if tail:
+        yield tail
+
+
+def store_text(document, extracted):
+    """Saves (or replaces) the compressed ExtractedText of a document."""
+    DocumentText.objects.update_or_create(document=document, defaults=_row_values(extracted))
+
+
+def text_rows(documents_and_texts):
+    """Unsaved DocumentText rows for bulk_create, from (document, ExtractedText) pairs."""
+    return [
+        DocumentText(document=document, **_row_values(extracted)) for document, extracted in documents_and_texts
+    ]
+
+
+def _row_values(extracted):
+    data, text_bytes = compress(extracted.text)
+    return {
+        'codec': TEXT_STORE_CODEC,
+        'data': data,
+        'text_bytes': text_bytes,
+        'page_count': extracted.page_count,
+        'page_ends': list(extracted.page_ends),
+        'truncated': extracted.truncated,
+    }
+
+
+def _stored_text(document):
+    """The DocumentText of a document, or of an identical upload (same content hash) when it has none."""
+    stored = DocumentText.objects.filter(document=document).first()
+    if stored is None and document.content_hash:
+        stored = DocumentText.objects.filter(document__content_hash=document.content_hash).first()
+    return stored
+
+
+def get_document_text(document):
+    """Full extracted text of a document (decompressed on demand), or None when it was never stored."""
+    stored = _stored_text(document)
+    if stored is None:
+        return None
+    return "".join(iter_decompressed(stored.codec, stored.data))
+
+
+def load_extracted_text(document):
+    """The stored text as an ExtractedText (what ingestion worked from), or None when it was never stored."""
+    stored = _stored_text(document)
+    if stored is None:
+        return None
+    return ExtractedText(
+        content_hash=document.content_hash or "",
+        text="".join(iter_decompressed(stored.codec, stored.data)),
+        page_count=stored.page_count,
+        page_ends=tuple(stored.page_ends),
+        truncated=stored.truncated,
+    )
+
+
+def iter_document_text(document, chunk_size=TEXT_STREAM_CHUNK_SIZE):
+    """Streams the extracted text of a document in pieces; yields nothing when it was never stored."""
+    stored = _stored_text(document)
+    if stored is None:
+        return
+    yield from iter_decompressed(stored.codec, stored.data, chunk_size)
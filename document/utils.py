@@ -1,45 +1,99 @@
 from decouple import config
 from django.contrib.auth import get_user_model
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
 import os
-import google.generativeai as genai
+import time
 from requests import HTTPError
-import io
-import PyPDF2
+from concurrent.futures import ThreadPoolExecutor
 from transformers import pipeline
+from .buffers import spooled_buffer
+from .classifiers import get_classifier
+from .drive import drive_client
+from .categories import CUSTOM_DOCUMENT_CATEGORIES, DOCUMENT_CATEGORIES
+from .gemini import GEMINI_MODEL, get_gemini_client
 from .models import Document
+from .resilience import Hedger, check_deadline, submit_in_context
+from .model_registry import registry
+from .summary_cache import SUMMARY_CACHE_MAX_BYTES, SUMMARY_CACHE_MEMORY_ENTRIES, SummaryCache, prompt_version
+from .text_prep import TOKEN_BUDGETS, TOKENIZER_ENCODING, count_tokens, prepare_text, split_into_chunks
 from stable_baselines3 import PPO  # Exemple de modèle RL
 import numpy as np
 
-SCOPES = ['https://www.googleapis.com/auth/drive']
-SERVICE_ACCOUNT_FILE = os.path.join(os.path.dirname(__file__), 'service-account.json')
 PARENT_FOLDER_ID = config('PARENT_FOLDER_ID')
+# Drive file metadata stored on Document (see drive_file_fields)
+DRIVE_FILE_FIELDS = 'id, name, size, mimeType, md5Checksum'
+# Drive transport: upload/download chunk size and retries on 5xx/429
+DRIVE_CHUNK_SIZE = config('DRIVE_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+DRIVE_NUM_RETRIES = config('DRIVE_NUM_RETRIES', default=2, cast=int)
+# Bytes fetched per ranged Drive request when streaming a download to the client
+DRIVE_STREAM_CHUNK_SIZE = config('DRIVE_STREAM_CHUNK_SIZE', default=1024 * 1024, cast=int)
+# Hedged requests (second attempt after the observed p95) for idempotent calls
+HEDGE_DRIVE_READS = config('HEDGE_DRIVE_READS', default=True, cast=bool)
+HEDGE_SUMMARIES = config('HEDGE_SUMMARIES', default=False, cast=bool)
+# Hedge delays (seconds) used until enough latencies have been observed to estimate the p95
+HEDGE_DRIVE_READS_DELAY = config('HEDGE_DRIVE_READS_DELAY', default=1.0, cast=float)
+HEDGE_SUMMARIES_DELAY = config('HEDGE_SUMMARIES_DELAY', default=20.0, cast=float)
+SUMMARY_MODEL = GEMINI_MODEL
+# Documents longer than this (tokens) are summarized with map-reduce
+SUMMARY_MAP_REDUCE_THRESHOLD = config('SUMMARY_MAP_REDUCE_THRESHOLD', default=24000, cast=int)
+SUMMARY_CHUNK_TOKENS = config('SUMMARY_CHUNK_TOKENS', default=8000, cast=int)
+SUMMARY_MAX_CHUNKS = config('SUMMARY_MAX_CHUNKS', default=32, cast=int)
+SUMMARY_MAP_WORKERS = config('SUMMARY_MAP_WORKERS', default=4, cast=int)
+RL_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'rl_model', 'rl_model', 'saved_model_v2.zip')
+
+drive_lookup_hedger = Hedger('drive_lookup', default_delay=HEDGE_DRIVE_READS_DELAY)
+summary_hedger = Hedger('gemini_summary', default_delay=HEDGE_SUMMARIES_DELAY)
+
+# Heavy models are loaded once per worker process, on first use
+registry.register('summarizer', lambda: pipeline("summarization"))
+registry.register('routing-policy', lambda: PPO.load(RL_MODEL_PATH))
 
 
 def authenticate():
-    credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    service = build('drive', 'v3', credentials=credentials)
-    return service
+    # Credentials and discovery are cached per process; the service and its transport per thread
+    return drive_client.service()
+
+
+def drive_file_fields(metadata):
+    """Document field values from a Drive file resource (as returned with DRIVE_FILE_FIELDS)."""
+    size = metadata.get('size')
+    return {
+        'drive_file_id': metadata.get('id'),
+        'file_size': int(size) if size is not None else None,
+        'mime_type': metadata.get('mimeType'),
+        'checksum': metadata.get('md5Checksum'),
+    }
 
 
-def upload(file_path, file_name):
+def upload(pdf_file, file_name):
+    """
+    Uploads a PDF given by path or binary file object (read from its start) and
+    returns the Drive file resource (DRIVE_FILE_FIELDS).
+    """
     service = authenticate()
 
     file_metadata = {
         'name': file_name,
         'parents': [PARENT_FOLDER_ID]
     }
-    media = MediaFileUpload(file_path, resumable=True)
+    if hasattr(pdf_file, 'read'):
+        pdf_file.seek(0)
+        media = MediaIoBaseUpload(pdf_file, mimetype='application/pdf', resumable=True, chunksize=DRIVE_CHUNK_SIZE)
+    else:
+        media = MediaFileUpload(pdf_file, resumable=True, chunksize=DRIVE_CHUNK_SIZE)
 
-    # Upload the file
-    file = service.files().create(
+    # Upload the file chunk by chunk, giving up once the request budget is spent
+    request = service.files().create(
         body=file_metadata,
         media_body=media,
-        fields='id'
-    ).execute()
+        fields=DRIVE_FILE_FIELDS
+    )
+    file = None
+    with drive_client.timed('upload'):
+        while file is None:
+            check_deadline('Drive upload')
+            _status, file = request.next_chunk(num_retries=DRIVE_NUM_RETRIES)
 
     file_id = file.get('id')
 
@@ -48,39 +102,104 @@ def upload(file_path, file_name):
         'type': 'anyone',
         'role': 'reader'
     }
-    service.permissions().create(
-        fileId=file_id,
-        body=permission
-    ).execute()
+    check_deadline('Drive permission update')
+    with drive_client.timed('permissions'):
+        service.permissions().create(
+            fileId=file_id,
+            body=permission
+        ).execute(num_retries=DRIVE_NUM_RETRIES)
 
     print(f"File '{file_name}' uploaded successfully. File ID: {file_id}")
 
-    return file_id  # Return the file ID if needed
+    return file
 
 
 # Make sure to import MediaFileUpload
 
+SUMMARY_INSTRUCTIONS = (
+    "Generate a detailed and concise summary  in the form of a paragraphe for the document titled . ensurin g the content is purely descriptive, highly detailed, and suitable for use as a database description. please do not include in your response anything else and no need to say the doc name again. i want to mention the exact name and values  in the summary"
+)
+CHUNK_SUMMARY_INSTRUCTIONS = (
+    "The text above is one part of a longer document. Summarize this part in a detailed paragraph, "
+    "keeping the exact names, dates, amounts and values it mentions. Do not include anything else."
+)
+REDUCE_SUMMARY_PREFIX = "The following paragraphs summarize consecutive parts of one document, in order:\n\n"
+
+# Any change to the prompts, the model or the text budgets yields a new version,
+# so summaries produced the old way are no longer served from the cache
+summary_cache = SummaryCache(
+    prompt_version(
+        SUMMARY_MODEL, SUMMARY_INSTRUCTIONS, CHUNK_SUMMARY_INSTRUCTIONS, REDUCE_SUMMARY_PREFIX,
+        TOKENIZER_ENCODING, TOKEN_BUDGETS['summary'], SUMMARY_MAP_REDUCE_THRESHOLD, SUMMARY_CHUNK_TOKENS,
+        SUMMARY_MAX_CHUNKS,
+    ),
+    SUMMARY_CACHE_MEMORY_ENTRIES,
+    SUMMARY_CACHE_MAX_BYTES,
+)
+
+
+def _generate_summary(prompt):
+    # Summaries are idempotent: optionally hedge slow calls with a second request
+    return summary_hedger.call(
+        get_gemini_client().generate_text, prompt, SUMMARY_MODEL, enabled=HEDGE_SUMMARIES
+    )
+
+
 def summarize_document(document_text: str):
-    # Configure the Gemini API with your API key from the env file
-    genai.configure(api_key=config('GEMINI_API_KEY'))
-    model = genai.GenerativeModel('gemini-1.5-flash')
+    # Identical text summarized with the same prompts is served from the cache
+    summary = summary_cache.get(document_text)
+    if summary is not None:
+        print("Summary served from cache")
+        return summary
+
+    summary = _summarize_uncached(document_text)
+    if summary:
+        summary_cache.set(document_text, summary)
+    return summary
 
-    print("document text", document_text)
+
+def _summarize_uncached(document_text: str):
+    # Long documents are summarized chunk by chunk, then the partial summaries are merged
+    if count_tokens(document_text) > SUMMARY_MAP_REDUCE_THRESHOLD:
+        return summarize_long_document(document_text)
+
+    # Keep the prompt within the summary token budget
+    prepared = prepare_text(document_text, 'summary')
+    print(f"Summary input: {prepared.tokens_kept}/{prepared.tokens_total} tokens")
 
     # Create a prompt for the model
     prompt = (
-        f"{document_text} Generate a detailed and concise summary  in the form of a paragraphe for the document titled . ensurin g the content is purely descriptive, highly detailed, and suitable for use as a database description. please do not include in your response anything else and no need to say the doc name again. i want to mention the exact name and values  in the summary"
+        f"{prepared.text} {SUMMARY_INSTRUCTIONS}"
     )
 
     # Generate a summary for the document
-    summary = model.generate_content(prompt)
-
-    try:
-        summary_text = summary.candidates[0].content.parts[0].text
-    except AttributeError as e:
-        summary_text = None
+    return _generate_summary(prompt)
+
+
+def summarize_long_document(document_text: str):
+    """
+    Map-reduce summarization: token-bounded chunks are summarized concurrently
+    (at most SUMMARY_MAP_WORKERS calls in flight), then one last call turns the
+    partial summaries into the final paragraph.
+    """
+    # Beyond SUMMARY_MAX_CHUNKS chunks, keep the most informative parts of the text
+    prepared = prepare_text(document_text, 'summary', budget=SUMMARY_CHUNK_TOKENS * SUMMARY_MAX_CHUNKS)
+    chunks = split_into_chunks(prepared.text, SUMMARY_CHUNK_TOKENS)
+    print(f"Summarizing {prepared.tokens_kept}/{prepared.tokens_total} tokens in {len(chunks)} chunks")
+
+    with ThreadPoolExecutor(max_workers=min(SUMMARY_MAP_WORKERS, len(chunks))) as executor:
+        futures = [
+            submit_in_context(executor, _generate_summary, f"{chunk} {CHUNK_SUMMARY_INSTRUCTIONS}")
+            for chunk in chunks
+        ]
+        partial_summaries = [future.result() for future in futures]
+
+    partial_summaries = [summary for summary in partial_summaries if summary]
+    if not partial_summaries:
+        return None
 
-    return summary_text
+    prompt = REDUCE_SUMMARY_PREFIX + "\n\n".join(partial_summaries) + f"\n\n{SUMMARY_INSTRUCTIONS}"
+    return _generate_summary(prompt)
 
 
 def transform_text_to_pgsql_command(text):
@@ -92,15 +211,14 @@ def transform_text_to_pgsql_command(text):
         schema.append(f"{column_name} ({column_type})")
     table_schema = ", ".join(schema)
 
-    # Configure the genai API
-    genai.configure(api_key=config("GEMINI_API_KEY"))
-    model = genai.GenerativeModel('gemini-1.5-flash')
+    # Bound the user question to the SQL token budget
+    question = prepare_text(text, 'sql').text
 
     # Prompt construction
     prompt = (
         f"You are a PostgreSQL expert. Given an input table schema and a question, "
         f"generate a valid PostgreSQL query to answer the question. "
-        f"The question is: {text} and the table schema is as follows:\n"
+        f"The question is: {question} and the table schema is as follows:\n"
 
         f"Table 'documents':\n"
         f"  - id (PK, INT)\n"
@@ -138,60 +256,50 @@ def transform_text_to_pgsql_command(text):
 
     # Generate the PostgreSQL command
     try:
-        pgsql_command = model.generate_content(prompt).candidates[0].content.parts[0].text
+        pgsql_command = get_gemini_client().generate_text(prompt)
         return pgsql_command
     except Exception as e:
         return f"Error generating PostgreSQL command: {e}"
 
 
-def get_old_file_by_name(filename):
-    service = authenticate()  # Assuming authenticate() sets up the Google API client
-    try:
-        # Use the files().list() method to search for files by name
+def _list_files_by_name(filename):
+    service = authenticate()
+    check_deadline('Drive file lookup')
+    with drive_client.timed('list'):
         results = service.files().list(
             q=f"name = '{filename}' and trashed = false",
             spaces='drive',
-            fields="files(id, name)"
-        ).execute()
+            orderBy='createdTime',
+            fields=f"files({DRIVE_FILE_FIELDS})"
+        ).execute(num_retries=DRIVE_NUM_RETRIES)
+    return results.get('files', [])
 
-        files = results.get('files', [])
 
-        if not files:
-            print("No files found.")
-            return None
+def find_files_by_name(filename):
+    # Name lookups are idempotent reads: hedge them when the first call is slow.
+    # Each attempt runs on its own hedge thread and so uses that thread's Drive service.
+    return drive_lookup_hedger.call(_list_files_by_name, filename, enabled=HEDGE_DRIVE_READS)
 
-        # Fetch the file content using its ID
-        file_id = files[0]['id']
 
-        # Get the media content of the file (this returns a MediaIoBaseDownload object)
-        request = service.files().get_media(fileId=file_id)
-        file_io = io.BytesIO()  # Create an in-memory byte stream
-        downloader = MediaIoBaseDownload(file_io, request)
+def _download(service, file_id, file_io):
+    request = service.files().get_media(fileId=file_id)
+    downloader = MediaIoBaseDownload(file_io, request, chunksize=DRIVE_CHUNK_SIZE)
 
-        done = False
+    done = False
+    with drive_client.timed('download'):
         while not done:
-            status, done = downloader.next_chunk()
-
-        # Return the binary data
-        file_io.seek(0)  # Reset stream position to the beginning
-        return file_io
+            check_deadline('Drive download')
+            status, done = downloader.next_chunk(num_retries=DRIVE_NUM_RETRIES)
+            print(f"Download progress: {int(status.progress() * 100)}%")
 
-    except HttpError as error:
-        print(f"An error occurred: {error}")
-        return None
+    file_io.seek(0)
+    return file_io
 
 
 def get_file_by_name(filename):
-    service = authenticate()
     try:
         # Use the files().list() method to search for files by name
-        results = service.files().list(
-            q=f"name = '{filename}' and trashed = false",
-            spaces='drive',
-            fields="files(id, name)",
-        ).execute()
-
-        files = results.get('files', [])
+        files = find_files_by_name(filename)
 
         if not files:
             print("No files found.")
@@ -207,98 +315,110 @@ def get_file_by_name(filename):
 
 def download_file_from_drive(file_id):
     service = authenticate()
-    request = service.files().get_media(fileId=file_id)
-    file_io = io.BytesIO()
-    downloader = MediaIoBaseDownload(file_io, request)
-
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-        print(f"Download progress: {int(status.progress() * 100)}%")
-
-    file_io.seek(0)
-    return file_io
-
-
-def extract_text_from_pdf(pdf_file):
-    pdf_reader = PyPDF2.PdfReader(pdf_file)
-    text = ""
-    for page_num in range(len(pdf_reader.pages)):
-        page = pdf_reader.pages[page_num]
-        text += page.extract_text()
-    return text
-
-
-def classify_document(text: str) -> str:
-    # Predefined categories
-    categories = ["report", "contract", "invoice", "day-off"]
-
-    # Validate input
+    return _download(service, file_id, spooled_buffer())
+
+
+def get_drive_file(file_id):
+    """Drive file resource (DRIVE_FILE_FIELDS) of `file_id`."""
+    check_deadline('Drive metadata lookup')
+    with drive_client.timed('get'):
+        return authenticate().files().get(fileId=file_id, fields=DRIVE_FILE_FIELDS).execute(
+            num_retries=DRIVE_NUM_RETRIES
+        )
+
+
+def delete_file_from_drive(file_id):
+    check_deadline('Drive delete')
+    with drive_client.timed('delete'):
+        authenticate().files().delete(fileId=file_id).execute(num_retries=DRIVE_NUM_RETRIES)
+
+
+def _fetch_range(request, first, last):
+    """One ranged GET of a media request, retried like the googleapiclient calls on 5xx/429."""
+    headers = {**request.headers, 'range': f'bytes={first}-{last}'}
+    for attempt in range(DRIVE_NUM_RETRIES + 1):
+        response, content = request.http.request(request.uri, method='GET', headers=headers)
+        if response.status < 500 and response.status != 429 or attempt == DRIVE_NUM_RETRIES:
+            break
+        time.sleep(2 ** attempt)
+    if response.status not in (200, 206):
+        raise HttpError(response, content, uri=request.uri)
+    return response, content
+
+
+def stream_file_from_drive(file_id, start=0, end=None, chunk_size=DRIVE_STREAM_CHUNK_SIZE):
+    """
+    Yields the bytes `start`..`end` (inclusive; None for the end of the file) of a
+    Drive file as they arrive, one ranged request of `chunk_size` bytes at a time,
+    so at most one chunk is held in memory.
+    """
+    request = authenticate().files().get_media(fileId=file_id)
+    position = start
+    with drive_client.timed('stream'):
+        while end is None or position <= end:
+            last = position + chunk_size - 1 if end is None else min(end, position + chunk_size - 1)
+            response, content = _fetch_range(request, position, last)
+            if response.status == 200:
+                # The range was ignored and the whole file came back
+                yield content[position:None if end is None else end + 1]
+                return
+            if not content:
+                return
+            yield content
+            position += len(content)
+            total = response.get('content-range', '').rpartition('/')[2]
+            if total.isdigit() and position >= int(total):
+                return
+
+
+def _validate_classifier_input(text, categories):
     if not text or not isinstance(text, str):
         raise ValueError("Input text must be a non-empty string.")
     if not categories:
         raise ValueError("Categories list must contain at least one label.")
 
-    # Load a pre-trained zero-shot classification pipeline from Hugging Face
-    classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
 
-    # Perform classification
-    result = classifier(text, candidate_labels=categories)
+def classify_document(text: str) -> str:
+    categories = DOCUMENT_CATEGORIES
+
+    # Validate input
+    _validate_classifier_input(text, categories)
 
-    predicted_category = result['labels'][0]
-    return predicted_category
+    # Classify the budgeted text with the configured engine (models are shared per process)
+    return get_classifier().classify([prepare_text(text, 'classifier').text], categories)[0]
 
 
 def classify_custom_document(text: str) -> str:
-    categories = [
-        "Documentation", "Design", "Proposal", "Memo", "Agreement", "Receipt", "Letter",
-        "Manual", "Presentation", "Email", "Resume", "Minutes", "Checklist", "Policy", "Procedure",
-        "Research Paper", "Whitepaper", "Guideline", "Testimonial", "Certificate", "Order",
-        "SOW (Statement of Work)", "Project Plan", "Budget", "Financial Statement", "Contract Amendment",
-        "Project Update", "Job Description", "Non-disclosure Agreement (NDA)", "Tender", "Legal Notice",
-        "Patent", "Press Release", "Event Flyer", "Newsletter", "Statement", "Application Form", "Transcript",
-        "Report Summary", "Project Charter", "Presentation Slides", "Terms and Conditions", "Agreement Addendum",
-        "Purchase Order", "Order Confirmation", "Business Letter", "Letter of Intent", "Internal Memo",
-        "Customer Feedback", "Work Order", "Audit Report", "Risk Assessment", "Compliance Report", "Tax Report",
-        "Logistics Report", "Contract Proposal", "Employee Handbook", "Employee Onboarding", "Training Materials",
-        "Sales Proposal", "Marketing Plan", "Client Brief", "Service Level Agreement (SLA)", "Product Specification",
-        "Performance Review", "Meeting Agenda", "Product Roadmap", "Change Request", "Job Application",
-        "Exit Interview", "Workplace Safety Plan", "Employee Evaluation", "Supplier Agreement", "Project Budget",
-        "Supplier Invoice", "Asset Management", "Health & Safety Report", "Vendor Contract", "Technical Documentation",
-        "Patent Application", "Purchase Requisition", "Event Proposal", "Business Continuity Plan", "Strategic Plan",
-        "Legal Brief", "Customer Agreement", "Travel Request", "Expense Report", "Software Release Notes",
-        "Audit Trail", "Project Milestones", "Service Report", "IT Incident Report", "Support Ticket",
-        "Client Feedback", "Team Meeting Notes", "Employee Benefits Guide", "Operational Plan",
-        "Board Meeting Minutes", "Company Newsletter", "Product Review", "Service Agreement", "Customer Service Log",
-        "Communication Plan", "Leadership Brief", "Marketing Report", "Team Performance Report",
-        "Crisis Management Plan"]
+    categories = CUSTOM_DOCUMENT_CATEGORIES
 
     # Validate input
-    if not text or not isinstance(text, str):
-        raise ValueError("Input text must be a non-empty string.")
-    if not categories:
-        raise ValueError("Categories list must contain at least one label.")
+    _validate_classifier_input(text, categories)
+
+    # Classify the budgeted text with the configured engine (models are shared per process)
+    return get_classifier().classify([prepare_text(text, 'classifier').text], categories)[0]
 
-    # Load a pre-trained zero-shot classification pipeline from Hugging Face
-    classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
 
-    # Perform classification
-    result = classifier(text, candidate_labels=categories)
+def classify_documents(texts, custom=False):
+    """
+    Classifies many texts together (batched forward passes) with the configured engine.
+    Returns the predicted category for each text, in order.
+    """
+    categories = CUSTOM_DOCUMENT_CATEGORIES if custom else DOCUMENT_CATEGORIES
+    for text in texts:
+        _validate_classifier_input(text, categories)
+    if not texts:
+        return []
 
-    predicted_category = result['labels'][0]
-    return predicted_category
+    return get_classifier().classify([prepare_text(text, 'classifier').text for text in texts], categories)
 
 
 def summarize_text(text):
-    summarizer = pipeline("summarization")  # Chargement du modèle de résumé
+    summarizer = registry.get('summarizer')  # Modèle de résumé partagé
     summary = summarizer(text, max_length=130, min_length=30,
                          do_sample=False)  # Ajustez les paramètres selon vos besoins
     return summary[0]['summary_text']
 
 
-model = PPO.load("document/rl_model/rl_model/saved_model_v2.zip")
-
-
 def predict_manager(category):
     User = get_user_model()
     Manager = User.objects.filter(role="manager")
@@ -313,6 +433,7 @@ def predict_manager(category):
         raise ValueError(f"Catégorie inconnue: {category}")
 
     # Utiliser le modèle pour prédire l'action (le manager à choisir)
+    model = registry.get('routing-policy')
     action, _states = model.predict(np.array([state]))  # Nous passons l'état à l'algorithme RL
 
     # Retourner le manager en fonction de l'action choisie
@@ -331,10 +452,6 @@ def predict_manager(category):
 
 
 def get_manager_by_gemini(category):
-    # Configure the Gemini API with the key from the settings
-    genai.configure(api_key=config('GEMINI_API_KEY'))
-    model = genai.GenerativeModel('gemini-1.5-flash')
-
     # Retrieve all users with the role of manager
     User = get_user_model()
     managers = User.objects.filter(role="manager")
@@ -354,10 +471,8 @@ def get_manager_by_gemini(category):
     )
     print(prompt)
 
-    # Use Gemini to generate the response
-    response = model.generate_content(prompt)
-
-    chosen_manager_id = response.candidates[0].content.parts[0].text
+    # Use the shared Gemini client to generate the response
+    chosen_manager_id = get_gemini_client().generate_text(prompt)
     print(f"Chosen manager ID: {chosen_manager_id}")
 
     # Find the manager by ID in the database
@@ -1,28 +1,46 @@
 import genai
+import itertools
 from decouple import config
+from django.core.exceptions import ValidationError
 from django.db.models import Count
-from django.http import FileResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from django.utils import timezone
+from django.utils.http import content_disposition_header
 from datetime import timedelta, datetime
 from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from project.rest_permissions import IsAuthenticated, IsAdmin, IsManager, IsEmployee
 from user.services.user_services import get_user_id, get_user_by_id, get_user_role
-from .models import Document
-from .serializers import DocumentSerializer
+from .models import Document, IngestionJob
+from .buffers import UploadBuffer
+from .drive import drive_client
+from .file_cache import file_cache, iter_range
+from .http_range import parse_byte_range
+from .extraction import extraction_pool, extraction_stats, text_cache
+from .ingestion import (
+    INGESTION_ASYNC,
+    INGESTION_BATCH_MAX_FILES,
+    enqueue_upload,
+    integrate_document,
+    process_batch,
+    process_document,
+    worker_pool,
+)
+from .gemini import get_gemini_client
+from .minhash import find_near_duplicates, from_bytes
+from .model_registry import registry
+from .resilience import DOWNLOAD_REQUEST_BUDGET, DeadlineExceeded, request_deadline
+from .text_prep import preparation_stats
+from .serializers import DocumentSerializer, IngestionJobSerializer
+from .storage import STORAGE_BACKEND, StorageError, StoredFileMissing, get_storage
 from .utils import (
-    classify_document,
-    download_file_from_drive,
-    extract_text_from_pdf,
-    upload,
-    summarize_document,
-    get_file_by_name, classify_custom_document, summarize_text, get_old_file_by_name, predict_manager,
-    get_manager_by_gemini
+    drive_lookup_hedger,
+    summary_hedger,
+    summary_cache,
 )
-import tempfile
 from graphql.execution import execute
 from graphene_django.views import GraphQLView
 from .schema import schema  # Assuming this schema is saved in 'graphql/schema.py'
@@ -38,6 +56,11 @@ def get_document_form(request):
     return render(request, 'get-document.html')
 
 
+# Document fields get_document needs to serve a file
+STORED_FILE_FIELDS = ('drive_file_id', 'file_size', 'mime_type', 'checksum', 'storage_backend')
+DOWNLOAD_FIELDS = ('file_name',) + STORED_FILE_FIELDS
+
+
 class DocumentViewSet(viewsets.ModelViewSet):
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
@@ -46,170 +69,266 @@ class DocumentViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated, IsAdmin | IsEmployee])
     def upload_and_save(self, request):
         """
-        Handles uploading a document, extracting its category and summary, 
-        and saving it along with metadata. Allowed for Admin and Manager only.
+        Handles uploading a document. The file is queued for ingestion (category,
+        summary, Drive upload, manager routing) and a job is returned immediately;
+        poll `ingestion_status` with the job id to get the resulting document.
+        Allowed for Admin and Employee only.
         """
+        return self._ingest_upload(request, IngestionJob.KIND_STANDARD)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def upload_and_save_custom_document(self, request):
+        return self._ingest_upload(request, IngestionJob.KIND_CUSTOM)
+
+    def _ingest_upload(self, request, kind):
         file = request.FILES.get('file')
         if not file:
             return Response({'error': 'File is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        file_name = file.name
-        print(f"Processing file: {file_name}")
-
-        # Save the uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            for chunk in file.chunks():
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
-
-        print('Extracting category...')
-        category = classify_document(extract_text_from_pdf(temp_file_path))
-        print(f"Category: {category}")
-
-        print('Uploading file...')
-        upload(temp_file_path, file_name)
-        print('File uploaded successfully.')
-
-        print('Generating summary...')
-        summary = summarize_document(extract_text_from_pdf(temp_file_path))
-        print(f"Summary: {summary}")
-
-        # Collect metadata from the request
         token = request.headers.get('Authorization')
         token = token[len("Bearer "):]
-        print(f"Token: {token}")
         owner_id = get_user_id(token)
 
-        manager_id = predict_manager(category).id
+        if not INGESTION_ASYNC:
+            timings = {}
+            # Read the upload where Django spooled it (memory or temporary file): no extra copy
+            with UploadBuffer(file) as buffer:
+                document = process_document(kind, buffer, file.name, owner_id, timings)
+            data = self.serializer_class(document).data
+            data['stage_timings'] = timings
+            return Response(data, status=status.HTTP_201_CREATED)
 
-        # Create a Document object and save it to the database
-        document = Document.objects.create(
-            owner_id=owner_id,
-            category=category,
-            manager_id=manager_id,
-            summary=summary,
-            file_name=file_name,
-            status="pending"
-        )
+        job = enqueue_upload(file, owner_id, kind)
+        print(f"Queued file {file.name} as ingestion job {job.id}")
+        return Response(IngestionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
-        serializer = self.serializer_class(document)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
-    def upload_and_save_custom_document(self, request):
-        file = request.FILES.get('file')
-        if not file:
-            return Response({'error': 'File is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated, IsAdmin | IsEmployee])
+    def upload_batch(self, request):
+        """
+        Uploads many documents at once (multipart field `files`, repeated). Classification
+        is batched and the Document rows are created together; the response lists the
+        outcome of every file. Pass `custom=true` to use the custom category taxonomy.
+        """
+        files = request.FILES.getlist('files')
+        if not files:
+            return Response({'error': 'At least one file is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(files) > INGESTION_BATCH_MAX_FILES:
+            return Response({'error': f'A batch can contain at most {INGESTION_BATCH_MAX_FILES} files.'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        file_name = file.name
-        print(f"Processing file: {file_name}")
+        token = request.headers.get('Authorization')
+        token = token[len("Bearer "):]
+        owner_id = get_user_id(token)
 
-        # Save the uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            for chunk in file.chunks():
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
+        custom = str(request.data.get('custom', '')).lower() in ('1', 'true', 'yes')
+        kind = IngestionJob.KIND_CUSTOM if custom else IngestionJob.KIND_STANDARD
+        print(f"Processing batch of {len(files)} files")
+        results = process_batch(files, owner_id, kind)
 
-        print('Extracting category...')
-        category = classify_custom_document(extract_text_from_pdf(temp_file_path))
-        print(f"Category: {category}")
+        for result in results:
+            if 'document' in result:
+                result['document'] = self.serializer_class(result['document']).data
 
-        print('Generating summary...')
-        summary = summarize_document(extract_text_from_pdf(temp_file_path))
-        print(f"Summary: {summary}")
+        created = sum(1 for result in results if result['status'] == 'created')
+        return Response({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
 
-        print('Uploading file...')
-        upload(temp_file_path, file_name)
-        print('File uploaded successfully.')
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def ingestion_status(self, request):
+        """
+        Returns the state of an ingestion job, and the created document once it has succeeded.
+        """
+        job_id = request.query_params.get('job_id')
+        if not job_id:
+            return Response({'message': 'Job ID is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Collect metadata from the request
         token = request.headers.get('Authorization')
         token = token[len("Bearer "):]
-        print(f"Token: {token}")
-        owner_id = get_user_id(token)
+        user_id = get_user_id(token)
+
         try:
-            manager_id = predict_manager(category).id
-        except ValueError as e:
-            # Generate a summary for the document
-            manager_id = get_manager_by_gemini(category)
+            job = IngestionJob.objects.select_related('document').get(id=job_id)
+        except (IngestionJob.DoesNotExist, ValidationError):
+            return Response({'message': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
 
+        if job.owner_id != user_id and get_user_role(token) != 'admin':
+            return Response({'message': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
 
+        data = IngestionJobSerializer(job).data
+        if job.document is not None:
+            data['document'] = self.serializer_class(job.document).data
+        return Response(data, status=status.HTTP_200_OK)
 
-        # Create a Document object and save it to the database
-        document = Document.objects.create(
-            owner_id=owner_id,
-            category=category,
-            manager_id=manager_id,
-            summary=summary,
-            file_name=file_name,
-            status="pending"
-        )
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsAdmin | IsManager])
+    def near_duplicates(self, request):
+        """
+        Lists the documents whose text is nearly the same as the given document's
+        (re-scans, lightly edited versions), most similar first. Optional
+        `min_similarity` (0-1, default 0.5). Allowed for Admin and Manager only.
+        """
+        document_id = request.query_params.get('document_id')
+        if not document_id:
+            return Response({'message': 'Document ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            min_similarity = float(request.query_params.get('min_similarity', 0.5))
+        except ValueError:
+            return Response({'message': 'min_similarity must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            document = Document.objects.get(id=document_id)
+        except (Document.DoesNotExist, ValueError):
+            return Response({'message': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+        if document.minhash is None:
+            return Response({'message': 'No signature for this document yet'}, status=status.HTTP_409_CONFLICT)
+
+        matches = find_near_duplicates(from_bytes(document.minhash), threshold=min_similarity, exclude_id=document.id)
+        return Response([
+            {'similarity': round(score, 3), 'document': self.serializer_class(match).data}
+            for match, score in matches
+        ], status=status.HTTP_200_OK)
 
-        serializer = self.serializer_class(document)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
     @action(detail=False, methods=['post'])  
     def get_document(self, request):
+        # By document id, or by file name for older clients; either way the stored file id is used when known
+        document_id = request.data.get('document_id')
         file_name = request.data.get('file_name')
-        file_id = get_file_by_name(file_name)
+        if document_id:
+            document = Document.objects.filter(id=document_id).only(*DOWNLOAD_FIELDS).first()
+            if document is None:
+                return Response({'error': 'File not found.'}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            # The oldest row, like the Drive name lookup (oldest file first)
+            document = Document.objects.filter(
+                file_name=file_name, drive_file_id__isnull=False
+            ).only(*DOWNLOAD_FIELDS).order_by('created_at').first() or Document(file_name=file_name)
+        file_name = document.file_name
+        storage = get_storage(document.storage_backend)
 
-        if not file_id:
+        try:
+            with request_deadline(DOWNLOAD_REQUEST_BUDGET):
+                if document.drive_file_id and document.file_size is not None:
+                    stored_file = {field: getattr(document, field) for field in STORED_FILE_FIELDS}
+                elif document.drive_file_id:
+                    stored_file = storage.stat(document.drive_file_id)
+                else:
+                    # Rows stored before the file id was kept fall back to a lookup by name
+                    stored_file = storage.find(file_name)
+        except StoredFileMissing:
+            stored_file = None
+        except (StorageError, DeadlineExceeded) as error:
+            print(f"An error occurred: {error}")
+            return Response({'error': 'Failed to read the file from storage.'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if stored_file is None:
             return Response({'error': 'File not found.'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Download the file from Google Drive
-        file_io = download_file_from_drive(file_id)
-
-        # Return the file as a download
-
-        response = FileResponse(file_io, as_attachment=True, filename=file_name)
+        file_id, size = stored_file['drive_file_id'], stored_file['file_size'] or 0
+        mime_type, checksum = stored_file['mime_type'], stored_file['checksum']
+
+        byte_range = parse_byte_range(request.headers.get('Range'), size)
+        if byte_range is False:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        first, last = byte_range or (0, size - 1)
+
+        # Files on local storage are served in place; remote ones from the node-local cache when present
+        local_path = storage.local_path(file_id)
+        if local_path is None and not storage.cacheable:
+            # A local file that is gone
+            return Response({'error': 'File not found.'}, status=status.HTTP_404_NOT_FOUND)
+        cached = local_path or file_cache.get(file_id, checksum, served_bytes=last - first + 1)
+        file = None
+        if cached is not None:
+            try:
+                file = open(cached, 'rb')
+            except OSError:
+                if local_path is not None:
+                    # Deleted from local storage since it was looked up
+                    return Response({'error': 'File not found.'}, status=status.HTTP_404_NOT_FOUND)
+                # Evicted from the node cache by another request since the lookup: a miss, read from storage
+        if file is not None and not byte_range:
+            # Whole local file: FileResponse lets the server use sendfile
+            response = FileResponse(file, as_attachment=True, filename=file_name,
+                                    content_type=mime_type or 'application/pdf')
+            response['Accept-Ranges'] = 'bytes'
+            return response
+        if file is not None:
+            chunks = iter_range(file, first, last)
+        elif byte_range:
+            chunks = storage.stream(file_id, first, last)
+        else:
+            # Forward the remote file chunk by chunk (memory stays at one chunk, the first bytes go out
+            # right away) and keep a copy in the local cache for the next request
+            chunks = file_cache.tee(file_id, checksum, storage.stream(file_id, first, last))
+        try:
+            # Read the first chunk now: a missing file gets a 404, not 200 headers and a cut body
+            chunks = itertools.chain([next(chunks, b'')], chunks) if size else iter(())
+        except (StoredFileMissing, FileNotFoundError):
+            return Response({'error': 'File not found.'}, status=status.HTTP_404_NOT_FOUND)
+        except (StorageError, OSError) as error:
+            print(f"An error occurred: {error}")
+            return Response({'error': 'Failed to read the file from storage.'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        response = StreamingHttpResponse(
+            chunks,
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+            content_type=mime_type or 'application/pdf',
+        )
+        response['Content-Length'] = str(last - first + 1)
+        response['Accept-Ranges'] = 'bytes'
+        if byte_range:
+            response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Disposition'] = content_disposition_header(True, file_name)
         return response
         
     @action(detail=False, methods=['post'])
     def integrateOldDocument(self, request):
         """
         Integrates an existing document into the system by creating a new Document record.
-        Fetches the document from Google Drive by its file ID.
+        Fetches the document from the configured storage backend by its file name.
         Allowed for Admin and Manager only.
         """
         print("Integrating old document...")
 
-        # Get the Google Drive file ID and file name from the request
+        # Get the file name from the request
         file_name = request.data.get('file_name')
 
         if not file_name:
             return Response({'error': 'File name is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Download the file from Google Drive
-        # Save the file temporarily
-        file_io = get_old_file_by_name(file_name)
-
-        if not file_io:
-            return Response({'error': 'Failed to download file from Google Drive.'},
+        # Download the file (Drive: into a spooled buffer, local storage: memory-mapped) and keep its id
+        storage = get_storage()
+        file_io = None
+        try:
+            with request_deadline(DOWNLOAD_REQUEST_BUDGET):
+                stored_file = storage.find(file_name)
+                if stored_file is not None:
+                    file_io = storage.get(stored_file['drive_file_id'])
+        except (StorageError, DeadlineExceeded) as error:
+            print(f"An error occurred: {error}")
+
+        if file_io is None:
+            return Response({'error': f'Failed to download file from {STORAGE_BACKEND} storage.'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Save the downloaded file to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file.write(file_io.read())  # Write the content (binary data) to the temp file
-            temp_file_path = temp_file.name
-
         # Metadata for the document
         owner_id = request.data.get('owner_id', 1)  # Default owner to admin
         category = request.data.get('category', 'Uncategorized')  # Default to 'Uncategorized'
         manager_id = request.data.get('manager_id', 1)  # Default manager to admin
         status_field = request.data.get('status', 'pending')  # Default status
 
-        # Extract summary and classify the document
-        summary = summarize_document(extract_text_from_pdf(temp_file_path))
-
-        # Create and save the Document object
-        document = Document.objects.create(
-            owner_id=owner_id,
-            category=category,
-            manager_id=manager_id,
-            summary=summary,
-            file_name=file_name,
-            status=status_field
-        )
+        # Hash, extract, summarize and index like an upload; the buffer (and its disk rollover) is freed right after
+        with file_io:
+            document, created = integrate_document(
+                file_io, stored_file, file_name, owner_id, category, manager_id, status_field
+            )
 
+        if not created:
+            print(f"Document '{file_name}' was already integrated as document {document.id}.")
+            return Response(self.serializer_class(document).data, status=status.HTTP_200_OK)
         print(f"Document '{file_name}' integrated successfully.")
         serializer = self.serializer_class(document)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -398,6 +517,28 @@ class DocumentViewSet(viewsets.ModelViewSet):
 
         return Response(top_managers, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsAdmin])
+    def performance_stats(self, request):
+        """
+        Reports per-process pipeline statistics: resident ML models, caches, workers and token budgets.
+        """
+        return Response({
+            "models": registry.stats(),
+            "text_cache": text_cache.stats(),
+            "pdf_extraction": {**extraction_stats.snapshot(), "process_pool": extraction_pool.stats()},
+            "ingestion_workers": worker_pool.stats(),
+            "text_preparation": preparation_stats.snapshot(),
+            "summary_cache": summary_cache.stats(),
+            "gemini": get_gemini_client().stats(),
+            "drive": drive_client.stats(),
+            "file_cache": file_cache.stats(),
+            "storage_backend": STORAGE_BACKEND,
+            "hedging": {
+                drive_lookup_hedger.name: drive_lookup_hedger.stats(),
+                summary_hedger.name: summary_hedger.stats(),
+            },
+        }, status=status.HTTP_200_OK)
+
 class GraphqlView(GraphQLView):
     schema = schema
     @csrf_exempt
@@ -183,6 +183,9 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Uploads up to this size are kept in memory, larger ones are streamed to a temporary file
+FILE_UPLOAD_MAX_MEMORY_SIZE = config('UPLOAD_MEMORY_MAX_BYTES', default=5 * 1024 * 1024, cast=int)
+
 # PYJWT Settings
 
 JWT_SECRET_KEY = config('JWT_SECRET_KEY')